@@ -0,0 +1,213 @@
+'''
+Asynchronous front-end of the File System.
+'''
+import sys
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from Settings import Settings
+
+
+class CancelledError(Exception):
+    "The operation was cancelled before it started"
+    pass
+
+
+class Operation(object):
+    '''
+    Pending result of a File System call, with the interface of a
+    concurrent.futures Future. An operation can only be cancelled while it
+    is waiting to run: once started it always completes, so cancelling
+    never leaves a directory or a file half written.
+    '''
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.__condition = threading.Condition()
+        self.__state = 'pending'
+        self.__result = None
+        self.__error = None
+        self.__callbacks = list()
+
+    def cancel(self):
+        "Cancels the operation if it didn't start, returns True if it was cancelled"
+        with self.__condition:
+            if self.__state == 'cancelled':
+                return True
+            if self.__state != 'pending':
+                return False
+            self.__state = 'cancelled'
+            self.__condition.notify_all()
+        self.__run_callbacks()
+        return True
+
+    def cancelled(self):
+        "True if the operation was cancelled"
+        return self.__state == 'cancelled'
+
+    def running(self):
+        "True if the operation is running"
+        return self.__state == 'running'
+
+    def done(self):
+        "True if the operation finished or was cancelled"
+        return self.__state in ('finished', 'cancelled')
+
+    def result(self, timeout=None):
+        '''
+        Waits up to "timeout" seconds (forever by default) for the operation
+        and returns its result or raises its error.
+        '''
+        self.__wait(timeout)
+        if self.__error is not None:
+            raise self.__error[0], self.__error[1], self.__error[2]
+        return self.__result
+
+    def exception(self, timeout=None):
+        "Waits like result() and returns the error raised by the operation, None if there is none"
+        self.__wait(timeout)
+        return self.__error[1] if self.__error is not None else None
+
+    def add_done_callback(self, callback):
+        '''
+        Calls callback(operation) when the operation is done, right away if it
+        already is. Callbacks run in the thread that completes the operation.
+        '''
+        with self.__condition:
+            if not self.done():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def run(self):
+        "Runs the operation unless it was cancelled, called by the executor"
+        with self.__condition:
+            if self.__state != 'pending':
+                return
+            self.__state = 'running'
+        try:
+            self.__result = self.function(*self.args, **self.kwargs)
+        except Exception:
+            self.__error = sys.exc_info()
+        with self.__condition:
+            self.__state = 'finished'
+            self.__condition.notify_all()
+        self.__run_callbacks()
+
+    def __wait(self, timeout):
+        with self.__condition:
+            if not self.done():
+                self.__condition.wait(timeout)
+            if self.__state == 'cancelled':
+                raise CancelledError()
+            if self.__state != 'finished':
+                raise TimeoutError("The operation didn't finish in {0} seconds".format(timeout))
+
+    def __run_callbacks(self):
+        callbacks, self.__callbacks = self.__callbacks, list()
+        for callback in callbacks:
+            callback(self)
+
+
+class AsyncFileSystem(object):
+    '''
+    Runs the File System operations on a bounded pool of "max_in_flight"
+    threads, every call returns at once an Operation with its result.
+    Further calls wait in the queue of the pool. The File System is shared,
+    with its caches, through a handle(), so the AsyncFileSystem has its own
+    working directory:
+
+        with AsyncFileSystem(file_system) as async_fs:
+            operation = async_fs.write("/a.txt", data)
+            operation.add_done_callback(on_written)
+    '''
+
+    def __init__(self, file_system, max_in_flight=Settings.async_max_in_flight):
+        if max_in_flight < 1:
+            raise ValueError("At least one operation must be allowed in flight")
+        self.file_system = file_system.handle()
+        self.max_in_flight = max_in_flight
+        self.__pool = ThreadPool(max_in_flight)
+        self.__closed = False
+
+    def submit(self, function, *args, **kwargs):
+        "Queues function(*args, **kwargs) and returns its Operation"
+        if self.__closed:
+            raise ValueError("The AsyncFileSystem is closed")
+        operation = Operation(function, args, kwargs)
+        self.__pool.apply_async(operation.run)
+        return operation
+
+    def open(self, path, mode='rb', extents=None):
+        "Opens the file, the Operation result is the file-like object (see FileSystem.open)"
+        return self.submit(self.file_system.open, path, mode, extents)
+
+    def read(self, source, size=-1):
+        '''
+        Reads up to "size" bytes (the whole file by default) from a file
+        opened by open() or from the file at the path "source".
+        '''
+        if hasattr(source, 'read'):
+            return self.submit(source.read, size)
+        return self.submit(self.__read_path, source, size)
+
+    def write(self, target, data, append=False, extents=None):
+        '''
+        Writes the data to a file opened by open() or to the file at the path
+        "target", which is closed afterwards. Unlike FileSystem.write_file
+        the errors are raised by the Operation.
+        '''
+        if hasattr(target, 'write'):
+            return self.submit(target.write, data)
+        return self.submit(self.__write_path, target, data, append, extents)
+
+    def close_file(self, file_object):
+        "Closes a file opened by open(), a writer updates its inode"
+        return self.submit(file_object.close)
+
+    def create_file(self, file_name, extents=None):
+        return self.submit(self.file_system.create_file, file_name, extents)
+
+    def create_directory(self, directory_name):
+        return self.submit(self.file_system.create_directory, directory_name)
+
+    def list_files(self, inode_id=-1):
+        "The Operation result is the sorted names of the files in the directory"
+        return self.submit(self.file_system.list_names, inode_id)
+
+    def remove_file(self, file_name):
+        return self.submit(self.file_system.remove_file, file_name)
+
+    def remove_directory(self, dir_name):
+        return self.submit(self.file_system.remove_directory, dir_name)
+
+    def flush(self):
+        return self.submit(self.file_system.flush)
+
+    def close(self, wait=True):
+        '''
+        Stops accepting operations, the queued ones still run. Waits for
+        them to finish if "wait" is set.
+        '''
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__pool.close()
+        if wait:
+            self.__pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __read_path(self, path, size):
+        with self.file_system.open(path) as file_reader:
+            return file_reader.read(size)
+
+    def __write_path(self, path, data, append, extents):
+        with self.file_system.open(path, 'ab' if append else 'wb', extents) as file_writer:
+            file_writer.write(data)
@@ -1,9 +1,15 @@
 """
  Author: Cesar Bonilla
 """
+import logging
 import os
 import sys
 from FileSystem import FileSystem
+from Transfer import Transfer
+from utilities import format_stats, format_statfs, format_transfer
+
+logging.basicConfig(format='%(message)s',
+                    level=logging.DEBUG if '-v' in sys.argv else logging.WARNING)
 
 new_fs = False
 file_path = "FS.ext2"
@@ -57,8 +63,30 @@ with open(file_path, "r+b") as fs_file:
             file_system.remove_directory(cmd[1])
         elif cmd[0] == "rm":
             file_system.remove_file(cmd[1])
+        elif cmd[0] == "stats":
+            if len(cmd) > 1 and cmd[1] == "reset":
+                file_system.reset_stats()
+            else:
+                for line in format_stats(file_system.stats()):
+                    print line
+        elif cmd[0] == "df":
+            for line in format_statfs(file_system.statfs()):
+                print line
+        elif cmd[0] == "import" and len(cmd) > 1:
+            try:
+                report = Transfer(file_system).import_tree(cmd[1], cmd[2] if len(cmd) > 2 else ".")
+                print format_transfer("import", report)
+            except (IOError, OSError, ValueError) as error:
+                print error
+        elif cmd[0] == "export" and len(cmd) > 2:
+            try:
+                print format_transfer("export", Transfer(file_system).export_tree(cmd[1], cmd[2]))
+            except (IOError, OSError, ValueError) as error:
+                print error
         elif cmd[0] == "exit": 
+            file_system.sync()
             break
+        file_system.flush()
 
 
 
@@ -0,0 +1,348 @@
+'''
+Benchmark suite for the core File System operations.
+
+Every workload runs on a freshly created image at increasing scales and
+reports ops/sec, bytes/sec and the I/O calls done on the image. Results
+can be saved as JSON and compared with the ones of another commit:
+
+    python Benchmark.py --output after.json --baseline before.json
+'''
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from BlockDevice import BlockDevice
+from FileSystem import FileSystem
+from Settings import Settings
+
+
+class Benchmark(object):
+    '''
+    Runs the workloads, each one on a new image. The setup of a workload
+    is not measured, the measured part includes flushing the changes.
+    With use_mmap=False every read and write is a seek + read/write
+    system call, so the I/O counters are the system calls done.
+    '''
+    # Bigger workloads are spread in several directories, each one big
+    # enough to need several levels of index
+    files_per_directory = 256
+    append_size = Settings.datablock_size
+    repetitions = 16
+    io_counters = ('reads', 'writes', 'seeks', 'syncs', 'bytes_read', 'bytes_written')
+
+    def __init__(self, scales=(4, 16, 64), use_mmap=True):
+        self.scales = scales
+        self.use_mmap = use_mmap
+        self.workloads = OrderedDict([
+            ('create_file', self.__create_files),
+            ('batch_create_file', self.__batch_create_files),
+            ('create_directory', self.__create_directories),
+            ('write_file', self.__write_files),
+            ('append', self.__append),
+            ('read_file', self.__read_files),
+            ('list_long', self.__list_long),
+            ('deep_cd', self.__deep_cd),
+            ('remove_directory', self.__remove_directory),
+        ])
+
+    def run(self, workloads=None):
+        "Runs the workloads (all by default) at every scale and returns the results"
+        results = list()
+        for name in workloads or self.workloads.keys():
+            if name not in self.workloads:
+                raise ValueError("Unknown workload '{0}'".format(name))
+            for scale in self.scales:
+                results.append(self.run_workload(name, scale))
+        return results
+
+    def run_workload(self, name, scale):
+        '''
+        Runs one workload on a new image and returns its result:
+        {workload, scale, ops, bytes, seconds, ops_per_sec, bytes_per_sec, io}
+        '''
+        handle, path = tempfile.mkstemp(suffix=".ext2")
+        os.close(handle)
+        try:
+            with open(path, "r+b") as fs_file:
+                FileSystem(fs_file, True)._create_file_system()
+                file_system = FileSystem(BlockDevice(fs_file, self.use_mmap))
+                measured = self.workloads[name](file_system, scale)
+                file_system.flush()
+                file_system.reset_stats()
+                with self.__quiet():
+                    start = time.time()
+                    ops, size = measured()
+                    file_system.flush()
+                    seconds = time.time() - start
+                counters = file_system.stats()['counters']
+                file_system.device.close()
+        finally:
+            os.remove(path)
+        seconds = max(seconds, 1e-9)
+        return OrderedDict([
+            ('workload', name),
+            ('scale', scale),
+            ('ops', ops),
+            ('bytes', size),
+            ('seconds', seconds),
+            ('ops_per_sec', ops / seconds),
+            ('bytes_per_sec', size / seconds),
+            ('io', OrderedDict((counter, counters.get(counter, 0))
+                               for counter in Benchmark.io_counters)),
+        ])
+
+    @staticmethod
+    def write_sizes(superblock):
+        '''
+        The sizes of the files written for the geometry of the image: only
+        direct blocks, all the direct blocks, the first indirect block and
+        the first double indirect block (the biggest file without one)
+        '''
+        direct = superblock.direct_blocks
+        last = direct + superblock.max_indirect_blocks
+        if superblock.indirect_levels > 1:
+            last += 1
+        return tuple(blocks * superblock.datablock_size
+                     for blocks in (direct / 2, direct, direct + 1, last))
+
+    @staticmethod
+    @contextmanager
+    def __quiet():
+        "Sends the output of cat and ls to /dev/null"
+        stdout = sys.stdout
+        with open(os.devnull, "w") as devnull:
+            sys.stdout = devnull
+            try:
+                yield
+            finally:
+                sys.stdout = stdout
+
+    def __make_directories(self, file_system, count):
+        "Creates the directories to spread 'count' files, returns their paths"
+        directories = int(math.ceil(float(count) / Benchmark.files_per_directory))
+        for index in xrange(0, directories):
+            file_system.create_directory("d{0}".format(index))
+        return ["/d{0}".format(index) for index in xrange(0, directories)]
+
+    def __file_path(self, index):
+        return "/d{0}/f{1}".format(index / Benchmark.files_per_directory, index)
+
+    def __create_files(self, file_system, scale):
+        directories = self.__make_directories(file_system, scale)
+
+        def measured():
+            for index in xrange(0, scale):
+                if index % Benchmark.files_per_directory == 0:
+                    file_system.change_directory(directories[index / Benchmark.files_per_directory])
+                file_system.create_file("f{0}".format(index))
+            return (scale, 0)
+        return measured
+
+    def __batch_create_files(self, file_system, scale):
+        measured = self.__create_files(file_system, scale)
+
+        def measured_batch():
+            with file_system.batch():
+                return measured()
+        return measured_batch
+
+    def __create_directories(self, file_system, scale):
+        directories = self.__make_directories(file_system, scale)
+
+        def measured():
+            for index in xrange(0, scale):
+                if index % Benchmark.files_per_directory == 0:
+                    file_system.change_directory(directories[index / Benchmark.files_per_directory])
+                file_system.create_directory("s{0}".format(index))
+            return (scale, 0)
+        return measured
+
+    def __write_files(self, file_system, scale):
+        write_sizes = Benchmark.write_sizes(file_system.device.superblock)
+        count = scale * len(write_sizes)
+        self.__make_directories(file_system, count)
+
+        def measured():
+            size = 0
+            for index in xrange(0, count):
+                file_size = write_sizes[index % len(write_sizes)]
+                file_system.write_file(self.__file_path(index), "w" * file_size)
+                size += file_size
+            return (count, size)
+        return measured
+
+    def __append(self, file_system, scale):
+        self.__make_directories(file_system, scale)
+        for index in xrange(0, scale):
+            file_system.write_file(self.__file_path(index), "")
+        appends = Benchmark.write_sizes(file_system.device.superblock)[-1] / Benchmark.append_size
+
+        def measured():
+            for index in xrange(0, scale):
+                for _ in xrange(0, appends):
+                    file_system.write_file(self.__file_path(index), "a" * Benchmark.append_size,
+                                           append=True)
+            return (scale * appends, scale * appends * Benchmark.append_size)
+        return measured
+
+    def __read_files(self, file_system, scale):
+        measured_write = self.__write_files(file_system, scale)
+        count, size = measured_write()
+
+        def measured():
+            for index in xrange(0, count):
+                file_system.read_file(self.__file_path(index))
+            return (count, size)
+        return measured
+
+    def __list_long(self, file_system, scale):
+        entries = min(scale, Benchmark.files_per_directory)
+        file_system.create_directory("big")
+        file_system.change_directory("big")
+        for index in xrange(0, entries):
+            file_system.write_file("f{0}".format(index), "l" * index)
+
+        def measured():
+            for _ in xrange(0, scale):
+                file_system.list_files_long_format()
+            return (scale, 0)
+        return measured
+
+    def __deep_cd(self, file_system, scale):
+        names = ["n{0}".format(level) for level in xrange(0, scale)]
+        for name in names:
+            file_system.create_directory(name)
+            file_system.change_directory(name)
+        file_system.change_directory("/")
+        path = "/" + "/".join(names)
+
+        def measured():
+            for _ in xrange(0, Benchmark.repetitions):
+                file_system.change_directory(path)
+                file_system.change_directory("/")
+            return (Benchmark.repetitions * 2, 0)
+        return measured
+
+    def __remove_directory(self, file_system, scale):
+        file_system.create_directory("tree")
+        file_system.change_directory("tree")
+        self.__make_directories(file_system, scale)
+        for index in xrange(0, scale):
+            file_system.write_file("/tree" + self.__file_path(index), "r" * Settings.datablock_size)
+        file_system.change_directory("/")
+
+        def measured():
+            file_system.remove_directory("tree")
+            return (scale, 0)
+        return measured
+
+
+def get_commit():
+    "Returns the current git commit, None if it is unknown"
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, path, use_mmap=True):
+    "Saves the results as JSON together with the commit and the python version"
+    report = OrderedDict([
+        ('commit', get_commit()),
+        ('date', time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ('python', platform.python_version()),
+        ('mmap', use_mmap),
+        ('results', results),
+    ])
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+
+
+def load_results(path):
+    "Returns the report saved by save_results"
+    with open(path) as report:
+        return json.load(report)
+
+
+def compare_results(baseline, results, tolerance=0.2):
+    '''
+    Compares the results with the baseline ones, returns the regressions as
+    messages: throughput lower than the baseline by more than 'tolerance'
+    or more I/O calls than the baseline (those don't depend on the machine).
+    '''
+    previous = dict(((result['workload'], result['scale']), result) for result in baseline)
+    regressions = list()
+    for result in results:
+        old = previous.get((result['workload'], result['scale']))
+        if old is None:
+            continue
+        name = "{0}[{1}]".format(result['workload'], result['scale'])
+        if result['ops_per_sec'] < old['ops_per_sec'] * (1.0 - tolerance):
+            regressions.append("{0}: {1:.0f} ops/sec, was {2:.0f}".format(
+                name, result['ops_per_sec'], old['ops_per_sec']))
+        for counter in ('reads', 'writes', 'seeks', 'syncs'):
+            if result['io'].get(counter, 0) > old['io'].get(counter, 0):
+                regressions.append("{0}: {1} {2}, was {3}".format(
+                    name, result['io'][counter], counter, old['io'][counter]))
+    return regressions
+
+
+def format_results(results):
+    "Returns the results as printable lines"
+    line = "{0:<18} {1:>6} {2:>8} {3:>12} {4:>14} {5:>8} {6:>8} {7:>8}"
+    lines = [line.format("workload", "scale", "ops", "ops/sec", "bytes/sec",
+                         "reads", "writes", "seeks")]
+    for result in results:
+        lines.append(line.format(result['workload'], result['scale'], result['ops'],
+                                 "{0:.1f}".format(result['ops_per_sec']),
+                                 "{0:.1f}".format(result['bytes_per_sec']),
+                                 result['io']['reads'], result['io']['writes'],
+                                 result['io']['seeks']))
+    return lines
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="File System benchmarks")
+    parser.add_argument("--scales", default="4,16,64",
+                        help="comma separated scales, default: 4,16,64")
+    parser.add_argument("--workloads", default=None,
+                        help="comma separated workloads, default: all")
+    parser.add_argument("--no-mmap", action="store_true",
+                        help="access the image with read/write system calls")
+    parser.add_argument("--output", help="saves the results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed throughput loss against the baseline, default: 0.2")
+    args = parser.parse_args(argv)
+    scales = [int(scale) for scale in args.scales.split(",")]
+    workloads = args.workloads.split(",") if args.workloads else None
+    benchmark = Benchmark(scales, not args.no_mmap)
+    results = benchmark.run(workloads)
+    for line in format_results(results):
+        print line
+    if args.output:
+        save_results(results, args.output, benchmark.use_mmap)
+    if args.baseline:
+        baseline = load_results(args.baseline)
+        if baseline['mmap'] != benchmark.use_mmap:
+            print "The baseline was run with mmap={0}, results can't be compared".format(
+                baseline['mmap'])
+            return 2
+        regressions = compare_results(baseline['results'], results, args.tolerance)
+        for regression in regressions:
+            print "REGRESSION " + regression
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,120 @@
+'''
+Resident allocation bitmap shared by the Cluster and Inode tables.
+A set bit means the element is free, a cleared bit means it is in use.
+'''
+from bitarray import bitarray
+
+
+class Bitmap(object):
+    '''
+    Keeps an on-disk bitmap loaded in memory and writes back only the
+    bytes that changed since the last flush.
+    '''
+
+    def __init__(self, device, offset, size):
+        self.device = device
+        self.offset = offset
+        self.size = size
+        self.__data = None
+        self.__dirty = set()
+
+    def load(self):
+        '''
+        Reads the whole bitmap from disk, discarding any unflushed change.
+        '''
+        self.device.metrics.count('bitmap_loads')
+        self.__data = bitarray()
+        self.__data.frombytes(self.device.read(self.offset, self.size))
+        self.__dirty.clear()
+
+    @property
+    def data(self):
+        "The resident bitarray, loaded on first use."
+        if self.__data is None:
+            self.load()
+        return self.__data
+
+    def first_free(self, start=0, stop=None):
+        '''
+        Returns the index of the first free element in [start, stop).
+        Raises ValueError if there is none.
+        '''
+        if stop is None:
+            stop = len(self.data)
+        self.device.metrics.count('bitmap_scans')
+        return self.data.index(True, start, stop)
+
+    def free_runs(self, start=0, stop=None):
+        '''
+        Yields the runs of free elements in [start, stop) as (first_index, length).
+        '''
+        if stop is None:
+            stop = len(self.data)
+        self.device.metrics.count('bitmap_scans')
+        position = start
+        while position < stop:
+            try:
+                run_start = self.data.index(True, position, stop)
+            except ValueError:
+                return
+            try:
+                run_end = self.data.index(False, run_start, stop)
+            except ValueError:
+                run_end = stop
+            yield (run_start, run_end - run_start)
+            position = run_end
+
+    def count_free(self, start=0, stop=None):
+        "Returns how many elements in [start, stop) are free"
+        self.device.metrics.count('bitmap_scans')
+        if start == 0 and stop is None:
+            return self.data.count(True)
+        return self.data[start:stop].count(True)
+
+    def is_free(self, index):
+        "Returns True if the element is free"
+        return self.data[index]
+
+    def set_state(self, index, state):
+        '''
+        Sets the element state (1 => free, 0 => occupied) in memory and
+        marks its byte as dirty. Returns the change of free elements.
+        '''
+        freed = int(bool(state)) - int(self.data[index])
+        self.data[index] = state
+        self.__dirty.add(index // 8)
+        return freed
+
+    def set_range(self, start, count, state):
+        "Sets the state of 'count' elements from start, like set_state"
+        if start < 0 or start + count > len(self.data):
+            raise IndexError("bitmap index out of range")
+        if count <= 0:
+            return 0
+        free_before = self.data[start:start + count].count(True)
+        self.data[start:start + count] = bool(state)
+        self.__dirty.update(xrange(start // 8, (start + count - 1) // 8 + 1))
+        return (count if state else 0) - free_before
+
+    def is_dirty(self):
+        "Returns True if there are changes that were not written back"
+        return len(self.__dirty) > 0
+
+    def flush(self):
+        '''
+        Writes back the dirty bytes, one write per run of adjacent bytes.
+        '''
+        if not self.__dirty:
+            return
+        dirty = sorted(self.__dirty)
+        run_start = dirty[0]
+        run_end = run_start
+        for byte_index in dirty[1:] + [None]:
+            if byte_index == run_end + 1:
+                run_end = byte_index
+                continue
+            self.device.write(self.offset + run_start,
+                              self.__data[run_start * 8:(run_end + 1) * 8].tobytes())
+            if byte_index is not None:
+                run_start = run_end = byte_index
+        self.__dirty.clear()
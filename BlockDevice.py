@@ -0,0 +1,258 @@
+'''
+Block device layer used to access the File System image.
+'''
+import mmap
+import os
+import threading
+from BufferCache import BufferCache
+from Metrics import Metrics
+from Settings import Settings
+from SuperBlock import SuperBlock
+from WriteBuffer import WriteBuffer
+
+
+class BlockDevice(object):
+    '''
+    Positional access to the File System image. The image is memory mapped,
+    so reads and writes are memory copies instead of seek + read/write
+    calls. When the image can't be mapped (e.g. an empty file that is
+    going to be formatted) the plain file object is used.
+    The I/O counters are kept in "metrics" and the geometry of the image in
+    "superblock", both shared by the File System components that use the device.
+    Between begin_batch() and end_batch() the writes to a not mapped image
+    are kept in memory and written out in offset order when the batch ends
+    (or when more than "batch_buffer_size" bytes are pending).
+    Reads and writes can come from several threads: slicing the map is
+    positional, the seek + read/write of a not mapped image (python 2 has
+    no pread/pwrite) and the write buffer are guarded by a lock.
+    The data blocks read with read_blocks() and readahead() are kept in a
+    buffer cache of "cache_size" bytes, every write updates it.
+    '''
+
+    def __init__(self, file_object, use_mmap=True, metrics=None,
+                 batch_buffer_size=Settings.batch_buffer_size,
+                 cache_size=Settings.buffer_cache_size):
+        self.file_object = file_object
+        self.use_mmap = use_mmap
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.batch_buffer_size = batch_buffer_size
+        self.batch_depth = 0
+        self.cache_size = cache_size
+        self.__cache = None
+        self.__buffer = WriteBuffer()
+        self.__map = None
+        self.__lock = threading.RLock()
+        self.remap()
+        self.superblock = SuperBlock.read(self)
+
+    def remap(self):
+        '''
+        Maps the whole image again, needed after the image changes its size.
+        '''
+        with self.__lock:
+            self.__write_buffer()
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+            self.file_object.flush()
+            size = os.fstat(self.file_object.fileno()).st_size
+            if self.use_mmap and size > 0:
+                # Images opened read only are mapped read only
+                access = mmap.ACCESS_READ if getattr(self.file_object, 'mode', 'r+') == 'rb' \
+                    else mmap.ACCESS_WRITE
+                try:
+                    self.__map = mmap.mmap(self.file_object.fileno(), size, access=access)
+                except (EnvironmentError, ValueError):
+                    self.__map = None
+
+    @property
+    def cache(self):
+        "The buffer cache, created again when the block size changes"
+        if self.__cache is None or self.__cache.block_size != self.superblock.datablock_size:
+            self.__cache = BufferCache(self.superblock.datablock_size, self.cache_size)
+        return self.__cache
+
+    def is_mapped(self):
+        "Returns True if the image is memory mapped"
+        return self.__map is not None
+
+    def size(self):
+        "Returns the image size in bytes"
+        with self.__lock:
+            if self.__map is not None:
+                return len(self.__map)
+            self.file_object.flush()
+            return max(os.fstat(self.file_object.fileno()).st_size, self.__buffer.end())
+
+    def read(self, offset, size):
+        "Returns a copy of 'size' bytes starting at 'offset'"
+        self.metrics.count('reads')
+        self.metrics.count('bytes_read', size)
+        if self.__map is not None:
+            return self.__map[offset:offset + size]
+        self.metrics.count('seeks')
+        with self.__lock:
+            self.file_object.seek(offset)
+            data = self.file_object.read(size)
+            if len(self.__buffer):
+                data = self.__buffer.overlay(offset, data, size)
+        return data
+
+    def view(self, offset, size):
+        '''
+        Returns a read only buffer over 'size' bytes starting at 'offset',
+        the bytes are not copied when the image is mapped.
+        '''
+        if self.__map is not None:
+            self.metrics.count('reads')
+            self.metrics.count('bytes_read', size)
+            return buffer(self.__map, offset, size)
+        return buffer(self.read(offset, size))
+
+    def read_blocks(self, block_id, count=1):
+        '''
+        Returns the data blocks "block_id" to "block_id" + count - 1 through
+        the buffer cache, the missing ones are read with one read per run.
+        Reads bigger than the cache bypass it.
+        '''
+        block_size = self.superblock.datablock_size
+        cache = self.cache
+        if count > cache.max_blocks:
+            return self.read(self.superblock.cluster_offset(block_id), count * block_size)
+        blocks = [cache.get(cached_id) for cached_id in xrange(block_id, block_id + count)]
+        position = 0
+        while position < count:
+            if blocks[position] is not None:
+                position += 1
+                continue
+            end = position
+            while end < count and blocks[end] is None:
+                end += 1
+            data = self.__read_to_cache(block_id + position, end - position)
+            for index in xrange(position, end):
+                blocks[index] = data[(index - position) * block_size:
+                                     (index - position + 1) * block_size]
+            position = end
+        return ''.join(blocks)
+
+    def readahead(self, runs):
+        '''
+        Reads the (first cluster, length) runs into the buffer cache, one
+        read per run of blocks that are not cached yet.
+        '''
+        cache = self.cache
+        for run_start, run_len in runs:
+            position = run_start
+            while position < run_start + run_len:
+                if cache.contains(position):
+                    position += 1
+                    continue
+                end = position
+                while end < run_start + run_len and not cache.contains(end):
+                    end += 1
+                self.__read_to_cache(position, end - position)
+                self.metrics.count('readahead_blocks', end - position)
+                position = end
+
+    def __read_to_cache(self, block_id, count):
+        "Reads the blocks and adds them to the buffer cache"
+        stamp = self.cache.stamp()
+        data = self.read(self.superblock.cluster_offset(block_id),
+                         count * self.superblock.datablock_size)
+        self.cache.fill(block_id, data, stamp)
+        return data
+
+    def write(self, offset, data):
+        "Writes the data starting at 'offset'"
+        if self.batch_depth and self.__map is None:
+            self.metrics.count('buffered_writes')
+            with self.__lock:
+                self.__buffer.write(offset, data)
+                if self.__buffer.size > self.batch_buffer_size:
+                    self.__write_buffer()
+        else:
+            self.metrics.count('writes')
+            self.metrics.count('bytes_written', len(data))
+            if self.__map is not None:
+                self.__map[offset:offset + len(data)] = data
+            else:
+                self.metrics.count('seeks')
+                with self.__lock:
+                    self.file_object.seek(offset)
+                    self.file_object.write(data)
+        # After the write, so a read that started before can't cache the old data
+        region_offset = self.superblock.datablock_region_offset
+        if offset + len(data) > region_offset:
+            if offset < region_offset:
+                data = data[region_offset - offset:]
+                offset = region_offset
+            block_id, block_offset = divmod(offset - region_offset, self.superblock.datablock_size)
+            self.cache.write(block_id, block_offset, data)
+
+    def begin_batch(self):
+        "Starts buffering the writes, batches can be nested"
+        with self.__lock:
+            self.batch_depth += 1
+
+    def end_batch(self):
+        '''
+        Ends the batch, when the outermost batch ends the buffered writes
+        are written in offset order.
+        '''
+        with self.__lock:
+            if self.batch_depth == 0:
+                raise ValueError("There is no batch to end")
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.__write_buffer()
+
+    def __write_buffer(self):
+        "Writes the buffered writes, one write per extent"
+        with self.__lock:
+            for offset, data in self.__buffer.extents():
+                self.metrics.count('writes')
+                self.metrics.count('bytes_written', len(data))
+                self.metrics.count('seeks')
+                self.file_object.seek(offset)
+                self.file_object.write(data)
+            self.__buffer.clear()
+
+    def resize(self, size):
+        '''
+        Changes the image size, the new bytes are zeros and take no disk space
+        until they are written.
+        '''
+        with self.__lock:
+            self.__write_buffer()
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+            self.file_object.flush()
+            os.ftruncate(self.file_object.fileno(), size)
+            self.remap()
+            self.cache.clear()
+
+    def flush(self):
+        "Hands the pending writes to the operating system"
+        with self.__lock:
+            if self.__map is None:
+                self.file_object.flush()
+
+    def sync(self):
+        "Forces the pending writes to the storage device"
+        with self.__lock:
+            self.metrics.count('syncs')
+            self.__write_buffer()
+            if self.__map is not None:
+                self.__map.flush()
+            else:
+                self.file_object.flush()
+            os.fsync(self.file_object.fileno())
+
+    def close(self):
+        "Unmaps the image, the file object is left open"
+        with self.__lock:
+            self.__write_buffer()
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
@@ -0,0 +1,271 @@
+'''
+Module to map the logical blocks of an inode to clusters.
+'''
+from utilities import to_runs
+
+
+class BlockMap(object):
+    '''
+    Maps the logical blocks of an inode to clusters like ext2: the first
+    blocks use the direct pointers of i_blocks, the next ones go through the
+    single, double and triple indirect blocks pointed by the last pointers
+    of i_blocks. Images without superblock have 14 direct pointers and a
+    single indirect one.
+    Indirect blocks are read once and cached, the changed ones are written
+    by store(). The cache and the pending changes are dropped when i_blocks
+    is replaced, which is how the blocks of a file are moved (see
+    FileSystem.relocate_inode).
+    '''
+
+    def __init__(self, inode_table, cluster_table, inode):
+        superblock = inode_table.superblock
+        self.inode_table = inode_table
+        self.cluster_table = cluster_table
+        self.inode = inode
+        self.direct_blocks = superblock.direct_blocks
+        self.levels = superblock.indirect_levels
+        # Pointers stored in an indirect block
+        self.indirect_blocks = superblock.max_indirect_blocks
+        self.max_blocks = self.direct_blocks + sum(
+            self.indirect_blocks ** level for level in xrange(1, self.levels + 1))
+        self.__indirect = dict()
+        self.__dirty = set()
+        self.__i_blocks = inode.i_blocks
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __path(self, logical_block):
+        '''
+        Returns the path to the logical block: the position in i_blocks
+        followed by the position inside every indirect block.
+        '''
+        if logical_block < self.direct_blocks:
+            return (logical_block,)
+        remaining = logical_block - self.direct_blocks
+        for level in xrange(1, self.levels + 1):
+            span = self.indirect_blocks ** level
+            if remaining < span:
+                path = [self.direct_blocks + level - 1]
+                for depth in xrange(level - 1, -1, -1):
+                    path.append(remaining / self.indirect_blocks ** depth % self.indirect_blocks)
+                return tuple(path)
+            remaining -= span
+        raise IOError("File is too big for the file system")
+
+    def __is_indirect(self, path):
+        "True if the path leads to an indirect block instead of a data block"
+        return path[0] >= self.direct_blocks and len(path) <= path[0] - self.direct_blocks + 1
+
+    def __check_i_blocks(self):
+        "Forgets the indirect blocks of the previous i_blocks if it was replaced"
+        if self.inode.i_blocks is not self.__i_blocks:
+            self.__i_blocks = self.inode.i_blocks
+            self.__indirect.clear()
+            self.__dirty.clear()
+
+    def __read_indirect(self, block_id):
+        "Returns the pointers of the indirect block, reading it only once"
+        self.__check_i_blocks()
+        pointers = self.__indirect.get(block_id)
+        if pointers is None:
+            self.cache_misses += 1
+            pointers = self.inode_table.get_indirect_blocks(block_id)
+            self.__indirect[block_id] = pointers
+        else:
+            self.cache_hits += 1
+        return pointers
+
+    def __walk(self, path):
+        '''
+        Follows the path and returns the block ids found at every step,
+        0 from the first pointer that is not assigned.
+        '''
+        block_id = self.inode.i_blocks[path[0]]
+        blocks = [block_id]
+        for index in path[1:]:
+            block_id = self.__read_indirect(block_id)[index] if block_id != 0 else 0
+            blocks.append(block_id)
+        return blocks
+
+    def __set_pointer(self, path, block_id):
+        "Stores block_id at the end of the path, whose parents must be assigned"
+        if len(path) == 1:
+            self.inode.i_blocks[path[0]] = block_id
+            return
+        parent_id = self.__walk(path[:-1])[-1]
+        self.__read_indirect(parent_id)[path[-1]] = block_id
+        self.__dirty.add(parent_id)
+
+    def get_blocks(self, count, first=0):
+        '''
+        Returns the ids of the data blocks "first" to "count" - 1 of the inode,
+        0 means the block is not assigned yet.
+        '''
+        blocks = list()
+        logical_block = first
+        while logical_block < count:
+            path = self.__path(logical_block)
+            if len(path) == 1:
+                blocks.append(self.inode.i_blocks[path[0]])
+                logical_block += 1
+                continue
+            # The next pointers of the same indirect block are taken at once
+            parent_id = self.__walk(path[:-1])[-1]
+            run = min(count - logical_block, self.indirect_blocks - path[-1])
+            if parent_id == 0:
+                blocks += [0] * run
+            else:
+                blocks += self.__read_indirect(parent_id)[path[-1]:path[-1] + run]
+            logical_block += run
+        return blocks
+
+    def get_runs(self, count, first=0):
+        '''
+        Returns the data blocks "first" to "count" - 1 as (first cluster, length)
+        runs of contiguous clusters.
+        '''
+        return to_runs(self.get_blocks(count, first))
+
+    def map_blocks(self, count, first=0):
+        '''
+        Makes sure the data blocks "first" to "count" - 1 of the inode are
+        assigned and returns their ids. All the missing blocks, including the
+        indirect ones, are requested to the cluster table in a single
+        allocation placed right after the last assigned block.
+        '''
+        if count > self.max_blocks:
+            raise IOError("File is too big for the file system")
+        self.__check_i_blocks()
+        pending = list()
+        pending_paths = set()
+        goal = None
+        for logical_block in xrange(first, count):
+            path = self.__path(logical_block)
+            blocks = self.__walk(path)
+            for depth, block_id in enumerate(blocks):
+                if block_id == 0 and path[:depth + 1] not in pending_paths:
+                    pending.append(path[:depth + 1])
+                    pending_paths.add(path[:depth + 1])
+            if blocks[-1] != 0 and not pending:
+                goal = blocks[-1] + 1
+        for path, block_id in zip(pending, self.cluster_table.allocate(len(pending), goal)):
+            if self.__is_indirect(path):
+                self.__indirect[block_id] = [0] * self.indirect_blocks
+                self.__dirty.add(block_id)
+            self.__set_pointer(path, block_id)
+        return self.get_blocks(count, first)
+
+    def map_runs(self, count, first=0):
+        '''
+        Like map_blocks, but returns the blocks as (first cluster, length) runs.
+        '''
+        return to_runs(self.map_blocks(count, first))
+
+    def unmap_block(self, logical_block):
+        '''
+        Frees the data block and leaves the logical block unassigned, the
+        indirect blocks are kept.
+        '''
+        path = self.__path(logical_block)
+        block_id = self.__walk(path)[-1]
+        if block_id != 0:
+            self.__set_pointer(path, 0)
+            self.cluster_table.release([(block_id, 1)])
+
+    def cluster_runs(self, count):
+        '''
+        Returns the clusters used by the first "count" data blocks, the data
+        blocks and the indirect blocks that point to them, as (first cluster, length) runs.
+        '''
+        data_blocks = list()
+        indirect_blocks = list()
+        seen = set()
+        for logical_block in xrange(0, count):
+            blocks = self.__walk(self.__path(logical_block))
+            if blocks[-1] != 0:
+                data_blocks.append(blocks[-1])
+            for block_id in blocks[:-1]:
+                if block_id != 0 and block_id not in seen:
+                    seen.add(block_id)
+                    indirect_blocks.append(block_id)
+        return to_runs(data_blocks) + to_runs(indirect_blocks)
+
+    def owned_runs(self):
+        '''
+        Returns every cluster the inode points to, the data blocks past
+        i_size included, as (first cluster, length) runs. Only the assigned
+        indirect blocks are read.
+        '''
+        data_blocks = [block_id for block_id in self.inode.i_blocks[:self.direct_blocks]
+                       if block_id != 0]
+        indirect_blocks = list()
+        for level in xrange(1, self.levels + 1):
+            self.__collect(self.inode.i_blocks[self.direct_blocks + level - 1], level,
+                           data_blocks, indirect_blocks)
+        return to_runs(data_blocks) + to_runs(indirect_blocks)
+
+    def __collect(self, block_id, level, data_blocks, indirect_blocks):
+        "Adds the blocks under the indirect block of the given level"
+        if block_id == 0:
+            return
+        indirect_blocks.append(block_id)
+        for pointer in self.__read_indirect(block_id):
+            if pointer == 0:
+                continue
+            if level == 1:
+                data_blocks.append(pointer)
+            else:
+                self.__collect(pointer, level - 1, data_blocks, indirect_blocks)
+
+    def truncate(self, count):
+        '''
+        Frees the data blocks from "count" on, the first block is always
+        kept, and the indirect blocks left without pointers.
+        '''
+        count = max(count, 1)
+        freed = list()
+        for position in xrange(count, self.direct_blocks):
+            if self.inode.i_blocks[position] != 0:
+                freed.append(self.inode.i_blocks[position])
+                self.inode.i_blocks[position] = 0
+        first = self.direct_blocks
+        for level in xrange(1, self.levels + 1):
+            position = self.direct_blocks + level - 1
+            block_id = self.inode.i_blocks[position]
+            if block_id != 0 and self.__prune(block_id, level, first, count, freed):
+                freed.append(block_id)
+                self.inode.i_blocks[position] = 0
+            first += self.indirect_blocks ** level
+        self.cluster_table.release(to_runs(sorted(freed)))
+
+    def __prune(self, block_id, level, first, count, freed):
+        '''
+        Frees the blocks from "count" on under the indirect block of the
+        given level, whose first logical block is "first". Returns True if
+        the indirect block is left empty, then the caller frees it.
+        '''
+        pointers = self.__read_indirect(block_id)
+        span = self.indirect_blocks ** (level - 1)
+        for index, pointer in enumerate(pointers):
+            child_first = first + index * span
+            if pointer == 0 or child_first + span <= count:
+                continue
+            if level == 1 or self.__prune(pointer, level - 1, child_first, count, freed):
+                freed.append(pointer)
+                pointers[index] = 0
+                self.__dirty.add(block_id)
+                self.__dirty.discard(pointer)
+        if any(pointers):
+            return False
+        self.__dirty.discard(block_id)
+        return True
+
+    def store(self):
+        '''
+        Writes the indirect blocks whose pointers changed. The pointers in
+        i_blocks are part of the inode, which is written by the caller.
+        '''
+        self.__check_i_blocks()
+        for block_id in sorted(self.__dirty):
+            self.inode_table.set_indirect_blocks(block_id, self.__indirect[block_id])
+        self.__dirty.clear()
@@ -0,0 +1,110 @@
+'''
+Cache of the data blocks read from the File System image.
+'''
+import threading
+from collections import OrderedDict
+from Settings import Settings
+
+
+class BufferCache(object):
+    '''
+    LRU cache of data blocks keyed by cluster id, it holds up to "capacity"
+    bytes of blocks of "block_size" bytes. A capacity of 0 disables it.
+
+    Writes update the cached blocks (whole blocks are cached, partial writes
+    patch the cached copy), so the cache never holds stale data. Blocks
+    read from the image are added with fill(), which drops them if a write
+    happened since the read started: the stamp() taken before the read
+    tells it. It can be shared by several threads.
+    '''
+
+    def __init__(self, block_size, capacity=Settings.buffer_cache_size):
+        self.block_size = block_size
+        self.capacity = max(0, capacity)
+        self.max_blocks = self.capacity / block_size
+        self.__blocks = OrderedDict()
+        self.__writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+
+    def get(self, block_id):
+        "Returns the cached block, None if it is not cached"
+        with self.__lock:
+            data = self.__blocks.pop(block_id, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__blocks[block_id] = data
+            return data
+
+    def contains(self, block_id):
+        "True if the block is cached, it doesn't count as a use"
+        return block_id in self.__blocks
+
+    def stamp(self):
+        "Returns the stamp to pass to fill() for the blocks about to be read"
+        return self.__writes
+
+    def fill(self, first, data, stamp):
+        '''
+        Caches the blocks read from the image, "data" holds the blocks from
+        "first" on. Nothing is cached if there were writes since the stamp.
+        '''
+        with self.__lock:
+            if stamp != self.__writes or self.max_blocks == 0:
+                return
+            for index in xrange(0, len(data) / self.block_size):
+                self.__put(first + index, data[index * self.block_size:(index + 1) * self.block_size])
+
+    def write(self, first, offset, data):
+        '''
+        Updates the cache with the data written "offset" bytes past the start
+        of block "first": the whole blocks are cached, the partially written
+        ones are patched if they are cached.
+        '''
+        with self.__lock:
+            self.__writes += 1
+            if self.max_blocks == 0:
+                return
+            position = 0
+            block_id = first
+            while position < len(data):
+                size = min(self.block_size - offset, len(data) - position)
+                if size == self.block_size:
+                    self.__put(block_id, data[position:position + size])
+                else:
+                    cached = self.__blocks.get(block_id)
+                    if cached is not None:
+                        self.__blocks[block_id] = cached[:offset] + data[position:position + size] + \
+                            cached[offset + size:]
+                position += size
+                offset = 0
+                block_id += 1
+
+    def __put(self, block_id, data):
+        "Inserts the block as the most recently used, evicting the oldest ones"
+        self.__blocks.pop(block_id, None)
+        self.__blocks[block_id] = str(data)
+        while len(self.__blocks) > self.max_blocks:
+            self.__blocks.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        "Drops all the blocks"
+        with self.__lock:
+            self.__writes += 1
+            self.__blocks.clear()
+
+    def stats(self):
+        "Returns the cache counters"
+        with self.__lock:
+            return {
+                'capacity': self.capacity,
+                'size': len(self.__blocks) * self.block_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
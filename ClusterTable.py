@@ -2,44 +2,115 @@
 Author: Cesar Bonilla
 Interface to interact with the File System Clusters
 '''
-
-from Settings import Settings
-from bitarray import bitarray
+from Bitmap import Bitmap
+from RWLock import RWLock
+from utilities import to_runs
 
 class ClusterTable(object):
     '''
-    Interface to interact with the File System Clusters
+    Interface to interact with the File System Clusters.
+    The blocks bitmap is kept in memory, changes are written back on flush/sync.
+    Searches take the read lock of the bitmap and allocations the write lock.
+    Every change updates the free clusters counter of the superblock.
     '''
-    def __init__(self, file_object):
-        self.file_object = file_object
+    def __init__(self, device):
+        self.device = device
+        self.superblock = device.superblock
+        self.bitmap = Bitmap(device, self.superblock.datablock_bitmap_offset,
+                             self.superblock.datablock_bitmap_size)
+        self.__cursor = 0
+        self.lock = RWLock()
 
-    def get_free_cluster(self):
+    def get_free_cluster(self, group=0):
         '''
-        Reads and return the first cluster index that is unused.
+        Reads and return the first cluster index that is unused, searching
+        from the start of the block group and then in the following groups.
         Returns a tuple containin the Cluster Index and cluster offset: (cluster_id, cluster_offset)
         '''
-        self.file_object.seek(Settings.datablock_bitmap_offset)
-        bitmap_bytes = self.file_object.read(Settings.datablock_bitmap_size)
-        data = bitarray()
-        data.frombytes(bitmap_bytes)
-        try:
-            free_block_index = data.index(True)
-            offset = Settings.datablock_region_offset + (free_block_index * Settings.datablock_size)
-            return (free_block_index, offset)
-        except ValueError:
+        with self.lock.read_locked():
+            start = self.superblock.group_clusters(group)[0]
+            for first, stop in [(start, self.superblock.datablock_max_elements), (0, start)]:
+                try:
+                    free_block_index = self.bitmap.first_free(first, stop)
+                except ValueError:
+                    continue
+                return (free_block_index, self.superblock.cluster_offset(free_block_index))
             raise ValueError("No more free Clusters, please delete some files")
 
+    def free_per_group(self):
+        "Returns how many clusters of every block group are free"
+        with self.lock.read_locked():
+            return [self.bitmap.count_free(*self.superblock.group_clusters(group))
+                    for group in xrange(0, self.superblock.group_count)]
+
+    def allocate(self, count, goal=None):
+        '''
+        Allocates "count" clusters and returns their ids in allocation order.
+        The search starts at "goal" (or where the last allocation ended) and
+        prefers a single free run; if there is none big enough, the closest
+        free runs are used.
+        '''
+        if count <= 0:
+            return []
+        with self.lock.write_locked():
+            bitmap_len = self.superblock.datablock_max_elements
+            start = self.__cursor if goal is None else goal % bitmap_len
+            clusters = []
+            for run_start, run_len in self.__free_runs_from(start):
+                if run_len >= count:
+                    clusters = range(run_start, run_start + count)
+                    break
+            else:
+                if self.bitmap.count_free() < count:
+                    raise ValueError("No more free Clusters, please delete some files")
+                for run_start, run_len in self.__free_runs_from(start):
+                    run_len = min(run_len, count - len(clusters))
+                    clusters += range(run_start, run_start + run_len)
+                    if len(clusters) == count:
+                        break
+            for run_start, run_len in to_runs(clusters):
+                self.superblock.change_free(clusters=self.bitmap.set_range(run_start, run_len, 0))
+            self.__cursor = (clusters[-1] + 1) % bitmap_len
+            return clusters
+
+    def __free_runs_from(self, start):
+        "Free runs from start to the end of the bitmap, then wrapping from 0"
+        for run in self.bitmap.free_runs(start):
+            yield run
+        for run in self.bitmap.free_runs(0, start):
+            yield run
+
     def change_cluster_state(self, cluster_id, state):
         '''
         Set the clusters as occupied or free, changing the bit state from 1 to 0
         '''
-        self.file_object.seek(Settings.datablock_bitmap_offset)
-        bitmap_bytes = self.file_object.read(Settings.datablock_bitmap_size)
-        data = bitarray()
-        data.frombytes(bitmap_bytes)
-        try:
-            data[cluster_id] = state
-            self.file_object.seek(Settings.datablock_bitmap_offset)
-            self.file_object.write(data.tobytes())
-        except ValueError:
-            raise ValueError("Unable to set cluster as occupied or free")
+        with self.lock.write_locked():
+            try:
+                self.superblock.change_free(clusters=self.bitmap.set_state(cluster_id, state))
+            except (ValueError, IndexError):
+                raise ValueError("Unable to set cluster as occupied or free")
+
+    def release(self, runs):
+        "Sets the (first cluster, length) runs of clusters as free"
+        with self.lock.write_locked():
+            try:
+                for run_start, run_len in runs:
+                    self.superblock.change_free(clusters=self.bitmap.set_range(run_start, run_len, 1))
+            except (ValueError, IndexError):
+                raise ValueError("Unable to set cluster as occupied or free")
+
+    def flush(self):
+        '''
+        Writes the changed bytes of the blocks bitmap and the free counters
+        back to disk.
+        '''
+        with self.lock.write_locked():
+            self.bitmap.flush()
+            self.superblock.flush(self.device)
+
+    def sync(self):
+        '''
+        Flushes the blocks bitmap and forces it to the storage device.
+        '''
+        self.flush()
+        self.device.sync()
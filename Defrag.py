@@ -0,0 +1,91 @@
+'''
+Online defragmenter of File System images:
+
+    python Defrag.py FS.ext2 [--seconds 0.5] [--bytes 1048576]
+
+The inodes are visited in table order and the fragmented ones are moved to
+runs of free clusters by FileSystem.relocate_inode, which takes the locks
+of the file, so the image can be used while it runs. A run stops when its
+time or I/O budget is spent and the next one goes on from there.
+'''
+import argparse
+import sys
+import time
+from collections import OrderedDict
+from FileSystem import FileSystem
+
+
+class Defragmenter(object):
+    '''
+    Defragments the files and directories of a mounted File System in
+    passes over the inode table. Every run() goes on where the previous one
+    stopped:
+
+        defragmenter = Defragmenter(file_system)
+        while not defragmenter.run(seconds=0.05)['finished']:
+            time.sleep(1)
+    '''
+
+    def __init__(self, file_system):
+        self.file_system = file_system.handle()
+        self.cursor = 0
+
+    def run(self, seconds=None, max_bytes=None):
+        '''
+        Defragments inodes until the end of the pass or until "seconds" or
+        "max_bytes" (bytes copied) are spent, and flushes the File System.
+        Returns the report:
+        {inodes, relocated, fragments_before, fragments_after, bytes, finished, seconds}
+        '''
+        start = time.time()
+        report = OrderedDict([('inodes', 0), ('relocated', 0), ('fragments_before', 0),
+                              ('fragments_after', 0), ('bytes', 0), ('finished', False),
+                              ('seconds', 0.0)])
+        inode_table = self.file_system.inode_table
+        inode_count = self.file_system.device.superblock.inode_max_elements
+        while True:
+            if self.cursor >= inode_count:
+                self.cursor = 0
+                report['finished'] = True
+                break
+            if seconds is not None and time.time() - start >= seconds or \
+                    max_bytes is not None and report['bytes'] >= max_bytes:
+                break
+            inode_id = self.cursor
+            self.cursor += 1
+            if inode_table.bitmap.is_free(inode_id):
+                continue
+            before, after, copied = self.file_system.relocate_inode(inode_id)
+            report['inodes'] += 1
+            report['fragments_before'] += before
+            report['fragments_after'] += after
+            report['bytes'] += copied
+            if copied:
+                report['relocated'] += 1
+        self.file_system.flush()
+        report['seconds'] = time.time() - start
+        return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Defragments a File System image")
+    parser.add_argument("path", help="image file")
+    parser.add_argument("-s", "--seconds", type=float, default=None,
+                        help="stop after this time, default: a whole pass")
+    parser.add_argument("-b", "--bytes", type=int, default=None,
+                        help="stop after copying this many bytes, default: a whole pass")
+    args = parser.parse_args(argv)
+    with open(args.path, "r+b") as fs_file:
+        file_system = FileSystem(fs_file)
+        report = Defragmenter(file_system).run(args.seconds, args.bytes)
+        file_system.sync()
+    print "{0}: {1} of {2} inodes relocated, {3} fragments left of {4}, {5} bytes copied " \
+        "in {6:.1f} ms{7}".format(args.path, report['relocated'], report['inodes'],
+                                  report['fragments_after'], report['fragments_before'],
+                                  report['bytes'], report['seconds'] * 1000,
+                                  "" if report['finished'] else " (stopped by the budget)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,76 @@
+'''
+Cache of the path components already resolved by the File System.
+'''
+import threading
+from collections import OrderedDict
+from Settings import Settings
+
+
+class DentryCache(object):
+    '''
+    Maps (parent inode, name, file type) to the child inode id. A child id
+    of -1 is a negative entry: the name is known not to exist.
+    The least recently used entry is dropped when the cache is over
+    capacity, the keys are also indexed by parent directory so a whole
+    directory can be forgotten at once. It can be shared by several threads.
+    '''
+
+    def __init__(self, capacity=Settings.dentry_cache_size):
+        self.capacity = max(1, capacity)
+        self.__entries = OrderedDict()
+        # parent inode id -> keys of its entries
+        self.__directories = dict()
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+    def get(self, parent_id, name, file_type):
+        '''
+        Returns the cached child inode id, -1 for a negative entry or
+        None if the name was not resolved yet.
+        '''
+        with self.__lock:
+            key = (parent_id, name, file_type)
+            child_id = self.__entries.pop(key, None)
+            if child_id is None:
+                self.misses += 1
+                return None
+            self.__entries[key] = child_id
+            self.hits += 1
+            return child_id
+
+    def add(self, parent_id, name, file_type, child_id):
+        "Stores the child inode id of the name, -1 if it does not exist"
+        with self.__lock:
+            key = (parent_id, name, file_type)
+            self.__entries.pop(key, None)
+            self.__entries[key] = child_id
+            self.__directories.setdefault(parent_id, set()).add(key)
+            while len(self.__entries) > self.capacity:
+                evicted, _ = self.__entries.popitem(last=False)
+                keys = self.__directories[evicted[0]]
+                keys.discard(evicted)
+                if not keys:
+                    del self.__directories[evicted[0]]
+
+    def forget_directory(self, parent_id):
+        "Drops all the entries of the directory"
+        with self.__lock:
+            for key in self.__directories.pop(parent_id, ()):
+                del self.__entries[key]
+
+    def clear(self):
+        "Drops all the entries"
+        with self.__lock:
+            self.__entries.clear()
+            self.__directories.clear()
+
+    def stats(self):
+        "Returns the cache counters"
+        with self.__lock:
+            return {
+                'capacity': self.capacity,
+                'size': len(self.__entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,509 @@
+'''
+Module to handle the dir entries of a directory.
+Directories use the linear dir entry format while they fit in one block,
+when they outgrow it they are converted to a hashed index (like ext3 htree).
+'''
+import bisect
+import math
+import struct
+import zlib
+from BlockMap import BlockMap
+
+
+class DirEntry(object):
+    '''
+    Basic structure to handle dir entries data. rec_len can be bigger than
+    the entry when it owns the space of removed entries, an entry without
+    name is an unused slot. "offset" is the position inside its block.
+    '''
+    _entry_mask = '=hhhh'
+    entry_header_size = struct.calcsize(_entry_mask)
+
+    def __init__(self, inode_id, rec_len, name_len, file_type, name, offset=0):
+        self.inode_id = inode_id
+        self.rec_len = rec_len
+        self.name_len = name_len
+        self.file_type = file_type
+        self.name = name
+        self.offset = offset
+
+    def size(self):
+        "Bytes really used by the entry, 0 for an unused slot"
+        return DirEntry.entry_header_size + self.name_len if self.name_len else 0
+
+    def to_binary(self):
+        "Convert currents instance to bytes using struct.pack"
+        return struct.pack('{0}{1}s'.format(DirEntry._entry_mask, self.name_len), self.inode_id,
+                           self.rec_len, self.name_len, self.file_type, self.name)
+
+    def __str__(self):
+        return "{0}, {1}, {2}, {3}, {4}".format(
+            self.inode_id, self.rec_len, self.name_len, self.file_type, self.name)
+
+
+class Directory(object):
+    '''
+    Reads, searches and adds the dir entries of a directory inode. The
+    logical blocks of the directory are mapped by a BlockMap, so big
+    directories go on in the indirect blocks.
+
+    The first block of an indexed directory is the root of the index: a
+    header (-1, count, limit, levels) followed by "count" (hash, logical
+    block) pairs sorted by hash. With 0 levels they point to the leaves,
+    otherwise to index nodes (same format, levels 0) one level closer to
+    them. Every leaf holds the linear dir entries whose name hash is between
+    its key and the key of the next leaf, so a lookup is a search in every
+    level of the index plus one leaf read. Full nodes are split in two and
+    a full root moves its pairs one level down, like ext3 htree.
+
+    Like ext2, removing an entry merges its space into the previous entry of
+    the block (the first entry of a block becomes an unused slot instead)
+    and add_entry fills the free space of the entries before appending, so
+    the directory doesn't grow while entries are removed and added. Leaves
+    left empty are dropped from the index and freed, their logical blocks
+    are used again by the next leaves.
+    '''
+    _index_header_mask = '=hhhh'
+    _index_entry_mask = '=Ih'
+    index_marker = -1
+
+    def __init__(self, device, inode_table, cluster_table, inode_id, index_cache=None):
+        self.device = device
+        self.inode_table = inode_table
+        self.cluster_table = cluster_table
+        self.inode_id = inode_id
+        self.inode = inode_table.get_inode(inode_id)
+        self.superblock = device.superblock
+        self.block_size = self.superblock.datablock_size
+        self.block_map = BlockMap(inode_table, cluster_table, self.inode)
+        self.max_blocks = self.block_map.max_blocks
+        # Index of each directory, None for the linear ones: the levels, the
+        # pairs of the nodes read ({logical block: pairs}) and the logical
+        # blocks without cluster (None until needed). Shared between instances.
+        self.index_cache = index_cache if index_cache is not None else dict()
+
+    @staticmethod
+    def name_hash(name):
+        "Hash used to place a name in the index"
+        return zlib.crc32(name) & 0xffffffff
+
+    def index_limit(self):
+        "How many pairs fit in an index block"
+        header_size = struct.calcsize(Directory._index_header_mask)
+        entry_size = struct.calcsize(Directory._index_entry_mask)
+        return (self.block_size - header_size) / entry_size
+
+    def is_indexed(self):
+        "Returns True if the directory uses the hashed index format"
+        return self.__get_index() is not None
+
+    def index_levels(self):
+        "Levels of index nodes under the root, None for a linear directory"
+        index = self.__get_index()
+        return index['levels'] if index is not None else None
+
+    def entries(self):
+        '''
+        Returns all the dir entries of the directory.
+        '''
+        index = self.__get_index()
+        if index is None:
+            logical_blocks = xrange(0, int(math.ceil(
+                float(self.inode.i_size) / float(self.block_size))))
+        else:
+            logical_blocks = self.__leaves(index['levels'], 0)
+        entries = list()
+        for logical_block in logical_blocks:
+            entries += self.__read_block(self.__block_id(logical_block))
+        return [entry for entry in entries if entry.name_len]
+
+    def lookup(self, name):
+        '''
+        Returns the dir entries with the given name.
+        '''
+        if self.__get_index() is None:
+            entries = self.entries()
+        else:
+            entries = self.__read_block(self.__block_id(self.__leaf(self.__find(name))))
+        return [entry for entry in entries if entry.name_len and entry.name == name]
+
+    def add_entry(self, file_name, inode_id, file_type):
+        '''
+        Adds a new dir entry to the directory and writes the directory inode.
+        file_type: 0 => regular file, 1 => directory file
+        '''
+        name_len = len(file_name)
+        rec_len = DirEntry.entry_header_size + name_len
+        if rec_len > self.block_size:
+            raise ValueError("File name '{0}' is too long".format(file_name))
+        entry = DirEntry(inode_id, rec_len, name_len, file_type, file_name)
+        index = self.__get_index()
+        if index is None:
+            block_id = self.inode.i_blocks[0]
+            entries = self.__read_block(block_id) if self.inode.i_size > 0 else list()
+        else:
+            path = self.__find(file_name)
+            block_id = self.__block_id(self.__leaf(path))
+            entries = self.__read_block(block_id)
+        if self.__fill_slot(block_id, entries, entry):
+            return
+        used = sum(item.rec_len for item in entries)
+        if index is None:
+            if self.inode.i_size <= self.block_size and \
+                    used + rec_len <= self.block_size:
+                self.__write_entry(block_id, used, entry)
+                self.inode.i_size = used + rec_len
+            else:
+                self.__convert_to_index(self.__live(self.entries()) + [entry])
+        elif used + rec_len <= self.block_size:
+            self.__write_entry(block_id, used, entry)
+        else:
+            self.__split_leaf(path, self.__live(entries) + [entry])
+        self.block_map.store()
+        self.inode_table.write_inode(self.inode_id, self.inode)
+
+    def remove_entry(self, name, inode_id):
+        '''
+        Removes the dir entry of the name that points to the inode and writes
+        the directory inode. Returns False if there is no such entry.
+        '''
+        index = self.__get_index()
+        if index is None:
+            if self.inode.i_size == 0:
+                return False
+            path = None
+            block_id = self.inode.i_blocks[0]
+        else:
+            path = self.__find(name)
+            block_id = self.__block_id(self.__leaf(path))
+        entries = self.__read_block(block_id)
+        for number, entry in enumerate(entries):
+            if entry.name_len and entry.name == name and entry.inode_id == inode_id:
+                break
+        else:
+            return False
+        if number + 1 < len(entries):
+            if number == 0:
+                self.__write_entry(block_id, 0, DirEntry(0, entry.rec_len, 0, 0, ''))
+            else:
+                previous = entries[number - 1]
+                previous.rec_len += entry.rec_len
+                self.__write_entry(block_id, previous.offset, previous)
+        else:
+            # The last entry: the block ends at the end of the previous entry
+            end = 0
+            if number > 0 and entries[number - 1].name_len:
+                previous = entries[number - 1]
+                previous.rec_len = previous.size()
+                self.__write_entry(block_id, previous.offset, previous)
+                end = previous.offset + previous.rec_len
+            # Appended entries must not be followed by the old ones
+            self.device.write(self.superblock.cluster_offset(block_id) + end,
+                              '\0' * (self.block_size - end))
+            if index is None:
+                self.inode.i_size = end
+            elif end == 0:
+                self.__drop_leaf(path)
+        self.block_map.store()
+        self.inode_table.write_inode(self.inode_id, self.inode)
+        return True
+
+    def __block_id(self, logical_block):
+        "Cluster of the logical block, the first block is cluster 0 in the root directory"
+        if logical_block == 0:
+            return self.inode.i_blocks[0]
+        return self.block_map.get_blocks(logical_block + 1, logical_block)[0]
+
+    def __get_index(self):
+        '''
+        Returns the index of the directory with its root (logical block 0)
+        read, None if the directory is linear.
+        '''
+        if self.inode_id in self.index_cache:
+            return self.index_cache[self.inode_id]
+        index = None
+        if self.inode.i_size > 0:
+            data = self.device.view(self.superblock.cluster_offset(self.inode.i_blocks[0]),
+                                    self.block_size)
+            if struct.unpack_from(Directory._index_header_mask, data)[0] == Directory.index_marker:
+                levels, pairs = self.__parse_node(data)
+                index = {'levels': levels, 'nodes': {0: pairs}, 'holes': None}
+        self.index_cache[self.inode_id] = index
+        return index
+
+    @staticmethod
+    def __parse_node(data):
+        "Returns (levels, pairs) of an index block"
+        _, count, _, levels = struct.unpack_from(Directory._index_header_mask, data)
+        pairs = list()
+        offset = struct.calcsize(Directory._index_header_mask)
+        entry_size = struct.calcsize(Directory._index_entry_mask)
+        for _ in xrange(0, count):
+            pairs.append(struct.unpack_from(Directory._index_entry_mask, data, offset))
+            offset += entry_size
+        return (levels, pairs)
+
+    def __node(self, logical_block):
+        "Returns the pairs of the index node, reading it only once"
+        nodes = self.__get_index()['nodes']
+        if logical_block not in nodes:
+            nodes[logical_block] = self.__parse_node(
+                self.device.read_blocks(self.__block_id(logical_block)))[1]
+        return nodes[logical_block]
+
+    def __write_node(self, logical_block, pairs, levels=0):
+        "Writes an index block, the root (logical block 0) with the levels under it"
+        data = struct.pack(Directory._index_header_mask, Directory.index_marker,
+                           len(pairs), self.index_limit(), levels)
+        for name_hash, pointer in pairs:
+            data += struct.pack(Directory._index_entry_mask, name_hash, pointer)
+        self.device.write(self.superblock.cluster_offset(self.__block_id(logical_block)),
+                          data.ljust(self.block_size, '\0'))
+        index = self.index_cache.get(self.inode_id)
+        if index is None:
+            # A new index, all its blocks are in use
+            index = {'levels': levels, 'nodes': dict(), 'holes': list()}
+            self.index_cache[self.inode_id] = index
+        if logical_block == 0:
+            index['levels'] = levels
+        index['nodes'][logical_block] = pairs
+
+    def __find(self, name):
+        '''
+        Walks the index down to the leaf of the name. Returns the path from
+        the root as (logical block of the node, position in the node) steps.
+        '''
+        name_hash = self.name_hash(name)
+        logical_block = 0
+        path = list()
+        for _ in xrange(0, self.__get_index()['levels'] + 1):
+            pairs = self.__node(logical_block)
+            position = bisect.bisect_right([key for key, _ in pairs], name_hash) - 1
+            path.append((logical_block, position))
+            logical_block = pairs[position][1]
+        return path
+
+    def __leaf(self, path):
+        "Logical block of the leaf at the end of the path"
+        logical_block, position = path[-1]
+        return self.__node(logical_block)[position][1]
+
+    def __leaves(self, levels, logical_block):
+        "Logical blocks of the leaves under the index node, in hash order"
+        pointers = [pointer for _, pointer in self.__node(logical_block)]
+        if levels == 0:
+            return pointers
+        leaves = list()
+        for pointer in pointers:
+            leaves += self.__leaves(levels - 1, pointer)
+        return leaves
+
+    def __read_block(self, block_id):
+        "Returns the list of dir entries in the block"
+        data = self.device.read_blocks(block_id)
+        entries = list()
+        offset = 0
+        while offset + DirEntry.entry_header_size <= len(data):
+            inode_id, rec_len, name_len, file_type = struct.unpack_from(
+                DirEntry._entry_mask, data, offset)
+            if rec_len <= 0:
+                break
+            name_offset = offset + DirEntry.entry_header_size
+            file_name = data[name_offset:name_offset + name_len]
+            entries.append(DirEntry(inode_id, rec_len, name_len, file_type, file_name, offset))
+            offset += rec_len
+        self.device.metrics.count('dir_block_reads')
+        self.device.metrics.count('dirent_parses', len(entries))
+        return entries
+
+    @staticmethod
+    def __live(entries):
+        "Returns the used entries with rec_len trimmed to their size, to be written again"
+        return [DirEntry(entry.inode_id, entry.size(), entry.name_len, entry.file_type, entry.name)
+                for entry in entries if entry.name_len]
+
+    def __fill_slot(self, block_id, entries, entry):
+        '''
+        Writes the entry in the free space of an entry of the block, which
+        is trimmed to its size. Returns False if no entry has enough room.
+        '''
+        for item in entries:
+            size = item.size()
+            if item.rec_len - size < entry.rec_len:
+                continue
+            if size:
+                free = item.rec_len - size
+                item.rec_len = size
+                self.__write_entry(block_id, item.offset, item)
+            else:
+                free = item.rec_len
+            entry.rec_len = free
+            self.__write_entry(block_id, item.offset + size, entry)
+            return True
+        return False
+
+    def __write_entry(self, block_id, offset, entry):
+        "Writes a single dir entry inside the block"
+        self.device.write(self.superblock.cluster_offset(block_id) + offset, entry.to_binary())
+
+    def __write_leaf(self, block_id, entries):
+        "Rewrites the whole leaf block with the given entries"
+        data = ''.join(entry.to_binary() for entry in entries)
+        self.device.write(self.superblock.cluster_offset(block_id), data.ljust(self.block_size, '\0'))
+
+    def __split_entries(self, entries):
+        '''
+        Splits the entries sorted by hash in leaves that fit in a block.
+        Entries with the same hash always go to the same leaf.
+        '''
+        entries = sorted(entries, key=lambda entry: self.name_hash(entry.name))
+        hashes = [self.name_hash(entry.name) for entry in entries]
+        total = sum(entry.rec_len for entry in entries)
+        best_split = None
+        left_size = 0
+        for position in xrange(1, len(entries)):
+            left_size += entries[position - 1].rec_len
+            if left_size > self.block_size:
+                break
+            if total - left_size > self.block_size or \
+                    hashes[position - 1] == hashes[position]:
+                continue
+            if best_split is None or abs(total - 2 * left_size) < abs(total - 2 * best_split[1]):
+                best_split = (position, left_size)
+        if best_split is not None:
+            return [entries[:best_split[0]], entries[best_split[0]:]]
+        leaves = [[]]
+        leaf_size = 0
+        for position, entry in enumerate(entries):
+            if leaf_size + entry.rec_len > self.block_size:
+                if hashes[position - 1] == hashes[position]:
+                    raise ValueError("Directory is full")
+                leaves.append([])
+                leaf_size = 0
+            leaves[-1].append(entry)
+            leaf_size += entry.rec_len
+        return leaves
+
+    def __holes(self):
+        "Sorted logical blocks before i_size without cluster, found once per index"
+        index = self.__get_index()
+        if index is None:
+            return list()
+        if index['holes'] is None:
+            blocks = self.block_map.get_blocks(self.inode.i_size / self.block_size)
+            index['holes'] = [logical_block for logical_block, block_id in enumerate(blocks)
+                              if logical_block > 0 and block_id == 0]
+        return index['holes']
+
+    def __check_room(self, count):
+        "Raises a ValueError if there are less than 'count' logical blocks left"
+        end = self.inode.i_size / self.block_size
+        if self.max_blocks - end >= count:
+            return
+        if len(self.__holes()) + self.max_blocks - end < count:
+            raise ValueError("Directory is full")
+
+    def __new_blocks(self, count):
+        '''
+        Assigns clusters to "count" logical blocks without one and returns
+        them: the ones left by dropped leaves first, then new ones.
+        '''
+        end = self.inode.i_size / self.block_size
+        holes = self.__holes()
+        reused = holes[:count]
+        logical_blocks = reused + range(end, end + count - len(reused))
+        if logical_blocks and logical_blocks[-1] >= self.max_blocks:
+            raise ValueError("Directory is full")
+        del holes[:len(reused)]
+        for logical_block in logical_blocks:
+            self.block_map.map_blocks(logical_block + 1, logical_block)
+        self.inode.i_size = max(self.inode.i_size, (max(logical_blocks + [0]) + 1) * self.block_size)
+        return logical_blocks
+
+    def __convert_to_index(self, entries):
+        '''
+        Moves the entries of a linear directory to leaves and writes the
+        index in the first block.
+        '''
+        leaves = self.__split_entries(entries)
+        if len(leaves) > self.index_limit():
+            raise ValueError("Directory is full")
+        # Past the entries of the first block, which becomes the root of the index
+        self.inode.i_size = self.block_size
+        logical_blocks = self.__new_blocks(len(leaves))
+        pairs = list()
+        for logical_block, leaf in zip(logical_blocks, leaves):
+            self.__write_leaf(self.__block_id(logical_block), leaf)
+            pairs.append((self.name_hash(leaf[0].name), logical_block))
+        pairs[0] = (0, pairs[0][1])
+        self.__write_node(0, pairs)
+
+    def __split_leaf(self, path, entries):
+        '''
+        Splits a full leaf, the new leaves are added after it in its node.
+        '''
+        leaves = self.__split_entries(entries)
+        # Checked first, so a full directory is never left half split: the
+        # new leaves, a split node per level and two new nodes for the root
+        self.__check_room(len(leaves) - 1 + len(path) + 1)
+        logical_blocks = [self.__leaf(path)] + self.__new_blocks(len(leaves) - 1)
+        pairs = list()
+        for logical_block, leaf in zip(logical_blocks, leaves):
+            self.__write_leaf(self.__block_id(logical_block), leaf)
+            pairs.append((self.name_hash(leaf[0].name), logical_block))
+        node, position = path[-1]
+        pairs[0] = self.__node(node)[position]
+        self.__replace_pair(path, pairs)
+
+    def __replace_pair(self, path, pairs):
+        '''
+        Replaces the pair at the end of the path by "pairs", the first one
+        keeps its key. Full nodes are split in two and their second half
+        is added to the parent node the same way. A full root moves its
+        pairs to two new nodes and the index gets one more level.
+        '''
+        levels = self.__get_index()['levels']
+        for depth in xrange(len(path) - 1, -1, -1):
+            logical_block, position = path[depth]
+            node = self.__node(logical_block)
+            node = node[:position] + pairs + node[position + 1:]
+            if len(node) <= self.index_limit():
+                self.__write_node(logical_block, node, levels if depth == 0 else 0)
+                return
+            half = len(node) / 2
+            if depth == 0:
+                children = self.__new_blocks(2)
+                self.__write_node(children[0], node[:half])
+                self.__write_node(children[1], node[half:])
+                self.__write_node(0, [(0, children[0]), (node[half][0], children[1])], levels + 1)
+                return
+            sibling = self.__new_blocks(1)[0]
+            self.__write_node(logical_block, node[:half])
+            self.__write_node(sibling, node[half:])
+            parent, parent_position = path[depth - 1]
+            pairs = [self.__node(parent)[parent_position], (node[half][0], sibling)]
+
+    def __drop_leaf(self, path):
+        '''
+        Removes an empty leaf from its index node and frees its block, its
+        hashes go to the previous leaf (the next one if it is the first).
+        The last leaf of a node is kept.
+        '''
+        logical_block, position = path[-1]
+        node = self.__node(logical_block)
+        if len(node) == 1:
+            return
+        holes = self.__holes()
+        self.block_map.unmap_block(node[position][1])
+        bisect.insort(holes, node[position][1])
+        new_node = node[:position] + node[position + 1:]
+        if position == 0:
+            new_node[0] = (node[0][0], new_node[0][1])
+        self.__write_node(logical_block, new_node,
+                          self.__get_index()['levels'] if logical_block == 0 else 0)
+        # i_size ends at the last block in use
+        end = self.inode.i_size / self.block_size
+        while holes and holes[-1] == end - 1:
+            holes.pop()
+            end -= 1
+        self.inode.i_size = end * self.block_size
@@ -0,0 +1,194 @@
+'''
+Module to map the logical blocks of an inode to clusters with extents.
+'''
+from utilities import to_runs
+
+
+class ExtentMap(object):
+    '''
+    Maps the logical blocks of an inode to clusters as extents: (first
+    cluster, length) pairs that cover the file in logical order, so a file
+    written in a contiguous run needs a single extent.
+    The first 7 extents are stored in i_blocks[0:14], i_blocks[14] points to
+    an index block with the ids of the leaf blocks holding the next ones.
+    It has the interface of BlockMap, the extents are written by store().
+    They are read again when i_blocks is replaced (see FileSystem.relocate_inode).
+    '''
+    inline_extents = 7
+    index_pointer = 14
+
+    def __init__(self, inode_table, cluster_table, inode):
+        superblock = inode_table.superblock
+        self.inode_table = inode_table
+        self.cluster_table = cluster_table
+        self.inode = inode
+        # Pointers stored in an index block, a leaf holds half as many extents
+        self.pointers = superblock.max_indirect_blocks
+        self.leaf_extents = self.pointers / 2
+        self.max_extents = ExtentMap.inline_extents + self.leaf_extents * self.pointers
+        self.max_blocks = superblock.datablock_max_elements
+        self.__extents = None
+        self.__i_blocks = None
+        self.__index = list()
+        self.__dirty = False
+
+    def __load(self):
+        "Reads the extents of the inode, the index and leaf blocks only once"
+        if self.__extents is not None and self.inode.i_blocks is self.__i_blocks:
+            return self.__extents
+        blocks = self.__i_blocks = self.inode.i_blocks
+        self.__index = list()
+        self.__dirty = False
+        pairs = [(blocks[index], blocks[index + 1])
+                 for index in xrange(0, ExtentMap.inline_extents * 2, 2)]
+        index_id = blocks[ExtentMap.index_pointer]
+        if index_id != 0:
+            self.__index = [index_id] + [leaf_id for leaf_id in
+                                         self.inode_table.get_indirect_blocks(index_id)
+                                         if leaf_id != 0]
+            for leaf_id in self.__index[1:]:
+                pointers = self.inode_table.get_indirect_blocks(leaf_id)
+                pairs += zip(pointers[0::2], pointers[1::2])
+        self.__extents = [(start, length) for start, length in pairs if length != 0]
+        return self.__extents
+
+    def mapped_blocks(self):
+        "Returns how many logical blocks are assigned"
+        return sum(length for _, length in self.__load())
+
+    def get_runs(self, count, first=0):
+        '''
+        Returns the data blocks "first" to "count" - 1 as (first cluster, length)
+        runs of contiguous clusters, the blocks that are not assigned yet are
+        returned as a run starting at cluster 0.
+        '''
+        runs = list()
+        logical_block = 0
+        for start, length in self.__load():
+            if logical_block >= count:
+                break
+            skip = max(0, first - logical_block)
+            run_len = min(length, count - logical_block) - skip
+            if run_len > 0:
+                runs.append((start + skip, run_len))
+            logical_block += length
+        if count > max(logical_block, first):
+            runs.append((0, count - max(logical_block, first)))
+        return runs
+
+    def get_blocks(self, count, first=0):
+        '''
+        Returns the ids of the data blocks "first" to "count" - 1 of the inode,
+        0 means the block is not assigned yet.
+        '''
+        blocks = list()
+        for start, length in self.get_runs(count, first):
+            blocks += [0] * length if start == 0 else range(start, start + length)
+        return blocks
+
+    def map_runs(self, count, first=0):
+        '''
+        Makes sure the data blocks "first" to "count" - 1 of the inode are
+        assigned and returns them as runs. The missing blocks are allocated
+        at once right after the last extent, which grows if they follow it.
+        '''
+        if count > self.max_blocks:
+            raise IOError("File is too big for the file system")
+        extents = self.__load()
+        missing = count - self.mapped_blocks()
+        if missing > 0:
+            goal = extents[-1][0] + extents[-1][1] if extents else None
+            new_runs = to_runs(self.cluster_table.allocate(missing, goal))
+            grown = list(extents)
+            for start, length in new_runs:
+                if grown and grown[-1][0] + grown[-1][1] == start:
+                    grown[-1] = (grown[-1][0], grown[-1][1] + length)
+                else:
+                    grown.append((start, length))
+            if len(grown) > self.max_extents:
+                self.cluster_table.release(new_runs)
+                raise IOError("File is too fragmented for the file system")
+            self.__extents = grown
+            self.__allocate_index()
+            self.__dirty = True
+        return self.get_runs(count, first)
+
+    def map_blocks(self, count, first=0):
+        '''
+        Like map_runs, but returns the ids of the data blocks.
+        '''
+        self.map_runs(count, first)
+        return self.get_blocks(count, first)
+
+    def __allocate_index(self):
+        "Allocates the index and leaf blocks needed by the extents"
+        overflow = len(self.__extents) - ExtentMap.inline_extents
+        needed = 0 if overflow <= 0 else 1 + -(-overflow // self.leaf_extents)
+        if needed > len(self.__index):
+            goal = self.__extents[-1][0] + self.__extents[-1][1]
+            self.__index += self.cluster_table.allocate(needed - len(self.__index), goal)
+
+    def cluster_runs(self, count):
+        '''
+        Returns the clusters used by the first "count" data blocks, the data
+        blocks and the index and leaf blocks of the extents, as (first cluster, length) runs.
+        '''
+        runs = [run for run in self.get_runs(count) if run[0] != 0]
+        return runs + to_runs(sorted(self.__index))
+
+    def owned_runs(self):
+        '''
+        Returns every cluster the inode points to, the extents past i_size
+        included, as (first cluster, length) runs.
+        '''
+        return list(self.__load()) + to_runs(sorted(self.__index))
+
+    def truncate(self, count):
+        '''
+        Frees the data blocks from "count" on, the first block is always
+        kept, and the leaf and index blocks no longer needed.
+        '''
+        count = max(count, 1)
+        kept = list()
+        freed = list()
+        logical_block = 0
+        for start, length in self.__load():
+            keep = min(length, max(0, count - logical_block))
+            if keep > 0:
+                kept.append((start, keep))
+            if keep < length:
+                freed.append((start + keep, length - keep))
+            logical_block += length
+        if not freed:
+            return
+        self.__extents = kept
+        overflow = len(kept) - ExtentMap.inline_extents
+        needed = 0 if overflow <= 0 else 1 + -(-overflow // self.leaf_extents)
+        freed += to_runs(sorted(self.__index[needed:]))
+        self.__index = self.__index[:needed]
+        self.__dirty = True
+        self.cluster_table.release(freed)
+
+    def store(self):
+        '''
+        Writes the extents, the inline ones in i_blocks, which is written by
+        the caller, and the rest in the leaf blocks.
+        '''
+        self.__load()
+        if not self.__dirty:
+            return
+        pairs = list()
+        for start, length in self.__extents:
+            pairs += [start, length]
+        inline = ExtentMap.inline_extents * 2
+        pairs += [0] * (inline - len(pairs))
+        self.inode.i_blocks[:inline] = pairs[:inline]
+        self.inode.i_blocks[ExtentMap.index_pointer] = self.__index[0] if self.__index else 0
+        if self.__index:
+            leaves = self.__index[1:]
+            self.inode_table.set_indirect_blocks(
+                self.__index[0], leaves + [0] * (self.pointers - len(leaves)))
+            for position, leaf_id in enumerate(leaves):
+                leaf = pairs[inline + position * self.pointers:inline + (position + 1) * self.pointers]
+                self.inode_table.set_indirect_blocks(leaf_id, leaf + [0] * (self.pointers - len(leaf)))
+        self.__dirty = False
@@ -0,0 +1,143 @@
+'''
+File-like object to read a file of the File System.
+'''
+import os
+from Settings import Settings
+
+
+class FileReader(object):
+    '''
+    Read only, file-like access to a File System file. Data is read on
+    demand and every run of physically contiguous clusters is read with a
+    single read, so the file is never held in memory as a whole.
+    The clusters of the requested blocks are resolved by the block map.
+    Blocks go through the buffer cache of the device: when the reads are
+    sequential the next "readahead" blocks are read ahead in the cache,
+    one read per run of contiguous clusters.
+    Iterating yields the file in chunks of at most "chunk_size" bytes.
+    Every read holds the read lock of the file (a RWLock), if there is one.
+    The blocks of a removed file are freed, reading it raises an IOError.
+    '''
+
+    def __init__(self, device, size, block_map, chunk_size=Settings.read_chunk_size, lock=None,
+                 readahead=Settings.readahead_blocks):
+        self.device = device
+        self.size = size
+        self.block_map = block_map
+        self.chunk_size = chunk_size
+        self.lock = lock
+        self.readahead = readahead
+        self.position = 0
+        self.closed = False
+        self.__last_end = 0
+        self.__readahead_end = 0
+
+    def readable(self):
+        "The file can be read"
+        return True
+
+    def read(self, size=-1):
+        '''
+        Reads up to "size" bytes, everything until the end of file if size is negative.
+        '''
+        self.__check_closed()
+        remaining = max(0, self.size - self.position)
+        if size < 0 or size > remaining:
+            size = remaining
+        chunks = list()
+        if self.lock is not None:
+            self.lock.acquire_read()
+        try:
+            if self.block_map.inode.i_ddate != 0:
+                raise IOError("The file was removed")
+            sequential = self.position == self.__last_end
+            while size > 0:
+                chunk = self.__read_run(size)
+                chunks.append(chunk)
+                size -= len(chunk)
+            self.__last_end = self.position
+            if sequential and self.readahead > 0:
+                self.__read_ahead()
+        finally:
+            if self.lock is not None:
+                self.lock.release_read()
+        return ''.join(chunks)
+
+    def readinto(self, buffer):
+        '''
+        Reads up to len(buffer) bytes into the buffer and returns how many were read.
+        '''
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        "Changes the current position, like file.seek"
+        self.__check_closed()
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        elif whence != os.SEEK_SET:
+            raise ValueError("Invalid whence ({0})".format(whence))
+        if offset < 0:
+            raise IOError("Invalid offset ({0})".format(offset))
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        "Returns the current position"
+        return self.position
+
+    def close(self):
+        "Closes the file, further reads will fail"
+        self.closed = True
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __check_closed(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def __read_run(self, size):
+        '''
+        Reads up to "size" bytes from the current position until the end of
+        the run of contiguous clusters it belongs to.
+        '''
+        block_size = self.device.superblock.datablock_size
+        first = self.position / block_size
+        offset = self.position % block_size
+        run_start, run_len = self.block_map.get_runs(
+            (self.position + size - 1) / block_size + 1, first)[0]
+        size = min(size, run_len * block_size - offset)
+        data = self.device.read_blocks(run_start, (offset + size - 1) / block_size + 1)
+        self.position += size
+        return data[offset:offset + size]
+
+    def __read_ahead(self):
+        '''
+        Reads the next blocks of the file in the buffer cache, once less than
+        half of the window read ahead is left.
+        '''
+        block_size = self.device.superblock.datablock_size
+        next_block = (self.position + block_size - 1) / block_size
+        if self.__readahead_end - next_block > self.readahead / 2:
+            return
+        end = min(next_block + self.readahead, (self.size + block_size - 1) / block_size)
+        first = max(next_block, self.__readahead_end)
+        if first >= end:
+            return
+        runs = self.block_map.get_runs(end, first)
+        self.device.readahead([run for run in runs if run[0] != 0])
+        self.__readahead_end = end
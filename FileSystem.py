@@ -3,71 +3,217 @@
 Author: Cesar Bonilla
 Module to Handle the Ext2 File System
 '''
-import struct
+import sys
+import copy
 import datetime
-import math
+import logging
+import threading
+from contextlib import contextmanager
 from colorama import init, Fore
 from bitarray import bitarray
 from InodeBase import Inode
 from ClusterTable import ClusterTable
 from InodeTable import InodeTable
+from BlockDevice import BlockDevice
+from BlockMap import BlockMap
+from ExtentMap import ExtentMap
+from FileReader import FileReader
+from FileWriter import FileWriter
+from Directory import Directory
+from DentryCache import DentryCache
+from Metrics import timed
+from RWLock import RWLock
 from Settings import Settings
-from utilities import split_path_and_file, get_cluster_offset, get_current_time_seconds
+from SuperBlock import SuperBlock
+from utilities import split_path_and_file, get_current_time_seconds, to_runs
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+# Once per process, every call wraps sys.stdout again
+init(autoreset=True)
 
 class FileSystem(object):
     '''
     Class to Handle the Basic File system Operations as read, write, delete
     and create files. All size properties are in bytes.
+    fs_file can be a BlockDevice or the image file object, opened as "r+b".
+    The geometry of the image is read from its superblock at mount.
+    The I/O counters and the latency of every operation are returned by stats().
+
+    The File System can be used from several threads: lookups and reads
+    share the namespace lock and the lock of the file, creating and removing
+    files takes the namespace lock for writing and a file opened for writing
+    holds the write lock of its inode until it is closed, so writers of
+    different files don't block each other. A file removed while it is open
+    for writing keeps its inode and blocks until the last writer is closed. The working directory belongs to
+    the FileSystem object, every thread should use its own handle().
     '''
 
-    def __init__(self, fs_file, create_fs=False):
-        init(autoreset=True)
-        self.file_object = fs_file
+    def __init__(self, fs_file, create_fs=False, inode_cache_size=Settings.inode_cache_size,
+                 dentry_cache_size=Settings.dentry_cache_size):
+        self.device = fs_file if isinstance(fs_file, BlockDevice) else BlockDevice(fs_file)
+        self.metrics = self.device.metrics
         self.working_dir = ""
-        self.inode_table = InodeTable(fs_file)
-        self.cluster_table = ClusterTable(fs_file)
         self.__current_inode_id = 0
+        self.dentry_cache = DentryCache(dentry_cache_size)
+        self.__lock = RWLock()
+        self.__inode_locks = dict()
+        self.__inode_locks_guard = threading.Lock()
+        # Writers open per inode id and the removed inodes freed when they close
+        self.__writers = dict()
+        self.__unlinked = set()
         if not create_fs:
+            self.device.superblock = SuperBlock.read(self.device)
+        self.__mount(inode_cache_size)
+        if not create_fs:
+            self.cluster_table.bitmap.load()
+            self.inode_table.bitmap.load()
             self.__root_inode = self.inode_table.get_root_inode()
-        print "Blocks Bitmap Offset: {0}".format(Settings.datablock_bitmap_offset)
-        print "Inodes Bitmap Offset: {0}".format(Settings.inode_bitmap_offset)
-        print "Inode Table Offset: {0}".format(Settings.inode_table_offset)
-        print "Data Region offset: {0}".format(Settings.datablock_region_offset)
 
-    def _create_file_system(self):
-        "Create a new ext2 file with the default structure"
-        print "Allocating new file system at '{0}'".format(self.file_object)
-        self.__allocate_bitmap(Settings.datablock_bitmap_size)
-        self.__allocate_bitmap(Settings.inode_bitmap_size)
-        self.__create_inode_table(Settings.inode_max_elements)
-        self.__allocate_space(Settings.datablock_region_size)
-        self.__create_root_inode()
-        print "File system allocated"
+    def __mount(self, inode_cache_size):
+        "Creates the tables for the geometry of the device"
+        superblock = self.device.superblock
+        self.inode_table = InodeTable(self.device, inode_cache_size)
+        self.cluster_table = ClusterTable(self.device)
+        self.__dir_index_cache = dict()
+        self.dentry_cache.clear()
+        logger.debug("Block size: %s, version: %s", superblock.datablock_size, superblock.version)
+        logger.debug("Block groups: %s of %s clusters and %s inodes", superblock.group_count,
+                     superblock.blocks_per_group, superblock.inodes_per_group)
+        logger.debug("Blocks Bitmap Offset: %s", superblock.datablock_bitmap_offset)
+        logger.debug("Inodes Bitmap Offset: %s", superblock.inode_bitmap_offset)
+        logger.debug("Inode Table Offset: %s", superblock.inode_table_offset)
+        logger.debug("Data Region offset: %s", superblock.datablock_region_offset)
+
+    def _create_file_system(self, superblock=None):
+        '''
+        Create a new ext2 file with the geometry of the superblock, by default
+        the one of Settings. SuperBlock.legacy() creates an image without superblock.
+        '''
+        with self.__lock.write_locked():
+            logger.info("Allocating new file system at '%s'", self.device.file_object)
+            superblock = superblock if superblock is not None else SuperBlock()
+            self.device.superblock = superblock
+            self.__mount(self.inode_table.cache_capacity)
+            # The zeroed regions (the data region) are holes of a sparse file
+            self.device.resize(0)
+            self.device.resize(superblock.image_size())
+            superblock.write(self.device)
+            self.__allocate_bitmap(superblock.datablock_bitmap_offset,
+                                   superblock.datablock_bitmap_size, superblock.datablock_max_elements)
+            self.__allocate_bitmap(superblock.inode_bitmap_offset, superblock.inode_bitmap_size,
+                                   superblock.inode_max_elements)
+            superblock.count_free(self.device)
+            self.__create_inode_table(superblock.inode_max_elements)
+            self.__create_root_inode()
+            self.flush()
+            logger.info("File system allocated")
+
+    def handle(self):
+        '''
+        Returns a new FileSystem object over the same image, tables and locks
+        with its own working directory, starting at the current one.
+        '''
+        return copy.copy(self)
+
+    def __inode_lock(self, inode_id):
+        "Returns the RWLock of the inode"
+        with self.__inode_locks_guard:
+            lock = self.__inode_locks.get(inode_id)
+            if lock is None:
+                lock = RWLock()
+                self.__inode_locks[inode_id] = lock
+            return lock
+
+    @timed('flush')
+    def flush(self):
+        '''
+        Writes back the pending changes of the bitmaps and the inode table.
+        '''
+        self.cluster_table.flush()
+        self.inode_table.flush()
 
-    def __allocate_space(self, size):
+    @timed('sync')
+    def sync(self):
         '''
-        Allocates a space of "size" bytes in the current file.
+        Flushes all the pending changes and forces them to the storage device.
         '''
-        _bytes = bytearray(size)
-        self.file_object.write(_bytes)
+        self.flush()
+        self.device.sync()
+
+    @contextmanager
+    def batch(self, sync=False):
+        '''
+        Groups the operations of the block in a single flush point:
+
+            with file_system.batch():
+                for name in names:
+                    file_system.create_file(name)
+
+        The inode, bitmap and dir entry updates are kept in memory and
+        written in offset order when the outermost batch ends, then the
+        image is synced if "sync" is set. Batches can be nested.
+        '''
+        self.device.begin_batch()
+        try:
+            yield self
+        finally:
+            if self.device.batch_depth == 1:
+                self.flush()
+            self.device.end_batch()
+            if sync and self.device.batch_depth == 0:
+                self.device.sync()
+
+    def stats(self):
+        '''
+        Returns the I/O counters, the latency of every operation and
+        the inode, dentry and buffer caches statistics.
+        '''
+        stats = self.metrics.snapshot()
+        stats['inode_cache'] = self.inode_table.cache_stats()
+        stats['dentry_cache'] = self.dentry_cache.stats()
+        stats['buffer_cache'] = self.device.cache.stats()
+        return stats
+
+    def reset_stats(self):
+        "Sets the I/O counters and latencies back to zero"
+        self.metrics.reset()
 
-    def __allocate_bitmap(self, size):
+    def statfs(self):
         '''
-        Creates a bitmap where all the bits are set to 1 and writes it to the current file.
+        Returns the size and the free space of the File System, read from
+        the counters of the superblock without reading the bitmaps.
+        '''
+        superblock = self.device.superblock
+        return {
+            'block_size': superblock.datablock_size,
+            'clusters': superblock.datablock_max_elements,
+            'free_clusters': superblock.free_clusters,
+            'inodes': superblock.inode_max_elements,
+            'free_inodes': superblock.free_inodes,
+            'size': superblock.datablock_region_size,
+            'free_bytes': superblock.free_clusters * superblock.datablock_size,
+        }
+
+    def __allocate_bitmap(self, offset, size, count):
+        '''
+        Creates a bitmap where the first "count" bits are set to 1 (free) and
+        writes it to the current file. The padding bits of an image with
+        superblock are set to 0, so they are never allocated.
         '''
         array = bitarray(size * 8)
         array.setall(True)
-        self.file_object.write(array.tobytes())
+        if self.device.superblock.version > 1:
+            array[count:] = False
+        self.device.write(offset, array.tobytes())
 
     def __create_inode_table(self, table_len):
         '''
-        Creates "table_len" Inodes into the current file.
+        Creates "table_len" Inodes into the current file with a single write.
         '''
-        while table_len > 1:
-            inode = Inode()
-            self.file_object.write(inode.to_binary())
-            table_len = table_len - 1
+        superblock = self.device.superblock
+        self.device.write(superblock.inode_table_offset,
+                          Inode().to_binary(superblock.version) * table_len)
 
     def __create_root_inode(self):
         '''
@@ -77,538 +223,566 @@ class FileSystem(object):
         self.cluster_table.change_cluster_state(0, 0)
         self.__root_inode = self.inode_table.get_root_inode()
         self.__current_inode_id = 0
-        self.__root_inode.i_size += self.__add_dir_entry(".", 0, 1, 0)
         self.__root_inode.i_mode = 1
-        self.inode_table.write_inode(0, self.__root_inode)
+        self.__directory(0).add_entry(".", 0, 1)
 
-    def __create_file(self, file_name, file_type, parent_id=-1):
+    def __create_file(self, file_name, file_type, parent_id=-1, extents=None):
         '''
-        Creates a new file and returns the assigned Inode ID.
+        Creates a new file and returns the assigned Inode ID. Regular files map
+        their blocks with extents if "extents" is set, by default if the image
+        has the extents feature.
         '''
+        superblock = self.device.superblock
+        if extents is None:
+            extents = superblock.has_extents()
+        if extents and superblock.version == 1:
+            raise ValueError("Images without superblock don't support extents")
         if parent_id == -1:
             parent_id = self.__current_inode_id
-        free_inode_id, free_inode = self.inode_table.get_free_inode()
+        free_inode_id, free_inode = self.inode_table.get_free_inode(
+            self.__find_group(parent_id, file_type))
         # Add dir entry to parent folder
-        dir_entry_size = self.__add_dir_entry(
-            file_name, free_inode_id, file_type, parent_id)
-        parent_inode = self.inode_table.get_inode(parent_id)
-        parent_inode.i_size += dir_entry_size
+        parent_directory = self.__directory(parent_id)
+        parent_directory.add_entry(file_name, free_inode_id, file_type)
+        parent_inode = parent_directory.inode
         parent_inode.i_mdate = get_current_time_seconds()
         # Clean inode for new file
         free_inode.i_ddate = 0
         free_inode.i_cdate = get_current_time_seconds()
         free_inode.i_mode = file_type
         free_inode.i_size = 0
-        free_cluster_id = self.cluster_table.get_free_cluster()[0]
-        free_inode.i_blocks = [free_cluster_id, 0,
-                               0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-        self.cluster_table.change_cluster_state(free_cluster_id, 0)
+        group = superblock.group_of_inode(free_inode_id)
+        free_cluster_id = self.cluster_table.allocate(1, superblock.group_clusters(group)[0])[0]
+        if extents and file_type == 0:
+            # A single extent of one block
+            free_inode.i_flags = Inode.extents_flag
+            free_inode.i_blocks = [free_cluster_id, 1,
+                                   0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+        else:
+            free_inode.i_flags = 0
+            free_inode.i_blocks = [free_cluster_id, 0,
+                                   0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.inode_table.change_inode_state(free_inode_id, 0)
+        self.__dir_index_cache.pop(free_inode_id, None)
+        self.dentry_cache.forget_directory(free_inode_id)
+        self.dentry_cache.add(parent_id, file_name, file_type, free_inode_id)
 
         self.inode_table.write_inode(free_inode_id, free_inode)
         self.inode_table.write_inode(parent_id, parent_inode)
         return free_inode_id
 
-    def __add_dir_entry(self, file_name, inode_id, file_type, folder_inode_id=-1):
-        '''
-        Adds a new dir entry at the current directory and returns the dir entry size.
-        file_type: 0 => regular file, 1 => directory file
-        '''
-        if folder_inode_id == -1:
-            folder_inode_id = self.__current_inode_id
-        parent_inode = self.inode_table.get_inode(folder_inode_id)
-        file_name_len = len(file_name)
-        struct_mask = '=hhhh{0}s'.format(file_name_len)
-        dir_entry_size = struct.calcsize(struct_mask)
-        block_data = struct.pack(
-            struct_mask, inode_id, dir_entry_size, file_name_len, file_type, file_name)
-        # Get the index of the block to be used
-        blocks_used = int(float(parent_inode.i_size) /
-                          float(Settings.datablock_size))
-        if blocks_used > 1:
-            data_offset = parent_inode.i_size - Settings.datablock_size * blocks_used
-        else:
-            data_offset = parent_inode.i_size
-
-        last_block_id = parent_inode.i_blocks[blocks_used]
-        if parent_inode.i_size == 0:
-            free_block_space = Settings.datablock_size
-        else:
-            free_block_space = (blocks_used + 1) * \
-                Settings.datablock_size - parent_inode.i_size
-        print "Current block has {0} of free space".format(free_block_space)
-        if dir_entry_size > free_block_space:
-            print "Will use a new block to allocate"
-            free_block_id, block_offset = self.cluster_table.get_free_cluster()
-            parent_inode.i_blocks[blocks_used + 1] = free_block_id
-            self.cluster_table.change_cluster_state(free_block_id, 0)
-            data_offset = block_offset
-        else:
-            block_offset = get_cluster_offset(last_block_id)
-            data_offset += block_offset
-
-        self.file_object.seek(data_offset)
-        print "Writing dir entry of size {0} to offset {1}".format(dir_entry_size, data_offset)
-        self.file_object.write(block_data)
-        self.inode_table.write_inode(folder_inode_id, parent_inode)
-        return dir_entry_size
-
-    def __get_files(self, dir_inode_id=0):
-        '''
-        Returns all the files under the directory, even the deleted ones.
-        '''
-        backup_inode_id = self.__current_inode_id
-        if dir_inode_id > 0:
-            self.__current_inode_id = dir_inode_id
-        current_inode = self.inode_table.get_inode(self.__current_inode_id)
-        files_list = list()
-        blocks_used = float(current_inode.i_size) / \
-            float(Settings.datablock_size)
-        blocks_used = int(math.ceil(blocks_used))
-        for i in xrange(0, blocks_used):
-            block_index = current_inode.i_blocks[i]
-            entries = self.__read_block_dir_entries(block_index)
-            files_list += entries
-        self.__current_inode_id = backup_inode_id
-        return files_list
-
-    def __read_block_dir_entries(self, block):
-        "Returns the list of direntries in the block"
-        files_list = list()
-        block_offset = get_cluster_offset(block)
-        self.file_object.seek(block_offset)
-        entry_mask = "=hhhh"
-        bytes_readed = 0
-        while bytes_readed < Settings.datablock_size:
-            entry_size = struct.calcsize(entry_mask)
-            inode_id, rec_len, name_len, file_type = struct.unpack(
-                entry_mask, self.file_object.read(entry_size))
-            name_mask = "={0}s".format(name_len)
-            file_name = struct.unpack(
-                name_mask, self.file_object.read(name_len))[0]
-            bytes_readed += struct.calcsize(entry_mask + name_mask[1:])
-            if rec_len != 0 and rec_len < 60:
-                dir_entry = DirEntry(
-                    inode_id, rec_len, name_len, file_type, file_name)
-                files_list.append(dir_entry)
-        return files_list
+    def __find_group(self, parent_id, file_type):
+        '''
+        Returns the block group for a new file: the group of its parent
+        directory, or for a directory the group with most free clusters among
+        the ones with at least the average of free inodes, searching from the
+        group after the parent one so that new directories are spread.
+        '''
+        superblock = self.device.superblock
+        parent_group = superblock.group_of_inode(parent_id)
+        if file_type != 1 or superblock.group_count == 1:
+            return parent_group
+        free_inodes = self.inode_table.free_per_group()
+        free_clusters = self.cluster_table.free_per_group()
+        average = sum(free_inodes) / float(superblock.group_count)
+        best_group = parent_group
+        best_free = -1
+        for step in xrange(1, superblock.group_count + 1):
+            group = (parent_group + step) % superblock.group_count
+            if free_inodes[group] == 0 or free_inodes[group] < average:
+                continue
+            if free_clusters[group] > best_free:
+                best_group = group
+                best_free = free_clusters[group]
+        return best_group
+
+    def __block_map(self, inode):
+        "Returns the extent or block map of the inode, depending on its flags"
+        if inode.i_flags & Inode.extents_flag:
+            return ExtentMap(self.inode_table, self.cluster_table, inode)
+        return BlockMap(self.inode_table, self.cluster_table, inode)
+
+    def __directory(self, inode_id):
+        "Returns the Directory handler of the directory inode"
+        return Directory(self.device, self.inode_table, self.cluster_table,
+                         inode_id, self.__dir_index_cache)
+
+    def __get_files(self, dir_inode_id):
+        '''
+        Returns all the files under the directory. Images written before the
+        inodes were reclaimed may still have entries of deleted files.
+        '''
+        return self.__directory(dir_inode_id).entries()
 
+    @timed('read_file')
     def read_file(self, file_name):
         "Interface to read a file by name"
-        is_file, inode_id = self.is_file(file_name)
-        print "reading file {0}, is file?: {1}".format(file_name, is_file)
-        if is_file:
-            inode = self.inode_table.get_inode(inode_id)
-            inode.i_adate = get_current_time_seconds()
-            bytes_to_read = inode.i_size
-            print "file size is: {0}".format(bytes_to_read)
-            # How much blocks the file has assigned
-            file_blocks = int(
-                math.ceil(float(bytes_to_read) / float(Settings.datablock_size)))
-            if file_blocks >= 14:
-                indirect_blocks = self.inode_table.get_indirect_blocks(inode.i_blocks[14]) 
-            index = 0
-            file_data = ''
-            while bytes_to_read > 0 and index < file_blocks:
-                print "Bytes to read: {0}".format(bytes_to_read)
-                block = inode.i_blocks[index] if index < 14 else indirect_blocks[index - 14]
-                data_region_offset = Settings.datablock_region_offset
-                seek_position = data_region_offset + (block * Settings.datablock_size)
-                print "Reading block {0} at position {1}".format(block, seek_position)
-                self.file_object.seek(seek_position)
-                if bytes_to_read > Settings.datablock_size:
-                    file_data += self.file_object.read(Settings.datablock_size)
-                    bytes_to_read -= Settings.datablock_size
-                    index += 1
-                else:
-                    file_data += self.file_object.read(bytes_to_read)
-                    bytes_to_read = 0
-                    index += 1
-                    break
-            print "Data len: {0}".format(len(str(file_data)))
-            print struct.unpack("={0}s".format(inode.i_size), file_data)[0]
-        else:
-            print "File not found '{0}'".format(file_name)
+        try:
+            file_reader = self.open(file_name)
+        except IOError:
+            logger.warning("File not found '%s'", file_name)
+            return
+        with file_reader:
+            for chunk in file_reader:
+                sys.stdout.write(chunk)
+        sys.stdout.write('\n')
 
-    def write_file(self, file_name, data, append=False):
+    @timed('open')
+    def open(self, path, mode='rb', extents=None):
         '''
-        Write text to a file, overwriting it if it exists or creating it.
+        Opens the file and returns a file-like object to read it ('r', 'rb')
+        or to write it ('w', 'wb' overwrite it, 'a', 'ab' append to it).
+        Files opened for writing are created if they don't exist, with
+        extents if "extents" is set (see create_file).
+        The path can be relative to the current directory or absolute.
         '''
-        if append:
-            self.__append_to_file(file_name, data)
-        else:
-            self.__write_to_file(file_name, data)
-
-    def __append_to_file(self, file_name, data):
-        "Internal function to append data to a file"
-        is_file, inode_id = self.is_file(file_name)
-        print "Inode: {0}".format(str(inode_id))
-        if is_file:
-            inode = self.inode_table.get_inode(inode_id)
-        else:
-            inode_id = self.create_file(file_name)
-            inode = self.inode_table.get_inode(inode_id)
-        bytes_to_write = len(data)
-        print "Will append {0} bytes to file {1}".format(bytes_to_write, file_name)
-        block_size = float(Settings.datablock_size)
-        required_blocks = int(math.ceil(float(bytes_to_write) / block_size))
-        last_used_block_index = inode.i_size / Settings.datablock_size
-        if last_used_block_index + required_blocks > Settings.max_indirect_blocks + 14:
-            print "File is to big for FileSystem"
-            return
-        indirect_blocks = [0] * Settings.max_indirect_blocks if last_used_block_index < 14 else \
-                          self.inode_table.get_indirect_blocks(inode.i_blocks[14])
-        writen_bytes = 0
-        index = last_used_block_index
-        while writen_bytes < bytes_to_write:
-            if index < 14:
-                block_id = inode.i_blocks[index]
-                block_offset = get_cluster_offset(block_id)
-                if block_id == 0: #Means it has no block assigned
-                    block_id, block_offset = self.cluster_table.get_free_cluster()
-                    inode.i_blocks[index] = block_id
-                    self.cluster_table.change_cluster_state(block_id, 0)
-                else:
-                    block_offset = get_cluster_offset(block_id)
-            elif index == 14:
-                print "First Indirect Node"
-                indirect_pointer = inode.i_blocks[index]
-                if indirect_pointer == 0:#Assign a cluster to store the indirect blocks
-                    print "A"
-                    inode.i_blocks[index] = self.cluster_table.get_free_cluster()[0]
-                    self.cluster_table.change_cluster_state(inode.i_blocks[index], 0)
-                    block_id, block_offset = self.cluster_table.get_free_cluster()
-                    indirect_blocks[0] = block_id
-                    self.cluster_table.change_cluster_state(block_id, 0)
-                else:
-                    print "B"
-                    indirect_blocks = self.inode_table.get_indirect_blocks(indirect_pointer)
-                    block_id = indirect_blocks[0]
-                    block_offset = get_cluster_offset(block_id)
-                    if block_id == 0: #Means it has no block assigned
-                        block_id, block_offset = self.cluster_table.get_free_cluster()
-                        indirect_blocks[0] = block_id
-                        self.cluster_table.change_cluster_state(block_id, 0)
-            else:
-                print "Indirect Node"
-                block_id = indirect_blocks[index - 14]
-                block_offset = get_cluster_offset(block_id)
-                if block_id == 0: #Means it has no block assigned
-                    block_id, block_offset = self.cluster_table.get_free_cluster()
-                    indirect_blocks[index - 14] = block_id
-                    self.cluster_table.change_cluster_state(block_id, 0)
-            print "Will write data to block {0}".format(block_id)
-            block_free_space = (index + 1) * Settings.datablock_size - inode.i_size
-            if block_free_space <= 0:
-                index += 1
-                continue
-            seek_position = block_offset + (Settings.datablock_size - block_free_space)
-            self.file_object.seek(seek_position)
-            print "Writing data to block {0} with offset {1}".format(block_id, seek_position)
-            if bytes_to_write - writen_bytes >= block_free_space:
-                start = writen_bytes
-                end = writen_bytes + block_free_space
-                _data = data[start:end]
-                print "Data[{0},{1}]: {2}".format(start, end, _data)
-                _data = struct.pack("={0}s".format(block_free_space), _data)
-                self.file_object.write(_data)
-                writen_bytes += block_free_space
-                inode.i_size += block_free_space
-                index += 1
-            else:
-                print "SDASDASDASDASD"
-                data_segment = data[writen_bytes:]
-                print "Data: {0}".format(data_segment)
-                _data = struct.pack("{0}s".format(len(data_segment)), data_segment)
-                self.file_object.write(_data)
-                writen_bytes += len(data_segment)
-                inode.i_size += len(data_segment)
-                index += 1
-                break
-        self.inode_table.write_inode(inode_id, inode)
-        print "indirect nodes {0}".format(", ".join(str(x) for x in indirect_blocks))
-        self.inode_table.set_indirect_blocks(inode.i_blocks[14], indirect_blocks)
-
-    def __write_to_file(self, file_name, data):
-        "Internal function to write data to a file and overwrite current data"
-        is_file, inode_id = self.is_file(file_name)
-        if is_file:
+        if mode not in ['r', 'rb', 'w', 'wb', 'a', 'ab']:
+            raise ValueError("Unsupported mode '{0}'".format(mode))
+        with self.__lock.read_locked():
+            dir_inode_id, file_name = self.__resolve_path(path)
+            inode_id = -1 if dir_inode_id == -1 else self.__find_entry(dir_inode_id, file_name, 0)
+        if inode_id == -1 and mode[0] != 'r' and dir_inode_id != -1:
+            with self.__lock.write_locked():
+                dir_inode_id, file_name = self.__resolve_path(path)
+                inode_id = -1 if dir_inode_id == -1 else self.__find_entry(dir_inode_id, file_name, 0)
+                if inode_id == -1 and dir_inode_id != -1:
+                    inode_id = self.__create_file(file_name, 0, dir_inode_id, extents)
+        return self.__open_inode(path, mode, inode_id)
+
+    def __open_inode(self, path, mode, inode_id):
+        '''
+        Returns the reader or writer of the file. The lock of the inode is
+        taken once the namespace lock is released, a thread holding a writer
+        may be waiting for the namespace lock.
+        '''
+        if inode_id == -1:
+            raise IOError("File not found '{0}'".format(path))
+        lock = self.__inode_lock(inode_id)
+        if mode[0] != 'r':
+            # Released by the writer when it is closed
+            lock.acquire_write()
             inode = self.inode_table.get_inode(inode_id)
-        else:
-            inode_id = self.create_file(file_name)
+            if inode.i_ddate != 0:
+                lock.release_write()
+                raise IOError("File not found '{0}'".format(path))
+            with self.__inode_locks_guard:
+                self.__writers[inode_id] = self.__writers.get(inode_id, 0) + 1
+            return FileWriter(self.device, self.inode_table, self.__block_map(inode), inode_id,
+                              append=mode[0] == 'a', lock=lock,
+                              on_close=lambda: self.__writer_closed(inode_id))
+        with lock.read_locked():
             inode = self.inode_table.get_inode(inode_id)
-        bytes_to_write = len(data)
-        print "Will write {0} bytes to file {1}".format(bytes_to_write, file_name)
-        #How much blocks we need to write the data
-        required_blocks = int(math.ceil(float(bytes_to_write) / float(Settings.datablock_size)))
-        if required_blocks > Settings.max_indirect_blocks + 14:
-            print "File is too big for the file system!"
-        indirect_blocks = [0] * Settings.max_indirect_blocks
-        writen_bytes = 0
-        inode.i_size = 0
-        for index in xrange(0, required_blocks):
-            if index < 14:#Direct pointers
-                block_id = inode.i_blocks[index]
-                block_offset = get_cluster_offset(block_id)
-                if block_id == 0: #Means it has no block assigned
-                    block_id, block_offset = self.cluster_table.get_free_cluster()
-                    inode.i_blocks[index] = block_id
-                    self.cluster_table.change_cluster_state(block_id, 0)
-            elif index == 14:#First Indirect Pointer
-                indirect_pointer = inode.i_blocks[index]
-                if indirect_pointer == 0:#Assign a cluster to store the indirect blocks
-                    inode.i_blocks[index] = self.cluster_table.get_free_cluster()[0]
-                    self.cluster_table.change_cluster_state(inode.i_blocks[index], 0)
-                    block_id, block_offset = self.cluster_table.get_free_cluster()
-                    indirect_blocks[0] = block_id
-                    self.cluster_table.change_cluster_state(block_id, 0)
+            if inode.i_ddate != 0:
+                raise IOError("File not found '{0}'".format(path))
+            inode.i_adate = get_current_time_seconds()
+            self.inode_table.write_inode(inode_id, inode)
+            return FileReader(self.device, inode.i_size, self.__block_map(inode), lock=lock)
+
+    def __writer_closed(self, inode_id):
+        "Frees the inode if it was removed and its last writer is closed"
+        with self.__inode_locks_guard:
+            self.__writers[inode_id] -= 1
+            if self.__writers[inode_id]:
+                return
+            del self.__writers[inode_id]
+            if inode_id not in self.__unlinked:
+                return
+            self.__unlinked.discard(inode_id)
+        self.__free_inode_blocks([inode_id])
+
+    def __resolve_path(self, path):
+        '''
+        Splits the path in its directory and file name.
+        Returns (directory inode id, file name), the id is -1 if the directory doesn't exist.
+        '''
+        if '/' not in path:
+            return (self.__current_inode_id, path)
+        dir_path, file_name = path.rsplit('/', 1)
+        is_dir, dir_inode_id = self.is_directory(dir_path if dir_path else '/')
+        return (dir_inode_id if is_dir else -1, file_name)
+
+    @timed('write_file')
+    def write_file(self, file_name, data, append=False, extents=None):
+        '''
+        Write text to a file, overwriting it if it exists or creating it.
+        data can be a string, a file-like object or an iterable of strings.
+        '''
+        try:
+            with self.open(file_name, 'ab' if append else 'wb', extents) as file_writer:
+                if isinstance(data, basestring):
+                    file_writer.write(data)
+                elif hasattr(data, 'read'):
+                    for chunk in iter(lambda: data.read(Settings.write_chunk_size), ''):
+                        file_writer.write(chunk)
                 else:
-                    indirect_blocks = self.inode_table.get_indirect_blocks(indirect_pointer)
-                    block_id = indirect_blocks[0]
-                    block_offset = get_cluster_offset(block_id)
-                    if block_id == 0: #Means it has no block assigned
-                        block_id, block_offset = self.cluster_table.get_free_cluster()
-                        indirect_blocks[0] = block_id
-                        self.cluster_table.change_cluster_state(block_id, 0)
-            else:#Indirect Pointers
-                block_id = indirect_blocks[index - 14]
-                block_offset = get_cluster_offset(block_id)
-                if block_id == 0: #Means it has no block assigned
-                    block_id, block_offset = self.cluster_table.get_free_cluster()
-                    indirect_blocks[0] = block_id
-                    self.cluster_table.change_cluster_state(block_id, 0)
-            self.file_object.seek(block_offset)
-            print "Writing data to block {0} with offset {1}".format(block_id, block_offset)
-            if bytes_to_write - writen_bytes >= Settings.datablock_size:
-                start = writen_bytes
-                end = writen_bytes + Settings.datablock_size
-                _data = data[start:end]
-                print "Data[{0},{1}]: {2}".format(start, end, _data)
-                _data = struct.pack("={0}s".format(Settings.datablock_size), _data)
-                self.file_object.write(_data)
-                writen_bytes += Settings.datablock_size
-                inode.i_size += Settings.datablock_size
-            else:
-                data_segment = data[writen_bytes:]
-                print "Data: {0}".format(data_segment)
-                _data = data_segment
-                _data = struct.pack("{0}s".format(len(_data)), data_segment)
-                self.file_object.write(_data)
-                writen_bytes += len(data_segment)
-                inode.i_size += len(data_segment)
-        self.inode_table.write_inode(inode_id, inode)
-        self.inode_table.set_indirect_blocks(inode.i_blocks[14], indirect_blocks)
+                    file_writer.writelines(data)
+        except IOError as error:
+            logger.error("%s", error)
 
+    @timed('list_files')
     def list_files(self, inode_id=-1):
         "Reads the current directory and returns/prints the list of files."
-        if inode_id == -1:
-            inode_id = self.__current_inode_id
-        files = self.__get_files(inode_id)
-        files = sorted(files, key=lambda file: file.name)
-        for item in files:
-            inode = self.inode_table.get_inode(item.inode_id)
-            if inode.i_ddate != 0:
-                continue
-            if inode.i_mode == 0:
-                print "{0}{1}".format(Fore.GREEN, item.name)
-            else:
-                print "{0}{1}".format(Fore.BLUE, item.name)
-
+        with self.__lock.read_locked():
+            if inode_id == -1:
+                inode_id = self.__current_inode_id
+            files = self.__get_files(inode_id)
+            files = sorted(files, key=lambda file: file.name)
+            for item in files:
+                inode = self.inode_table.get_inode(item.inode_id)
+                if inode.i_ddate != 0:
+                    continue
+                if inode.i_mode == 0:
+                    print "{0}{1}".format(Fore.GREEN, item.name)
+                else:
+                    print "{0}{1}".format(Fore.BLUE, item.name)
+
+    @timed('list_names')
+    def list_names(self, inode_id=-1):
+        "Returns the sorted names of the files in the directory, the current one by default"
+        with self.__lock.read_locked():
+            if inode_id == -1:
+                inode_id = self.__current_inode_id
+            return sorted(entry.name for entry in self.__get_files(inode_id)
+                          if self.inode_table.get_inode(entry.inode_id).i_ddate == 0)
+
+    @timed('list_files_long_format')
     def list_files_long_format(self):
         "List the files using the long format"
-        entries_all = self.__get_files(self.__current_inode_id)
-        entries_filtered = list()
-        for entry in entries_all:
-            inode = self.inode_table.get_inode(entry.inode_id)
-            if inode.i_ddate == 0:
-                entries_filtered.append(entry)
-        file_output = "{0}{1}{2}{3} 1 root root {size} {date} {name}"
-        for entry in entries_filtered:
-            inode = self.inode_table.get_inode(entry.inode_id)
-            owner_permissions = "rwx"
-            group_permission = "rwx"
-            all_permissions = "r--"
-            date = datetime.datetime.fromtimestamp(
-                inode.i_mdate).strftime('%Y-%m-%d %H:%M:%S')
-            if inode.i_mode == 0:
-                entry_type = "-"
-                size = inode.i_size
-            elif inode.i_mode == 1:
-                entry_type = "d"
-                size = 0
-            elif inode.i_mode == 2:
-                entry_type = "l"
-                size = 0
-            print file_output.format(entry_type, owner_permissions, group_permission,
-                                     all_permissions, size=size, date=date, name=entry.name)
-
-    def create_file(self, file_name):
-        '''
-        Creates a new file and returns the assigned Inode ID.
-        '''
-        is_file, inode_id = self.is_file(file_name)
-        if not is_file:
-            return self.__create_file(file_name, 0)
-        else:
-            print "File already exists"
-            return inode_id
+        with self.__lock.read_locked():
+            entries_all = self.__get_files(self.__current_inode_id)
+            file_output = "{0}{1}{2}{3} 1 root root {size} {date} {name}"
+            for entry in entries_all:
+                inode = self.inode_table.get_inode(entry.inode_id)
+                if inode.i_ddate != 0:
+                    continue
+                owner_permissions = "rwx"
+                group_permission = "rwx"
+                all_permissions = "r--"
+                date = datetime.datetime.fromtimestamp(
+                    inode.i_mdate).strftime('%Y-%m-%d %H:%M:%S')
+                if inode.i_mode == 0:
+                    entry_type = "-"
+                    size = inode.i_size
+                elif inode.i_mode == 1:
+                    entry_type = "d"
+                    size = 0
+                elif inode.i_mode == 2:
+                    entry_type = "l"
+                    size = 0
+                print file_output.format(entry_type, owner_permissions, group_permission,
+                                         all_permissions, size=size, date=date, name=entry.name)
+
+    @timed('create_file')
+    def create_file(self, file_name, extents=None):
+        '''
+        Creates a new file and returns the assigned Inode ID. The file maps
+        its blocks with extents if "extents" is set, by default if the image
+        was created with the extents feature.
+        '''
+        with self.__lock.write_locked():
+            is_file, inode_id = self.is_file(file_name)
+            if not is_file:
+                return self.__create_file(file_name, 0, extents=extents)
+            else:
+                logger.warning("File already exists")
+                return inode_id
 
+    @timed('create_directory')
     def create_directory(self, directory_name):
         '''
         Creates a new directory and returns the assigned Inode ID.
         '''
-        is_dir, inode_id = self.is_directory(directory_name)
-        if not is_dir:
-            created_id = self.__create_file(directory_name, 1)
-            inode = self.inode_table.get_inode(created_id)
-            inode.i_size += self.__add_dir_entry(".",
-                                                 created_id, 1, created_id)
-            self.inode_table.write_inode(created_id, inode)
-            inode.i_size += self.__add_dir_entry("..",
-                                                 self.__current_inode_id, 1, created_id)
-            self.inode_table.write_inode(created_id, inode)
-            return created_id
-        else:
-            print "Directory already exists"
-            return inode_id
+        with self.__lock.write_locked():
+            is_dir, inode_id = self.is_directory(directory_name)
+            if not is_dir:
+                created_id = self.__create_file(directory_name, 1)
+                directory = self.__directory(created_id)
+                directory.add_entry(".", created_id, 1)
+                directory.add_entry("..", self.__current_inode_id, 1)
+                return created_id
+            else:
+                logger.warning("Directory already exists")
+                return inode_id
 
+    @timed('change_directory')
     def change_directory(self, full_path):
         '''
         Change the current working directory.
         '''
-        is_dir, inode_id = self.is_directory(full_path)
-        print "the dir has id: {0}".format(inode_id)
-        dir_name = full_path.split('/')
-        dir_name = dir_name[len(dir_name) - 1]
-        if is_dir:
-            if dir_name == ".":
+        with self.__lock.read_locked():
+            is_dir, inode_id = self.is_directory(full_path)
+            logger.debug("the dir has id: %s", inode_id)
+            dir_name = full_path.split('/')
+            dir_name = dir_name[len(dir_name) - 1]
+            if is_dir:
+                if dir_name == ".":
+                    return True
+                elif dir_name == "..":
+                    last = self.working_dir.rfind("/")
+                    if last >= 0:
+                        self.working_dir = self.working_dir[:last]
+                else:
+                    if full_path.find('/') == 0:
+                        self.working_dir = full_path
+                    else:
+                        self.working_dir += "/" + full_path
+                self.__current_inode_id = inode_id
                 return True
-            elif dir_name == "..":
-                last = self.working_dir.rfind("/")
-                if last >= 0:
-                    self.working_dir = self.working_dir[:last]
             else:
-                if full_path.find('/') == 0:
-                    self.working_dir = full_path
-                else:
-                    self.working_dir += "/" + full_path
-            self.__current_inode_id = inode_id
-            return True
-        else:
-            return False
+                return False
 
+    @timed('is_directory')
     def is_directory(self, path):
         '''
         Search in the current directory if the folder exists.
         Returns: (True/False, i_node_id)
         '''
-
-        found = False
-        print "PATH: " + path
-        path = "./" + path if path.find('/') != 0 else path
-        folders = path.split("/")
-        inode_id = 0 if folders[0] == "" else self.__current_inode_id
-        print "Before:" + str(folders)
-        folders = folders[1:]
-        print "After:" + str(folders)
-        childs = self.__get_files(inode_id)
-        for folder in folders:
-            found = False
-            for child in childs:
-                print "is directory -> inode_id: {0}".format(inode_id)
-                print "searching for {0}, comparing with {1}".format(folder, child.name)
-                inode = self.inode_table.get_inode(child.inode_id)
-                if child.name == folder and inode.i_mode == 1 and inode.i_ddate == 0:
-                    inode_id = child.inode_id
-                    childs = self.__get_files(inode_id)
-                    found = True
-            if not found:
-                break
-        return (True, inode_id) if found else (False, -1)
-
+        with self.__lock.read_locked():
+            logger.debug("PATH: %s", path)
+            path = "./" + path if path.find('/') != 0 else path
+            folders = path.split("/")
+            inode_id = 0 if folders[0] == "" else self.__current_inode_id
+            for folder in folders[1:]:
+                if folder == "":
+                    continue
+                child_id = self.__find_entry(inode_id, folder, 1)
+                if child_id == -1:
+                    return (False, -1)
+                inode_id = child_id
+            return (True, inode_id)
+
+    @timed('is_file')
     def is_file(self, file_name):
         '''
         Search in the current directory if the file exists.
         Returns: (True/False, i_node_id)
         '''
-        files = self.__get_files(self.__current_inode_id)
-        for item in files:
-            item_inode = self.inode_table.get_inode(item.inode_id)
-            if item.name == file_name and item_inode.i_mode == 0 and item_inode.i_ddate == 0:
-                return (True, item.inode_id)
-        return (False, -1)
+        with self.__lock.read_locked():
+            inode_id = self.__find_entry(self.__current_inode_id, file_name, 0)
+            return (inode_id != -1, inode_id)
+
+    def __find_entry(self, dir_inode_id, name, file_type):
+        '''
+        Returns the inode id of the live file of the given type (0 => regular file,
+        1 => directory) in the directory, -1 if there is none.
+        '''
+        inode_id = self.dentry_cache.get(dir_inode_id, name, file_type)
+        if inode_id is not None:
+            return inode_id
+        inode_id = -1
+        for entry in self.__directory(dir_inode_id).lookup(name):
+            inode = self.inode_table.get_inode(entry.inode_id)
+            if inode.i_mode == file_type and inode.i_ddate == 0:
+                inode_id = entry.inode_id
+                break
+        self.dentry_cache.add(dir_inode_id, name, file_type, inode_id)
+        return inode_id
 
+    @timed('remove_file')
     def remove_file(self, file_name):
         """ Removes the file in the current folder """
-        # Current directory dir entries
-        curdir_dir_entries = self.__get_files(self.__current_inode_id)
-        for entry in curdir_dir_entries:
-            if entry.name == file_name and entry.file_type == 0:
-                inode = self.inode_table.get_inode(entry.inode_id)
-                self.__free_inode_blocks(inode)
-                inode.i_ddate = get_current_time_seconds()
-                self.inode_table.write_inode(entry.inode_id, inode)
-                #self.inode_table.change_inode_state(entry.inode_id, 1)
-
-    def __free_inode_blocks(self, inode):
-        size = float(inode.i_size)
-        datablock_size = float(Settings.datablock_size)
-        used_blocks = int(math.ceil(size / datablock_size))
-        if used_blocks >= 14:
-            indirect_blocks = self.inode_table.get_indirect_blocks(inode.i_blocks[14])
-        for index in xrange(0, used_blocks):
-            if index < 14:
-                block_id = inode.i_blocks[index]
-                self.cluster_table.change_cluster_state(block_id, 1)
-            elif index == 14:
-                block_id = inode.i_blocks[index]
-                self.cluster_table.change_cluster_state(block_id, 1)
-                self.cluster_table.change_cluster_state(indirect_blocks[0], 1)
-            else:
-                self.cluster_table.change_cluster_state(indirect_blocks[index - 14], 1)
+        removed = list()
+        with self.__lock.write_locked():
+            self.__remove_file(self.__current_inode_id, file_name, removed)
+        self.__free_inode_blocks(removed)
 
-    def __remove_directory_rec(self, inode_id=-1):
+    def __remove_file(self, dir_inode_id, file_name, removed):
+        '''
+        Removes the file in the given folder and adds its inode id to
+        "removed", the inode and its blocks are freed later by __free_inode_blocks.
         '''
-        Internal method used to delete folder in a recursive way
+        inode_id = self.__find_entry(dir_inode_id, file_name, 0)
+        if inode_id != -1:
+            self.__directory(dir_inode_id).remove_entry(file_name, inode_id)
+            self.__mark_removed(inode_id, removed)
+            self.dentry_cache.add(dir_inode_id, file_name, 0, -1)
+
+    def __mark_removed(self, inode_id, removed):
+        "Sets the deletion date of the inode, so it can't be opened any more"
+        inode = self.inode_table.get_inode(inode_id)
+        inode.i_ddate = get_current_time_seconds()
+        self.inode_table.write_inode(inode_id, inode)
+        removed.append(inode_id)
+
+    def __free_inode_blocks(self, inode_ids):
+        '''
+        Frees the removed inodes and every cluster they own: the data blocks,
+        the ones past i_size included, and the indirect or extent blocks.
+        Called without the namespace lock, it waits for the writers of other
+        threads. The files still open for writing (by the current thread, the
+        lock is reentrant) are freed when their last writer is closed.
+        '''
+        for inode_id in inode_ids:
+            with self.__inode_lock(inode_id).write_locked():
+                with self.__inode_locks_guard:
+                    if self.__writers.get(inode_id):
+                        self.__unlinked.add(inode_id)
+                        continue
+                inode = self.inode_table.get_inode(inode_id)
+                if inode.i_mode == 1:
+                    self.__dir_index_cache.pop(inode_id, None)
+                self.cluster_table.release(self.__block_map(inode).owned_runs())
+                # A new Inode: the open readers keep the removed one, and the
+                # inode id can be used by a new file
+                version = self.device.superblock.version
+                freed = Inode().from_binary(inode.to_binary(version), 0, version)
+                freed.i_size = 0
+                freed.i_flags = 0
+                freed.i_blocks = [0] * len(inode.i_blocks)
+                self.inode_table.write_inode(inode_id, freed)
+                self.inode_table.change_inode_state(inode_id, 1)
+
+    def __remove_directory_rec(self, removed, inode_id=-1):
+        '''
+        Internal method used to delete folder in a recursive way, the ids of
+        the removed files are added to "removed". The entries of the removed
+        directories are not changed, their blocks are freed.
         '''
         if inode_id == -1:
             inode_id = 0
-        curdir_dir_entries = self.__get_files(inode_id)
-        dir_inode = self.inode_table.get_inode(inode_id)
-        # Deleting files in directory
-        for element in curdir_dir_entries:
+        for element in self.__get_files(inode_id):
             if element.name in [".", ".."]:
                 continue
             inode = self.inode_table.get_inode(element.inode_id)
-            if inode.i_mode == 0 and inode.i_ddate == 0:
-                self.remove_file(element.name)
-            elif inode.i_mode == 1 and inode.i_ddate == 0:
-                self.__remove_directory_rec(element.inode_id)
-        dir_inode.i_ddate = get_current_time_seconds()
-        self.inode_table.write_inode(inode_id, dir_inode)
+            if inode.i_ddate != 0:
+                continue
+            if inode.i_mode == 1:
+                self.__remove_directory_rec(removed, element.inode_id)
+            else:
+                self.__mark_removed(element.inode_id, removed)
+        self.__mark_removed(inode_id, removed)
+        self.dentry_cache.forget_directory(inode_id)
 
-    def remove_directory(self, dir_name):
+    @timed('relocate_inode')
+    def relocate_inode(self, inode_id):
         '''
-        Removes the directory and its child elements
+        Moves the blocks of the file or directory to a run of free clusters
+        when that leaves it in fewer fragments (runs of contiguous clusters).
+        The blocks are copied first, then i_blocks is switched with a single
+        inode update and the old clusters are freed. Files are moved under
+        their write lock, directories under the namespace lock. Files open
+        for writing by the current thread are skipped.
+        Returns (fragments before, fragments after, bytes copied).
         '''
-        curdir_dir_entries = self.__get_files(self.__current_inode_id)
-        for entry in curdir_dir_entries:
-            if entry.name == dir_name:
-                self.__remove_directory_rec(entry.inode_id)
-
-
-class DirEntry(object):
-    '''
-    Basic structure to handle dir entries data
-    '''
+        if self.inode_table.bitmap.is_free(inode_id):
+            return (0, 0, 0)
+        if self.inode_table.get_inode(inode_id).i_mode == 1:
+            with self.__lock.write_locked():
+                return self.__relocate_directory(inode_id)
+        with self.__inode_lock(inode_id).write_locked():
+            return self.__relocate_file(inode_id)
+
+    @staticmethod
+    def __fragments(runs):
+        "Number of runs of contiguous clusters left once the runs are merged"
+        fragments = 0
+        end = None
+        for run_start, run_len in sorted(runs):
+            if run_start != end:
+                fragments += 1
+            end = run_start + run_len
+        return fragments
+
+    def __copy_blocks(self, old_runs, new_runs):
+        "Copies the blocks of old_runs to new_runs, both cover the same logical blocks"
+        superblock = self.device.superblock
+        block_size = superblock.datablock_size
+        targets = [block_id for run_start, run_len in new_runs
+                   for block_id in xrange(run_start, run_start + run_len)]
+        position = 0
+        for run_start, run_len in old_runs:
+            if run_start == 0:
+                # Not assigned blocks are read as zeros
+                data = '\0' * (run_len * block_size)
+            else:
+                data = self.device.read(superblock.cluster_offset(run_start), run_len * block_size)
+            for run_first, target_len in to_runs(targets[position:position + run_len]):
+                offset = (run_first - targets[position]) * block_size
+                self.device.write(superblock.cluster_offset(run_first),
+                                  data[offset:offset + target_len * block_size])
+            position += run_len
+        return position * block_size
+
+    def __relocate_file(self, inode_id):
+        "Moves the blocks of a regular file, the caller holds its write lock"
+        with self.__inode_locks_guard:
+            if self.__writers.get(inode_id):
+                return (0, 0, 0)
+        inode = self.inode_table.get_inode(inode_id)
+        if inode.i_ddate != 0 or inode.i_mode != 0 or self.inode_table.bitmap.is_free(inode_id):
+            return (0, 0, 0)
+        block_map = self.__block_map(inode)
+        owned = block_map.owned_runs()
+        before = self.__fragments(owned)
+        if before <= 1:
+            return (before, before, 0)
+        count = max(1, self.device.superblock.blocks_for_size(inode.i_size))
+        moved = Inode()
+        moved.i_flags = inode.i_flags
+        moved.i_size = inode.i_size
+        new_map = self.__block_map(moved)
+        try:
+            new_runs = new_map.map_runs(count)
+        except (ValueError, IOError):
+            return (before, before, 0)
+        after = self.__fragments(new_map.owned_runs())
+        if after >= before:
+            self.cluster_table.release(new_map.owned_runs())
+            return (before, before, 0)
+        copied = self.__copy_blocks(block_map.get_runs(count), new_runs)
+        new_map.store()
+        inode.i_blocks = moved.i_blocks
+        self.inode_table.write_inode(inode_id, inode)
+        self.cluster_table.release(owned)
+        return (before, after, copied)
 
-    def __init__(self, inode_id, rec_len, name_len, file_type, name):
-        self.inode_id = inode_id
-        self.rec_len = rec_len
-        self.name_len = name_len
-        self.file_type = file_type
-        self.name = name
+    def __relocate_directory(self, inode_id):
+        '''
+        Moves the blocks of a directory, the caller holds the namespace lock.
+        The first block of the root directory (cluster 0) is never moved.
+        '''
+        inode = self.inode_table.get_inode(inode_id)
+        if inode.i_ddate != 0 or self.inode_table.bitmap.is_free(inode_id):
+            return (0, 0, 0)
+        superblock = self.device.superblock
+        if any(inode.i_blocks[superblock.direct_blocks:]):
+            # Only the directories that fit in the direct pointers are moved
+            fragments = self.__fragments(self.__block_map(inode).owned_runs())
+            return (fragments, fragments, 0)
+        positions = [position for position in xrange(0, superblock.direct_blocks)
+                     if inode.i_blocks[position] != 0]
+        old_blocks = [inode.i_blocks[position] for position in positions]
+        before = self.__fragments((block_id, 1) for block_id in old_blocks)
+        if before <= 1:
+            return (before, before, 0)
+        try:
+            new_blocks = self.cluster_table.allocate(len(old_blocks))
+        except ValueError:
+            return (before, before, 0)
+        after = self.__fragments((block_id, 1) for block_id in new_blocks)
+        if after >= before:
+            self.cluster_table.release(to_runs(sorted(new_blocks)))
+            return (before, before, 0)
+        copied = self.__copy_blocks([(block_id, 1) for block_id in old_blocks],
+                                    [(block_id, 1) for block_id in new_blocks])
+        i_blocks = list(inode.i_blocks)
+        for position, block_id in zip(positions, new_blocks):
+            i_blocks[position] = block_id
+        inode.i_blocks = i_blocks
+        self.inode_table.write_inode(inode_id, inode)
+        self.cluster_table.release(to_runs(sorted(old_blocks)))
+        return (before, after, copied)
 
-    def __str__(self):
-        return "{0}, {1}, {2}, {3}, {4}".format(
-            self.inode_id, self.rec_len, self.name_len, self.file_type, self.name)
+    @timed('remove_directory')
+    def remove_directory(self, dir_name):
+        '''
+        Removes the directory and its child elements
+        '''
+        removed = list()
+        with self.__lock.write_locked():
+            inode_id = self.__find_entry(self.__current_inode_id, dir_name, 1)
+            if inode_id != -1:
+                self.__directory(self.__current_inode_id).remove_entry(dir_name, inode_id)
+                self.__remove_directory_rec(removed, inode_id)
+                self.dentry_cache.add(self.__current_inode_id, dir_name, 1, -1)
+        self.__free_inode_blocks(removed)
@@ -0,0 +1,28 @@
+import os
+import tempfile
+import unittest
+from FileSystem import FileSystem
+
+
+class FileSystemTestCase(unittest.TestCase):
+    '''
+    Base of the tests that work on a new File System image, created in a
+    temporary file before each test and removed after it. Subclasses can
+    override geometry() to format the image with their own SuperBlock.
+    '''
+
+    def geometry(self):
+        "The SuperBlock used to format the image, None for the default one"
+        return None
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".ext2")
+        os.close(handle)
+        self.fs_file = open(self.path, "r+b")
+        self.file_system = FileSystem(self.fs_file, True)
+        self.file_system._create_file_system(self.geometry())
+        self.superblock = self.file_system.device.superblock
+
+    def tearDown(self):
+        self.fs_file.close()
+        os.remove(self.path)
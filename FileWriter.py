@@ -0,0 +1,131 @@
+'''
+File-like object to write a file of the File System.
+'''
+import math
+from Settings import Settings
+from utilities import get_current_time_seconds
+
+
+class FileWriter(object):
+    '''
+    Write only, file-like access to a File System file. Written data is
+    buffered until "chunk_size" bytes are pending, then the blocks for it
+    are allocated at once and every run of contiguous clusters is written
+    with a single write. The inode is updated when the writer is closed,
+    the blocks past the end of a file that was overwritten are freed then.
+    The write lock of the file (a RWLock), if there is one, is taken by the
+    caller before reading the inode and released when the writer is closed,
+    then on_close() is called.
+    '''
+
+    def __init__(self, device, inode_table, block_map, inode_id, append=False,
+                 chunk_size=Settings.write_chunk_size, lock=None, on_close=None):
+        self.lock = lock
+        self.on_close = on_close
+        self.device = device
+        self.inode_table = inode_table
+        self.block_map = block_map
+        self.inode_id = inode_id
+        self.inode = block_map.inode
+        self.chunk_size = chunk_size
+        self.position = self.inode.i_size if append else 0
+        self.closed = False
+        self.__pending = list()
+        self.__pending_size = 0
+
+    def writable(self):
+        "The file can be written"
+        return True
+
+    def write(self, data):
+        "Writes the data at the end of the file"
+        self.__check_closed()
+        self.__pending.append(data)
+        self.__pending_size += len(data)
+        if self.__pending_size >= self.chunk_size:
+            self.__write_pending(False)
+
+    def writelines(self, lines):
+        "Writes every string of the iterable"
+        for line in lines:
+            self.write(line)
+
+    def tell(self):
+        "Returns the current position"
+        return self.position + self.__pending_size
+
+    def reserve(self, size):
+        '''
+        Assigns the blocks for the next "size" bytes in a single allocation,
+        so they get one run of clusters if there is a free one. The blocks
+        left past the end of the file are freed when the writer is closed.
+        '''
+        self.__check_closed()
+        if size <= 0:
+            return
+        end = self.tell() + size
+        self.block_map.map_blocks(self.device.superblock.blocks_for_size(end),
+                                  self.tell() / self.device.superblock.datablock_size)
+
+    def flush(self):
+        "Writes all the pending data to the blocks"
+        self.__check_closed()
+        self.__write_pending(True)
+
+    def close(self):
+        '''
+        Writes the pending data and updates the inode with the new size.
+        '''
+        if self.closed:
+            return
+        try:
+            self.__write_pending(True)
+        finally:
+            self.closed = True
+            self.inode.i_size = self.position
+            self.inode.i_mdate = get_current_time_seconds()
+            try:
+                self.block_map.truncate(self.device.superblock.blocks_for_size(self.position))
+                self.block_map.store()
+                self.inode_table.write_inode(self.inode_id, self.inode)
+            finally:
+                if self.lock is not None:
+                    self.lock.release_write()
+                if self.on_close is not None:
+                    self.on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __check_closed(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def __write_pending(self, write_all):
+        '''
+        Writes the pending data, keeping the last partial block pending
+        unless write_all is set.
+        '''
+        data = ''.join(self.__pending)
+        size = len(data)
+        block_size = self.device.superblock.datablock_size
+        if not write_all:
+            size -= (self.position + size) % block_size
+        if size <= 0:
+            return
+        first = self.position / block_size
+        count = int(math.ceil(float(self.position + size) / float(block_size)))
+        offset = self.position % block_size
+        written_bytes = 0
+        for run_start, run_len in self.block_map.map_runs(count, first):
+            run_size = min(run_len * block_size - offset, size - written_bytes)
+            self.device.write(self.device.superblock.cluster_offset(run_start) + offset,
+                              data[written_bytes:written_bytes + run_size])
+            written_bytes += run_size
+            offset = 0
+        self.position += size
+        self.__pending = [data[size:]] if size < len(data) else list()
+        self.__pending_size = len(data) - size
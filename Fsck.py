@@ -0,0 +1,317 @@
+'''
+Offline consistency checker of File System images:
+
+    python Fsck.py FS.ext2 [--repair] [--processes 4]
+
+The inode table is split in ranges checked by a pool of processes, every
+process maps the image read only and returns the clusters claimed by its
+inodes and the dir entries of its directories. The results are merged to
+cross-check the blocks bitmap, the directory tree and the file sizes.
+Exit status: 0 the image is clean, 1 all the problems were repaired, 4
+problems were left.
+'''
+import argparse
+import multiprocessing
+import sys
+import time
+from collections import OrderedDict
+from bitarray import bitarray
+from BlockDevice import BlockDevice
+from BlockMap import BlockMap
+from ClusterTable import ClusterTable
+from Directory import Directory
+from ExtentMap import ExtentMap
+from InodeBase import Inode
+from InodeTable import InodeTable
+from utilities import to_runs
+
+
+def check_inodes(task):
+    '''
+    Checks the inodes [first, stop) of the image at path, task is
+    (path, first, stop). Runs in the worker processes.
+    '''
+    path, first, stop = task
+    result = {'claims': list(), 'live': list(), 'edges': list(), 'deleted': list(),
+              'sizes': list(), 'surplus': list()}
+    with open(path, "rb") as fs_file:
+        device = BlockDevice(fs_file)
+        superblock = device.superblock
+        inode_table = InodeTable(device)
+        cluster_table = ClusterTable(device)
+        for inode_id in xrange(first, stop):
+            if inode_table.bitmap.is_free(inode_id):
+                continue
+            inode = inode_table.get_inode(inode_id)
+            if inode.i_ddate != 0:
+                result['deleted'].append(inode_id)
+                continue
+            result['live'].append((inode_id, inode.i_mode))
+            if inode.i_mode == 1:
+                owned = BlockMap(inode_table, cluster_table, inode).owned_runs()
+                # The first block of the root directory is cluster 0
+                if inode.i_blocks[0] == 0:
+                    owned.append((0, 1))
+                result['claims'].append((inode_id, owned))
+                directory = Directory(device, inode_table, cluster_table, inode_id)
+                for entry in directory.entries():
+                    if entry.name not in [".", ".."]:
+                        result['edges'].append((inode_id, entry.name, entry.inode_id,
+                                                entry.file_type))
+                continue
+            if inode.i_flags & Inode.extents_flag:
+                block_map = ExtentMap(inode_table, cluster_table, inode)
+            else:
+                block_map = BlockMap(inode_table, cluster_table, inode)
+            owned = block_map.owned_runs()
+            result['claims'].append((inode_id, owned))
+            needed = superblock.blocks_for_size(inode.i_size)
+            blocks = block_map.get_blocks(min(needed, block_map.max_blocks))
+            assigned = blocks.index(0, 1) if 0 in blocks[1:] else len(blocks)
+            if assigned < needed:
+                result['sizes'].append((inode_id, inode.i_size,
+                                        assigned * superblock.datablock_size))
+            # Files always own their first block, even when empty
+            surplus = sum(length for _, length in owned) - \
+                sum(length for _, length in block_map.cluster_runs(max(1, needed)))
+            if surplus > 0:
+                result['surplus'].append((inode_id, surplus))
+        device.close()
+    return result
+
+
+class Fsck(object):
+    '''
+    Checks an image and optionally repairs it:
+     - the clusters claimed by the live inodes against the blocks bitmap
+       (leaked clusters, clusters in use marked as free, clusters claimed
+       twice or outside the image)
+     - the dir entries: every live inode must be reachable from the root and
+       every entry must point to an allocated inode of the same type
+     - i_size against the blocks assigned to the file
+     - the free clusters and inodes counters of the superblock
+    Blocks past i_size and deleted inodes still allocated are warnings.
+    Repairing frees the leaked clusters, marks the clusters and inodes in
+    use as such, shrinks i_size to the assigned blocks and counts the free
+    clusters and inodes again. The other problems (clusters claimed twice,
+    unreachable inodes) are left, the image is checked again to find them.
+    '''
+
+    def __init__(self, path, processes=None, chunks_per_process=4):
+        self.path = path
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunks_per_process = chunks_per_process
+
+    def run(self, repair=False):
+        '''
+        Checks the image and returns the report:
+        {inodes, directories, clusters, problems, warnings, repaired, remaining, seconds}
+        "problems" are the ones found, "repaired" the ones fixed and
+        "remaining" the ones still in the image.
+        '''
+        start = time.time()
+        with open(self.path, "rb") as fs_file:
+            device = BlockDevice(fs_file)
+            superblock = device.superblock
+            inode_count = superblock.inode_max_elements
+            cluster_count = superblock.datablock_max_elements
+            free_clusters = ClusterTable(device).bitmap.data[:cluster_count]
+            free_inodes = InodeTable(device).bitmap.data[:inode_count].count(True)
+            counters = (superblock.free_clusters, superblock.free_inodes)
+            device.close()
+        results = self.__check_inodes(inode_count)
+        problems = list()
+        for name, stored, counted in [('clusters', counters[0], free_clusters.count(True)),
+                                      ('inodes', counters[1], free_inodes)]:
+            if stored != counted:
+                problems.append("The superblock counts {0} free {1}, the bitmap {2}".format(
+                    stored, name, counted))
+        warnings = list()
+        fixes = {'release': list(), 'claim': list(), 'inodes': list(), 'sizes': list()}
+        live = dict()
+        for result in results:
+            live.update(result['live'])
+        self.__check_clusters(results, cluster_count, free_clusters, problems, fixes)
+        self.__check_tree(results, live, problems, fixes)
+        for result in results:
+            for inode_id, size, assigned in result['sizes']:
+                problems.append("Inode {0}: i_size {1} is past its assigned blocks ({2} bytes)".format(
+                    inode_id, size, assigned))
+                fixes['sizes'].append((inode_id, assigned))
+            for inode_id, surplus in result['surplus']:
+                warnings.append("Inode {0}: {1} blocks past i_size".format(inode_id, surplus))
+        deleted = sum(len(result['deleted']) for result in results)
+        if deleted:
+            warnings.append("{0} deleted inodes are still allocated".format(deleted))
+        repaired = list()
+        remaining = problems
+        if repair and problems:
+            self.__repair(fixes)
+            remaining = self.run()['problems']
+            repaired = [problem for problem in problems if problem not in remaining]
+        return OrderedDict([
+            ('inodes', len(live)),
+            ('directories', sum(1 for mode in live.itervalues() if mode == 1)),
+            ('clusters', cluster_count - free_clusters.count(True)),
+            ('problems', problems),
+            ('warnings', warnings),
+            ('repaired', repaired),
+            ('remaining', remaining),
+            ('seconds', time.time() - start),
+        ])
+
+    def __check_inodes(self, inode_count):
+        "Splits the inode table in ranges checked by the process pool"
+        chunks = max(1, min(inode_count, self.processes * self.chunks_per_process))
+        size = -(-inode_count // chunks)
+        tasks = [(self.path, first, min(first + size, inode_count))
+                 for first in xrange(0, inode_count, size)]
+        if self.processes == 1:
+            return map(check_inodes, tasks)
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            return pool.map(check_inodes, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def __check_clusters(self, results, cluster_count, free_clusters, problems, fixes):
+        "Cross-checks the claimed clusters against the blocks bitmap"
+        claimed = bitarray(cluster_count)
+        claimed.setall(False)
+        owners = dict()
+        conflicts = list()
+        for result in results:
+            for inode_id, runs in result['claims']:
+                for run_start, run_len in runs:
+                    if run_start < 0 or run_start + run_len > cluster_count:
+                        problems.append("Inode {0}: cluster {1} is outside the image".format(
+                            inode_id, run_start))
+                        continue
+                    if claimed[run_start:run_start + run_len].any():
+                        conflicts.append((inode_id, run_start, run_len))
+                    claimed[run_start:run_start + run_len] = True
+        if conflicts:
+            # Second pass only to name the owners of the clusters claimed twice
+            wanted = set(cluster for _, run_start, run_len in conflicts
+                         for cluster in xrange(run_start, run_start + run_len))
+            for result in results:
+                for inode_id, runs in result['claims']:
+                    for run_start, run_len in runs:
+                        for cluster in xrange(run_start, run_start + run_len):
+                            if cluster in wanted:
+                                owners.setdefault(cluster, list()).append(inode_id)
+            for cluster in sorted(owners):
+                if len(owners[cluster]) > 1:
+                    problems.append("Cluster {0} is claimed by inodes {1}".format(
+                        cluster, ", ".join(str(owner) for owner in owners[cluster])))
+        # A set bit of the bitmap means free
+        for run_start, run_len in self.__runs(~free_clusters & ~claimed):
+            problems.append("Clusters {0}-{1} are in use but not claimed by any inode".format(
+                run_start, run_start + run_len - 1))
+            fixes['release'].append((run_start, run_len))
+        for run_start, run_len in self.__runs(free_clusters & claimed):
+            problems.append("Clusters {0}-{1} are claimed but marked as free".format(
+                run_start, run_start + run_len - 1))
+            fixes['claim'].append((run_start, run_len))
+
+    @staticmethod
+    def __runs(bits):
+        "Yields the runs of set bits as (first index, length)"
+        position = 0
+        while True:
+            try:
+                run_start = bits.index(True, position)
+            except ValueError:
+                return
+            try:
+                run_end = bits.index(False, run_start)
+            except ValueError:
+                run_end = len(bits)
+            yield (run_start, run_end - run_start)
+            position = run_end
+
+    def __check_tree(self, results, live, problems, fixes):
+        "Checks that the live inodes are reachable from the root and the dir entries"
+        children = dict()
+        for result in results:
+            for dir_id, name, child_id, file_type in result['edges']:
+                children.setdefault(dir_id, list()).append((name, child_id, file_type))
+        reachable = set([0])
+        pending = [0]
+        while pending:
+            dir_id = pending.pop()
+            for name, child_id, file_type in children.get(dir_id, list()):
+                if child_id not in live:
+                    continue
+                if live[child_id] != file_type:
+                    problems.append("Entry '{0}' of directory {1} has type {2}, inode {3} "
+                                    "has mode {4}".format(name, dir_id, file_type, child_id,
+                                                          live[child_id]))
+                if child_id not in reachable:
+                    reachable.add(child_id)
+                    if live[child_id] == 1:
+                        pending.append(child_id)
+        for inode_id in sorted(set(live) - reachable):
+            problems.append("Inode {0} is not reachable from the root directory".format(inode_id))
+        # Entries of deleted files are kept, only the ones to free inodes are wrong
+        allocated = set(live)
+        for result in results:
+            allocated.update(result['deleted'])
+        for dir_id in sorted(reachable):
+            for name, child_id, _ in children.get(dir_id, list()):
+                if child_id not in allocated:
+                    problems.append("Entry '{0}' of directory {1} points to the free inode "
+                                    "{2}".format(name, dir_id, child_id))
+                    fixes['inodes'].append(child_id)
+
+    def __repair(self, fixes):
+        "Applies the fixes to the image"
+        with open(self.path, "r+b") as fs_file:
+            device = BlockDevice(fs_file)
+            cluster_table = ClusterTable(device)
+            inode_table = InodeTable(device)
+            cluster_table.release(fixes['release'])
+            for run_start, run_len in fixes['claim']:
+                cluster_table.bitmap.set_range(run_start, run_len, 0)
+            for inode_id in fixes['inodes']:
+                inode_table.change_inode_state(inode_id, 0)
+            for inode_id, size in fixes['sizes']:
+                inode = inode_table.get_inode(inode_id)
+                inode.i_size = size
+                inode_table.write_inode(inode_id, inode)
+            cluster_table.flush()
+            inode_table.flush()
+            device.superblock.count_free(device)
+            device.superblock.write(device)
+            device.sync()
+            device.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Checks the consistency of a File System image")
+    parser.add_argument("path", help="image file")
+    parser.add_argument("-r", "--repair", action="store_true", help="repair the problems found")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="worker processes, default: number of CPUs")
+    args = parser.parse_args(argv)
+    report = Fsck(args.path, args.processes).run(args.repair)
+    for problem in report['problems']:
+        print "ERROR " + problem
+    for warning in report['warnings']:
+        print "WARNING " + warning
+    print "{0}: {1} inodes, {2} directories, {3} clusters in use, checked in {4:.1f} ms".format(
+        args.path, report['inodes'], report['directories'], report['clusters'],
+        report['seconds'] * 1000)
+    if not report['problems']:
+        return 0
+    if report['repaired']:
+        print "{0} problems repaired".format(len(report['repaired']))
+    if report['remaining']:
+        print "{0} problems left".format(len(report['remaining']))
+        return 4
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
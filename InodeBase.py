@@ -8,9 +8,19 @@ class Inode(object):
     '''
     Base Metadata Structure of an inode:
     Mode, File Size, Created Date, Accesed Date, Deleted Date
+    There are two on-disk formats: 1 (images without superblock) with 16 bit
+    block pointers and 2 with 32 bit block pointers, 64 bit size and flags.
     '''
-    _i_struct = '=iillll' + "h"*15
+    __slots__ = ('i_mode', 'i_size', 'i_cdate', 'i_adate', 'i_mdate', 'i_ddate', 'i_flags',
+                 'i_blocks', '__weakref__')
+    # i_flags: the blocks are mapped with extents instead of block pointers
+    extents_flag = 0x80000
+    i_formats = {1: '=iillll' + "h"*15, 2: '=iqllllI' + "I"*15}
+    _i_packers = dict((version, struct.Struct(i_format)) for version, i_format in i_formats.iteritems())
+    _i_struct = i_formats[1]
     i_struct_size = struct.calcsize(_i_struct)
+    i_fields = len(_i_struct) - 1
+    _i_packer = _i_packers[1]
 
     def __init__(self):
         self.i_mode = 0
@@ -19,41 +29,41 @@ class Inode(object):
         self.i_adate = 0
         self.i_mdate = calendar.timegm(time.gmtime())
         self.i_ddate = 0
+        self.i_flags = 0
         self.i_blocks = [0]*15
 
-    def to_binary(self):
+    @staticmethod
+    def struct_size(version=1):
+        "Size in bytes of an inode in the given format"
+        return Inode._i_packers[version].size
+
+    @staticmethod
+    def field_count(version=1):
+        "Number of struct fields of an inode in the given format"
+        return len(Inode.i_formats[version]) - 1
+
+    def to_binary(self, version=1):
         "Convert currents instance to bytes using struct.pack"
-        return struct.pack(Inode._i_struct, self.i_mode, self.i_size, self.i_cdate,
-                           self.i_adate, self.i_mdate, self.i_ddate, self.i_blocks[0],
-                           self.i_blocks[1], self.i_blocks[2], self.i_blocks[3], self.i_blocks[4],
-                           self.i_blocks[5], self.i_blocks[6], self.i_blocks[7], self.i_blocks[8],
-                           self.i_blocks[9], self.i_blocks[10], self.i_blocks[11], self.i_blocks[12],
-                           self.i_blocks[13], self.i_blocks[14])
+        if version == 1:
+            return Inode._i_packer.pack(self.i_mode, self.i_size, self.i_cdate, self.i_adate,
+                                        self.i_mdate, self.i_ddate, *self.i_blocks)
+        return Inode._i_packers[version].pack(self.i_mode, self.i_size, self.i_cdate,
+                                              self.i_adate, self.i_mdate, self.i_ddate,
+                                              self.i_flags, *self.i_blocks)
+
+    def from_binary(self, binary_inode, offset=0, version=1):
+        "Load struct data from buffer (starting at offset) and returns the Inode"
+        return self.from_values(Inode._i_packers[version].unpack_from(binary_inode, offset), version)
 
-    def from_binary(self, binary_inode):
-        "Load struct data from buffer and returns the Inode"
-        unpacked_data = struct.unpack(self._i_struct, binary_inode)
-        self.i_mode = unpacked_data[0]
-        self.i_size = unpacked_data[1]
-        self.i_cdate = unpacked_data[2]
-        self.i_adate = unpacked_data[3]
-        self.i_mdate = unpacked_data[4]
-        self.i_ddate = unpacked_data[5]
-        self.i_blocks[0] = unpacked_data[6]
-        self.i_blocks[1] = unpacked_data[7]
-        self.i_blocks[2] = unpacked_data[8]
-        self.i_blocks[3] = unpacked_data[9]
-        self.i_blocks[4] = unpacked_data[10]
-        self.i_blocks[5] = unpacked_data[11]
-        self.i_blocks[6] = unpacked_data[12]
-        self.i_blocks[7] = unpacked_data[13]
-        self.i_blocks[8] = unpacked_data[14]
-        self.i_blocks[9] = unpacked_data[15]
-        self.i_blocks[10] = unpacked_data[16]
-        self.i_blocks[11] = unpacked_data[17]
-        self.i_blocks[12] = unpacked_data[18]
-        self.i_blocks[13] = unpacked_data[19]
-        self.i_blocks[14] = unpacked_data[20]
+    def from_values(self, values, version=1):
+        "Load the inode from the sequence of unpacked struct fields and returns the Inode"
+        self.i_mode, self.i_size, self.i_cdate, self.i_adate, self.i_mdate, self.i_ddate = values[:6]
+        if version == 1:
+            self.i_flags = 0
+            self.i_blocks = list(values[6:Inode.i_fields])
+        else:
+            self.i_flags = values[6]
+            self.i_blocks = list(values[7:Inode.field_count(version)])
         return self
 
     def __str__(self):
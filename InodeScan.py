@@ -0,0 +1,61 @@
+'''
+Column view of the whole Inode Table, used for queries over all the inodes.
+'''
+import struct
+from InodeBase import Inode
+
+
+class InodeScan(object):
+    '''
+    The whole inode table unpacked at once. Every column is a tuple indexed
+    by inode id, so queries over all the inodes are done on plain tuples
+    instead of one Inode object per record.
+    '''
+
+    def __init__(self, data, count, free_bitmap, version=1):
+        self.count = count
+        self.version = version
+        values = struct.unpack('=' + Inode.i_formats[version][1:] * count, data)
+        self.__values = values
+        fields = Inode.field_count(version)
+        self.i_mode = values[0::fields]
+        self.i_size = values[1::fields]
+        self.i_cdate = values[2::fields]
+        self.i_adate = values[3::fields]
+        self.i_mdate = values[4::fields]
+        self.i_ddate = values[5::fields]
+        # A cleared bit in the bitmap means the inode is in use
+        self.in_use = tuple((~free_bitmap[:count]).tolist())
+
+    def get_inode(self, inode_id):
+        "Returns the Inode object of the given id"
+        fields = Inode.field_count(self.version)
+        return Inode().from_values(self.__values[inode_id * fields:(inode_id + 1) * fields],
+                                   self.version)
+
+    def live(self, mode=None):
+        '''
+        Returns the ids of the inodes in use that are not deleted,
+        only the ones with the given mode (0 => file, 1 => directory) if it is set.
+        '''
+        return [inode_id for inode_id in xrange(0, self.count)
+                if self.in_use[inode_id] and self.i_ddate[inode_id] == 0 and
+                (mode is None or self.i_mode[inode_id] == mode)]
+
+    def live_files(self):
+        "Returns the ids of the regular files that are not deleted"
+        return self.live(0)
+
+    def live_directories(self):
+        "Returns the ids of the directories that are not deleted"
+        return self.live(1)
+
+    def deleted(self):
+        "Returns the ids of the inodes with a deleted date"
+        return [inode_id for inode_id in xrange(0, self.count) if self.i_ddate[inode_id] != 0]
+
+    def total_size(self, inode_ids=None):
+        "Returns the sum of the size of the inodes, by default the live files"
+        if inode_ids is None:
+            inode_ids = self.live_files()
+        return sum(self.i_size[inode_id] for inode_id in inode_ids)
@@ -2,104 +2,232 @@
 Author: Cesar Bonilla
 Module to handle all the Inode Table Operations and Indirect Blocks
 '''
+import logging
 import struct
+import threading
+import weakref
+from collections import OrderedDict
 from InodeBase import Inode
+from InodeScan import InodeScan
 from Settings import Settings
-from bitarray import bitarray
+from Bitmap import Bitmap
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 
 class InodeTable(object):
-    "Inode Table API to perform Read & Write Operations"
+    '''
+    Inode Table API to perform Read & Write Operations.
+    Inodes are kept in a bounded LRU cache, written inodes are marked as
+    dirty and written back on flush or when they are evicted. An evicted
+    inode still in use (by an open reader) is returned again instead of a
+    new copy, so the changes made to the inode reach every user.
+    The cache and the bitmap are guarded by a lock, so the table can be
+    shared by several threads.
+    '''
 
-    def __init__(self, file_object):
-        self.file_object = file_object
+    def __init__(self, device, cache_capacity=Settings.inode_cache_size):
+        self.device = device
+        self.superblock = device.superblock
+        self.bitmap = Bitmap(device, self.superblock.inode_bitmap_offset,
+                             self.superblock.inode_bitmap_size)
+        self.cache_capacity = max(1, cache_capacity)
+        self.__cache = OrderedDict()
+        self.__dirty = set()
+        # The Inode objects still referenced, cached or not
+        self.__in_use = weakref.WeakValueDictionary()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self.__lock = threading.RLock()
 
     def get_root_inode(self):
         '''
         Get Inode at position 0
         '''
-        self.file_object.seek(Settings.inode_table_offset)
-        binary_inode = self.file_object.read(Settings.inode_size)
-        inode = Inode().from_binary(binary_inode)
-        return inode
+        return self.get_inode(0)
 
     def get_inode(self, inode_id):
         '''
         Read the Inode with the specified id
         '''
-        self.file_object.seek(Settings.inode_table_offset)
-        inode_offset = inode_id * Settings.inode_size
-        self.file_object.seek(inode_offset, 1)
-        i_bytes = self.file_object.read(Settings.inode_size)
-        inode = Inode().from_binary(i_bytes)
-        return inode
+        with self.__lock:
+            inode = self.__cache.pop(inode_id, None)
+            if inode is None:
+                inode = self.__in_use.get(inode_id)
+            if inode is not None:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+                self.device.metrics.count('inode_loads')
+                i_bytes = self.device.view(self.__inode_offset(inode_id), self.superblock.inode_size)
+                inode = Inode().from_binary(i_bytes, 0, self.superblock.version)
+                self.__in_use[inode_id] = inode
+            self.__cache_inode(inode_id, inode)
+            return inode
 
     def write_inode(self, index, inode):
         '''
         Writes the inode to the indicated position(inode_id).
+        The write is deferred until the next flush or until it is evicted.
+        '''
+        with self.__lock:
+            self.__cache.pop(index, None)
+            self.__cache_inode(index, inode)
+            self.__in_use[index] = inode
+            self.__dirty.add(index)
+            return True
+
+    def __cache_inode(self, inode_id, inode):
+        "Inserts the inode as the most recently used, evicting the oldest one"
+        self.__cache[inode_id] = inode
+        while len(self.__cache) > self.cache_capacity:
+            evicted_id, evicted_inode = self.__cache.popitem(last=False)
+            if evicted_id in self.__dirty:
+                self.__dirty.discard(evicted_id)
+                self.__write_inodes(evicted_id, [evicted_inode])
+            self.cache_evictions += 1
+
+    def __inode_offset(self, inode_id):
+        "Returns the offset of the inode in the image"
+        return self.superblock.inode_table_offset + self.superblock.inode_size * inode_id
+
+    def __write_inodes(self, first_id, inodes):
+        "Writes a run of consecutive inodes with a single write"
+        self.device.metrics.count('inode_writes', len(inodes))
+        self.device.write(self.__inode_offset(first_id),
+                          ''.join(inode.to_binary(self.superblock.version) for inode in inodes))
+
+    def flush_inodes(self):
+        '''
+        Writes back the dirty inodes in table order, one write per run of
+        consecutive inode ids.
+        '''
+        with self.__lock:
+            dirty = sorted(self.__dirty)
+            run = list()
+            for index, inode_id in enumerate(dirty):
+                run.append(self.__cache[inode_id])
+                if index + 1 == len(dirty) or dirty[index + 1] != inode_id + 1:
+                    self.__write_inodes(inode_id - len(run) + 1, run)
+                    run = list()
+            self.__dirty.clear()
+
+    def __read_table(self):
+        '''
+        Reads the whole inode table with a single read, the cached inodes
+        replace their on-disk copy since they may be newer.
+        '''
+        with self.__lock:
+            self.device.metrics.count('inode_table_scans')
+            inode_size = self.superblock.inode_size
+            data = bytearray(self.device.read(self.superblock.inode_table_offset,
+                                              self.superblock.inode_table_size))
+            for inode_id, inode in self.__cache.iteritems():
+                offset = inode_id * inode_size
+                data[offset:offset + inode_size] = inode.to_binary(self.superblock.version)
+            return str(data)
+
+    def scan(self):
         '''
-        self.file_object.seek(Settings.inode_table_offset + (Settings.inode_size * index))
-        self.file_object.write(inode.to_binary())
-        return True
+        Returns an InodeScan with the whole inode table to run queries over all the inodes.
+        '''
+        with self.__lock:
+            return InodeScan(self.__read_table(), self.superblock.inode_max_elements,
+                             self.bitmap.data, self.superblock.version)
+
+    def load_all(self):
+        '''
+        Returns the list with all the inodes of the table, read with a single read.
+        '''
+        data = self.__read_table()
+        return [Inode().from_binary(data, inode_id * self.superblock.inode_size,
+                                    self.superblock.version)
+                for inode_id in xrange(0, self.superblock.inode_max_elements)]
+
+    def cache_stats(self):
+        "Returns the inode cache counters"
+        with self.__lock:
+            return {
+                'capacity': self.cache_capacity,
+                'size': len(self.__cache),
+                'dirty': len(self.__dirty),
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'evictions': self.cache_evictions,
+            }
 
-    def get_free_inode_index(self):
+    def get_free_inode_index(self, group=0):
         '''
-        Reads and return the first inode element that is free
+        Reads and return the first inode element that is free, searching
+        from the start of the block group and then in the following groups.
         '''
-        self.file_object.seek(Settings.inode_bitmap_offset)
-        bitmap_bytes = self.file_object.read(Settings.inode_bitmap_size)
-        data = bitarray()
-        data.frombytes(bitmap_bytes)
-        try:
-            free_inode_position = data.index(True)
-            return free_inode_position
-        except ValueError:
+        with self.__lock:
+            start = self.superblock.group_inodes(group)[0]
+            for first, stop in [(start, self.superblock.inode_max_elements), (0, start)]:
+                try:
+                    return self.bitmap.first_free(first, stop)
+                except ValueError:
+                    continue
             raise ValueError("No more free Inodes, please delete some files")
 
-    def get_free_inode(self):
-        "Returns the next free inode"
-        index = self.get_free_inode_index()
-        return (index, self.get_inode(index))
+    def get_free_inode(self, group=0):
+        "Returns the next free inode of the block group (or the following ones)"
+        with self.__lock:
+            index = self.get_free_inode_index(group)
+            return (index, self.get_inode(index))
+
+    def free_per_group(self):
+        "Returns how many inodes of every block group are free"
+        with self.__lock:
+            return [self.bitmap.count_free(*self.superblock.group_inodes(group))
+                    for group in xrange(0, self.superblock.group_count)]
 
     def change_inode_state(self, inode_id, state):
         '''
         Stablish the inode as occupied or free, will set the bit to 0 in the bitmap
         '''
-        self.file_object.seek(Settings.inode_bitmap_offset)
-        bitmap_bytes = self.file_object.read(Settings.inode_bitmap_size)
-        data = bitarray()
-        data.frombytes(bitmap_bytes)
-        try:
-            data[inode_id] = state
-            self.file_object.seek(Settings.inode_bitmap_offset)
-            self.file_object.write(data.tobytes())
-        except ValueError:
-            raise ValueError("Unable to set inode as occupied or free")
+        with self.__lock:
+            try:
+                self.superblock.change_free(inodes=self.bitmap.set_state(inode_id, state))
+            except (ValueError, IndexError):
+                raise ValueError("Unable to set inode as occupied or free")
+
+    def flush(self):
+        '''
+        Writes the changed bytes of the inodes bitmap, the free counters and
+        the dirty inodes back to disk.
+        '''
+        with self.__lock:
+            self.bitmap.flush()
+            self.superblock.flush(self.device)
+            self.flush_inodes()
+
+    def sync(self):
+        '''
+        Flushes the inodes bitmap and inodes and forces them to the storage device.
+        '''
+        self.flush()
+        self.device.sync()
 
     def get_indirect_blocks(self, block_id):
         'Returns the array block_ids stored in the block.'
-        indirect_block_offset = Settings.datablock_region_offset
-        indirect_block_offset += Settings.datablock_size * block_id
-        self.file_object.seek(indirect_block_offset)
-        binary_data = self.file_object.read(Settings.datablock_size)
-        print len(binary_data)
-        unpack_mask = '=' + 'i' * Settings.max_indirect_blocks
-        print unpack_mask
+        self.device.metrics.count('indirect_block_reads')
+        binary_data = self.device.read_blocks(block_id)
+        unpack_mask = '=' + self.superblock.pointer_format * self.superblock.max_indirect_blocks
         __blocks = struct.unpack(unpack_mask, binary_data)
         blocks = []
         for block in __blocks:
             blocks.append(int(block))
-            print "indirect block {0}".format(block)
+        logger.debug("indirect block %s: %s", block_id, blocks)
         return blocks
 
     def set_indirect_blocks(self, block_id, indirect_blocks):
         'Writes the array of indirect blocks into the specified block.'
         if block_id == 0:
             return
-        indirect_block_offset = Settings.datablock_region_offset
-        indirect_block_offset += Settings.datablock_size * block_id
-        self.file_object.seek(indirect_block_offset)
-        data = ''
-        for indirect_block in indirect_blocks:
-            data += struct.pack('=i', indirect_block)
-        self.file_object.write(data)
+        indirect_block_offset = self.superblock.cluster_offset(block_id)
+        data = struct.pack('=' + self.superblock.pointer_format * len(indirect_blocks),
+                           *indirect_blocks)
+        self.device.write(indirect_block_offset, data)
@@ -0,0 +1,83 @@
+'''
+I/O counters and operation latencies of the File System.
+'''
+import bisect
+import functools
+import threading
+import time
+from collections import defaultdict
+
+
+class Metrics(object):
+    '''
+    Counters (reads, writes, seeks, bytes read and written, bitmap scans,
+    inode loads, dir entries parsed...) and a latency histogram per
+    File System operation. Safe to update from several threads.
+    '''
+    # Upper bound, in seconds, of the latency histogram buckets
+    latency_buckets = (0.0001, 0.001, 0.01, 0.1, 1.0)
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.latencies = dict()
+        self.__lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        "Adds amount to the counter"
+        with self.__lock:
+            self.counters[name] += amount
+
+    def observe(self, operation, seconds):
+        "Records the latency of one call of the operation"
+        with self.__lock:
+            latency = self.latencies.get(operation)
+            if latency is None:
+                latency = {'count': 0, 'total': 0.0, 'max': 0.0,
+                           'buckets': [0] * (len(Metrics.latency_buckets) + 1)}
+                self.latencies[operation] = latency
+            latency['count'] += 1
+            latency['total'] += seconds
+            latency['max'] = max(latency['max'], seconds)
+            latency['buckets'][bisect.bisect_left(Metrics.latency_buckets, seconds)] += 1
+
+    def snapshot(self):
+        '''
+        Returns a copy of the counters and latencies:
+        {'counters': {name: value}, 'latencies': {operation: {count, total, mean, max, buckets}}}
+        where buckets maps the upper bound in seconds ('inf' for the last one) to the calls count.
+        '''
+        with self.__lock:
+            labels = [str(bound) for bound in Metrics.latency_buckets] + ['inf']
+            latencies = dict()
+            for operation, latency in self.latencies.iteritems():
+                latencies[operation] = {
+                    'count': latency['count'],
+                    'total': latency['total'],
+                    'mean': latency['total'] / latency['count'],
+                    'max': latency['max'],
+                    'buckets': dict(zip(labels, latency['buckets'])),
+                }
+            return {'counters': dict(self.counters), 'latencies': latencies}
+
+    def reset(self):
+        "Sets all the counters and latencies back to zero"
+        with self.__lock:
+            self.counters.clear()
+            self.latencies.clear()
+
+
+def timed(operation):
+    '''
+    Decorator for the methods of an object with a "metrics" attribute,
+    records the latency of every call under the operation name.
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(operation, time.time() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,70 @@
+'''
+Standalone entry point to create a new File System image:
+
+    python Mkfs.py FS.ext2 [--block-size 4096] [--clusters 65536] [--inodes 1024] [--extents]
+'''
+import argparse
+import os
+import sys
+import time
+from BlockDevice import BlockDevice
+from FileSystem import FileSystem
+from Settings import Settings
+from SuperBlock import SuperBlock
+
+
+def make_file_system(path, superblock=None):
+    '''
+    Creates the File System image at path with the geometry of the
+    superblock (Settings by default), an existing file is overwritten.
+    The zeroed regions are not written, so the image is a sparse file.
+    '''
+    mode = "r+b" if os.path.isfile(path) else "w+b"
+    with open(path, mode) as fs_file:
+        device = BlockDevice(fs_file)
+        FileSystem(device, True)._create_file_system(superblock)
+        device.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Creates a File System image")
+    parser.add_argument("path", help="image file")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="overwrite the image if it exists")
+    parser.add_argument("-b", "--block-size", type=int, default=Settings.datablock_size,
+                        help="block size in bytes, default: {0}".format(Settings.datablock_size))
+    parser.add_argument("-c", "--clusters", type=int, default=Settings.datablock_max_elements,
+                        help="number of data blocks, default: {0}".format(
+                            Settings.datablock_max_elements))
+    parser.add_argument("-i", "--inodes", type=int, default=Settings.inode_max_elements,
+                        help="number of inodes, default: {0}".format(Settings.inode_max_elements))
+    parser.add_argument("-g", "--blocks-per-group", type=int, default=None,
+                        help="data blocks per block group, default: 8 * block size")
+    parser.add_argument("--extents", action="store_true",
+                        help="new files map their blocks with extents")
+    parser.add_argument("--legacy", action="store_true",
+                        help="image without superblock and with 16 bit block pointers")
+    args = parser.parse_args(argv)
+    try:
+        if args.legacy and args.extents:
+            raise ValueError("Images without superblock don't support extents")
+        if args.legacy:
+            superblock = SuperBlock.legacy()
+        else:
+            superblock = SuperBlock(args.block_size, args.clusters, args.inodes,
+                                    args.extents, args.blocks_per_group)
+    except ValueError as error:
+        print error
+        return 1
+    if os.path.exists(args.path) and not args.force:
+        print "'{0}' already exists, use --force to overwrite it".format(args.path)
+        return 1
+    start = time.time()
+    make_file_system(args.path, superblock)
+    print "File system created at '{0}' in {1:.1f} ms".format(
+        args.path, (time.time() - start) * 1000)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+'''
+Reader/writer lock used to share the File System between threads.
+'''
+import thread
+import threading
+from contextlib import contextmanager
+
+
+class RWLock(object):
+    '''
+    Many readers or a single writer. Waiting writers go before new readers,
+    so a stream of readers can't starve them. Both locks are reentrant and
+    the writer can also take the read lock, but a reader can't become the
+    writer: it would wait for itself.
+    The write lock can be released by another thread than the one that
+    took it (e.g. a file opened in one thread and closed in another).
+    '''
+
+    def __init__(self):
+        self.__condition = threading.Condition(threading.Lock())
+        self.__readers = dict()
+        self.__writer = None
+        self.__writer_depth = 0
+        self.__waiting_writers = 0
+
+    def acquire_read(self):
+        "Waits until there is no writer and takes the lock for reading"
+        me = thread.get_ident()
+        with self.__condition:
+            if self.__writer == me or me in self.__readers:
+                self.__readers[me] = self.__readers.get(me, 0) + 1
+                return
+            while self.__writer is not None or self.__waiting_writers:
+                self.__condition.wait()
+            self.__readers[me] = 1
+
+    def release_read(self):
+        "Releases the read lock of the current thread"
+        me = thread.get_ident()
+        with self.__condition:
+            depth = self.__readers[me] - 1
+            if depth:
+                self.__readers[me] = depth
+                return
+            del self.__readers[me]
+            if not self.__readers and self.__waiting_writers:
+                self.__condition.notify_all()
+
+    def acquire_write(self):
+        "Waits until there are no readers nor writer and takes the lock for writing"
+        me = thread.get_ident()
+        with self.__condition:
+            if self.__writer == me:
+                self.__writer_depth += 1
+                return
+            if me in self.__readers:
+                raise RuntimeError("A read lock can't be upgraded to a write lock")
+            self.__waiting_writers += 1
+            try:
+                while self.__writer is not None or self.__readers:
+                    self.__condition.wait()
+            finally:
+                self.__waiting_writers -= 1
+            self.__writer = me
+            self.__writer_depth = 1
+
+    def release_write(self):
+        "Releases the write lock"
+        with self.__condition:
+            if self.__writer is None:
+                raise RuntimeError("The write lock is not held")
+            self.__writer_depth -= 1
+            if self.__writer_depth == 0:
+                self.__writer = None
+                self.__condition.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        "Holds the read lock in a with block"
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        "Holds the write lock in a with block"
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
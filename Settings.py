@@ -15,3 +15,13 @@ class Settings(object):
     inode_table_offset = datablock_bitmap_size + inode_bitmap_size
     datablock_region_offset = inode_table_offset + inode_table_size
     max_indirect_blocks = int(float(datablock_size) / 4.0)
+    inode_cache_size = 128
+    dentry_cache_size = 1024
+    read_chunk_size = 4096
+    write_chunk_size = 4096
+    batch_buffer_size = 4 * 1024 * 1024
+    async_max_in_flight = 4
+    buffer_cache_size = 1024 * 1024
+    readahead_blocks = 64
+    transfer_threads = 4
+    transfer_window = 16
@@ -0,0 +1,219 @@
+'''
+Module to handle the superblock, the geometry of a File System image.
+'''
+import math
+import struct
+import threading
+from bitarray import bitarray
+from InodeBase import Inode
+from Settings import Settings
+
+
+class SuperBlock(object):
+    '''
+    Block size, number of clusters and inodes and the offset of every region
+    of an image. It is stored in the first "size" bytes of the image and read
+    at mount. Images created before the superblock existed have none, they
+    use the fixed geometry of Settings and the inode format 1.
+
+    Layout: superblock, blocks bitmap, inodes bitmap, inode table and the
+    data region, which starts at a block boundary.
+
+    The clusters and inodes are split in block groups of "blocks_per_group"
+    clusters and "inodes_per_group" inodes, each group uses its own slice of
+    both bitmaps and of the inode table. Legacy images are a single group.
+
+    The free clusters and inodes are counted in the superblock, the tables
+    update the counters with every change of the bitmaps and write them
+    back on flush, so the free space is known without reading the bitmaps.
+    Images without stored counters (legacy ones and the ones written before
+    the counters) count the bitmaps once when they are mounted.
+    '''
+    magic = 'PYEXT2SB'
+    size = 1024
+    _sb_mask = '=8s' + 'I' * 15
+    # Features: new regular files map their blocks with extents
+    extents_feature = 0x1
+    # Features: the free clusters and inodes counters are stored
+    free_counts_feature = 0x2
+    min_block_size = 64
+    max_block_size = 4096
+    # Dir entries store the inode id as a signed 16 bit number
+    max_inodes = 32767
+    max_clusters = 2 ** 32 - 1
+
+    def __init__(self, block_size=Settings.datablock_size,
+                 cluster_count=Settings.datablock_max_elements,
+                 inode_count=Settings.inode_max_elements, extents=False,
+                 blocks_per_group=None):
+        if block_size < SuperBlock.min_block_size or block_size > SuperBlock.max_block_size or \
+                block_size & (block_size - 1):
+            raise ValueError("The block size must be a power of 2 between {0} and {1}".format(
+                SuperBlock.min_block_size, SuperBlock.max_block_size))
+        if cluster_count < 2 or cluster_count > SuperBlock.max_clusters:
+            raise ValueError("The number of clusters must be between 2 and {0}".format(
+                SuperBlock.max_clusters))
+        if inode_count < 2 or inode_count > SuperBlock.max_inodes:
+            raise ValueError("The number of inodes must be between 2 and {0}".format(
+                SuperBlock.max_inodes))
+        if blocks_per_group is None:
+            # Like ext2, as many clusters as bits in a block of the bitmap
+            blocks_per_group = block_size * 8
+        if blocks_per_group < 8 or blocks_per_group % 8:
+            raise ValueError("The clusters per group must be a multiple of 8")
+        self.blocks_per_group = min(blocks_per_group, cluster_count)
+        self.version = 2
+        self.features = SuperBlock.free_counts_feature
+        if extents:
+            self.features |= SuperBlock.extents_feature
+        self.datablock_size = block_size
+        self.datablock_max_elements = cluster_count
+        self.inode_max_elements = inode_count
+        # The bitmaps of a new image are all free
+        self.free_clusters = cluster_count
+        self.free_inodes = inode_count
+        self.__counters_dirty = False
+        self.__lock = threading.Lock()
+        self.inode_size = Inode.struct_size(self.version)
+        self.datablock_bitmap_offset = SuperBlock.size
+        self.datablock_bitmap_size = int(math.ceil(cluster_count / 8.0))
+        self.inode_bitmap_offset = self.datablock_bitmap_offset + self.datablock_bitmap_size
+        self.inode_bitmap_size = int(math.ceil(inode_count / 8.0))
+        self.inode_table_offset = self.inode_bitmap_offset + self.inode_bitmap_size
+        data_offset = self.inode_table_offset + self.inode_size * inode_count
+        self.datablock_region_offset = int(math.ceil(float(data_offset) / block_size)) * block_size
+        self.__update()
+
+    def __update(self):
+        "Computes the values derived from the stored ones"
+        self.inode_table_size = self.inode_size * self.inode_max_elements
+        self.datablock_region_size = self.datablock_max_elements * self.datablock_size
+        # Block pointers stored in an indirect block
+        self.pointer_format = 'i' if self.version == 1 else 'I'
+        self.max_indirect_blocks = self.datablock_size / struct.calcsize(self.pointer_format)
+        # i_blocks: direct pointers followed by the single (double, triple) indirect ones
+        self.indirect_levels = 1 if self.version == 1 else 3
+        self.direct_blocks = 15 - self.indirect_levels
+        # Images written before the block groups have a single group
+        if self.blocks_per_group == 0:
+            self.blocks_per_group = self.datablock_max_elements
+        self.group_count = -(-self.datablock_max_elements // self.blocks_per_group)
+        self.inodes_per_group = -(-self.inode_max_elements // self.group_count)
+
+    @staticmethod
+    def legacy():
+        "Returns the geometry of the images without superblock"
+        superblock = SuperBlock()
+        superblock.version = 1
+        superblock.inode_size = Inode.struct_size(1)
+        superblock.blocks_per_group = 0
+        for name in ['datablock_bitmap_offset', 'datablock_bitmap_size', 'inode_bitmap_offset',
+                     'inode_bitmap_size', 'inode_table_offset', 'datablock_region_offset']:
+            setattr(superblock, name, getattr(Settings, name))
+        superblock.__update()
+        return superblock
+
+    @staticmethod
+    def read(device):
+        "Reads the superblock of the image, the legacy geometry if it has none"
+        if device.size() < SuperBlock.size or \
+                device.read(0, len(SuperBlock.magic)) != SuperBlock.magic:
+            superblock = SuperBlock.legacy()
+            # Images written by older versions can be a few bytes short of
+            # image_size(), the bitmaps are there as long as the inode table starts
+            if device.size() >= superblock.inode_table_offset:
+                superblock.count_free(device)
+            return superblock
+        values = struct.unpack_from(SuperBlock._sb_mask, device.read(0, SuperBlock.size))
+        superblock = SuperBlock()
+        (_, superblock.version, superblock.datablock_size, superblock.datablock_max_elements,
+         superblock.inode_max_elements, superblock.inode_size,
+         superblock.datablock_bitmap_offset, superblock.datablock_bitmap_size,
+         superblock.inode_bitmap_offset, superblock.inode_bitmap_size,
+         superblock.inode_table_offset, superblock.datablock_region_offset,
+         superblock.features, superblock.blocks_per_group,
+         superblock.free_clusters, superblock.free_inodes) = values
+        if superblock.version not in Inode.i_formats:
+            raise IOError("Unsupported File System version {0}".format(superblock.version))
+        superblock.__update()
+        if not superblock.features & SuperBlock.free_counts_feature:
+            superblock.count_free(device)
+            superblock.features |= SuperBlock.free_counts_feature
+            superblock.__counters_dirty = True
+        return superblock
+
+    def write(self, device):
+        "Writes the superblock at the start of the image, legacy images have none"
+        if self.version == 1:
+            return
+        data = struct.pack(SuperBlock._sb_mask, SuperBlock.magic, self.version,
+                           self.datablock_size, self.datablock_max_elements,
+                           self.inode_max_elements, self.inode_size,
+                           self.datablock_bitmap_offset, self.datablock_bitmap_size,
+                           self.inode_bitmap_offset, self.inode_bitmap_size,
+                           self.inode_table_offset, self.datablock_region_offset,
+                           self.features, self.blocks_per_group,
+                           self.free_clusters, self.free_inodes)
+        device.write(0, data.ljust(SuperBlock.size, '\0'))
+
+    def count_free(self, device):
+        "Sets the free clusters and inodes counters from the bitmaps of the image"
+        for name, offset, size, count in [
+                ('free_clusters', self.datablock_bitmap_offset, self.datablock_bitmap_size,
+                 self.datablock_max_elements),
+                ('free_inodes', self.inode_bitmap_offset, self.inode_bitmap_size,
+                 self.inode_max_elements)]:
+            bits = bitarray()
+            bits.frombytes(device.read(offset, size))
+            setattr(self, name, bits[:count].count(True))
+
+    def change_free(self, clusters=0, inodes=0):
+        "Adds the changes to the free clusters and inodes counters"
+        if clusters == 0 and inodes == 0:
+            return
+        with self.__lock:
+            self.free_clusters += clusters
+            self.free_inodes += inodes
+            self.__counters_dirty = True
+
+    def flush(self, device):
+        "Writes the superblock back if the counters changed since the last flush"
+        with self.__lock:
+            if not self.__counters_dirty:
+                return
+            self.__counters_dirty = False
+            self.write(device)
+
+    def has_extents(self):
+        "True if new regular files map their blocks with extents"
+        return bool(self.features & SuperBlock.extents_feature)
+
+    def group_of_cluster(self, block_id):
+        "Returns the block group of the cluster"
+        return block_id / self.blocks_per_group
+
+    def group_of_inode(self, inode_id):
+        "Returns the block group of the inode"
+        return inode_id / self.inodes_per_group
+
+    def group_clusters(self, group):
+        "Returns the [first, last) clusters of the block group"
+        start = group * self.blocks_per_group
+        return (start, min(start + self.blocks_per_group, self.datablock_max_elements))
+
+    def group_inodes(self, group):
+        "Returns the [first, last) inodes of the block group"
+        start = group * self.inodes_per_group
+        return (start, min(start + self.inodes_per_group, self.inode_max_elements))
+
+    def image_size(self):
+        "Returns the size in bytes of the whole image"
+        return self.datablock_region_offset + self.datablock_region_size
+
+    def cluster_offset(self, block_id):
+        "Returns the Cluster offset in the whole storage device"
+        return self.datablock_region_offset + block_id * self.datablock_size
+
+    def blocks_for_size(self, size):
+        "Returns how many data blocks are needed to store 'size' bytes"
+        return int(math.ceil(float(size) / float(self.datablock_size)))
@@ -0,0 +1,213 @@
+'''
+Bulk copy of directory trees between the host and a File System image:
+
+    python Transfer.py FS.ext2 import HOST_DIR [IMAGE_DIR]
+    python Transfer.py FS.ext2 export IMAGE_DIR HOST_DIR
+
+The host files are read and written by a pool of threads while the image
+is used from the calling thread, in a single batch.
+'''
+import argparse
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+from FileSystem import FileSystem
+from Settings import Settings
+from utilities import format_transfer
+
+
+class Transfer(object):
+    '''
+    Imports host directory trees into a File System and exports them back.
+    The host side runs on "threads" threads with up to "window" files held
+    in memory, the image side runs in the calling thread inside a batch, so
+    the inodes, bitmaps and dir entries are written once at the end (see
+    FileSystem.batch). Every imported file gets its clusters in a single
+    allocation, contiguous when there is a free run that fits.
+
+        report = Transfer(file_system).import_tree("photos", "/photos")
+    '''
+
+    def __init__(self, file_system, threads=Settings.transfer_threads,
+                 window=Settings.transfer_window, extents=None):
+        self.file_system = file_system.handle()
+        self.threads = threads
+        self.window = window
+        self.extents = extents
+
+    def import_tree(self, host_dir, image_dir="."):
+        '''
+        Copies the host directory tree into the image directory, creating
+        the missing directories and overwriting the existing files. A name
+        that doesn't fit in its directory raises IOError with its path.
+        Returns the report: {files, directories, bytes, seconds}
+        '''
+        start = time.time()
+        report = OrderedDict([('files', 0), ('directories', 0), ('bytes', 0), ('seconds', 0.0)])
+        if not os.path.isdir(host_dir):
+            raise IOError("Directory not found '{0}'".format(host_dir))
+        image_dir = self.__absolute(image_dir)
+        files = list()
+        with self.file_system.batch():
+            self.__make_directories(image_dir, report)
+            for dir_path, dir_names, file_names in os.walk(host_dir):
+                dir_names.sort()
+                relative = os.path.relpath(dir_path, host_dir)
+                target = image_dir
+                if relative != os.curdir:
+                    target = self.__join(image_dir, *relative.split(os.sep))
+                for name in dir_names:
+                    self.__make_directories(self.__join(target, name), report)
+                for name in sorted(file_names):
+                    host_path = os.path.join(dir_path, name)
+                    if os.path.isfile(host_path):
+                        files.append((host_path, self.__join(target, name)))
+            for (_, image_path), data in self.__pipeline(self.__read_host_file, files):
+                try:
+                    with self.file_system.open(image_path, 'wb', self.extents) as file_writer:
+                        file_writer.reserve(len(data))
+                        file_writer.write(data)
+                except ValueError as error:
+                    raise IOError("Cannot import '{0}': {1}".format(image_path, error))
+                report['files'] += 1
+                report['bytes'] += len(data)
+        report['seconds'] = time.time() - start
+        return report
+
+    def export_tree(self, image_dir, host_dir):
+        '''
+        Copies the image directory tree into the host directory, creating
+        the missing directories and overwriting the existing files.
+        Returns the report: {files, directories, bytes, seconds}
+        '''
+        start = time.time()
+        report = OrderedDict([('files', 0), ('directories', 0), ('bytes', 0), ('seconds', 0.0)])
+        image_dir = self.__absolute(image_dir)
+        if not self.file_system.is_directory(image_dir)[0]:
+            raise IOError("Directory not found '{0}'".format(image_dir))
+        with self.file_system.batch():
+            for _, size in self.__pipeline(self.__write_host_file,
+                                           self.__image_files(image_dir, host_dir, report)):
+                report['files'] += 1
+                report['bytes'] += size
+        report['seconds'] = time.time() - start
+        return report
+
+    def __image_files(self, image_dir, host_dir, report):
+        '''
+        Yields (host path, data) for the files of the image tree, creating
+        the host directories on the way.
+        '''
+        if not os.path.isdir(host_dir):
+            os.makedirs(host_dir)
+            report['directories'] += 1
+        self.file_system.change_directory(image_dir)
+        names = [name for name in sorted(set(self.file_system.list_names()))
+                 if name not in ('.', '..')]
+        directories = [name for name in names if self.file_system.is_directory(name)[0]]
+        files = [name for name in names if self.file_system.is_file(name)[0]]
+        for name in files:
+            with self.file_system.open(self.__join(image_dir, name)) as file_reader:
+                yield (os.path.join(host_dir, name), file_reader.read())
+        for name in directories:
+            for item in self.__image_files(self.__join(image_dir, name),
+                                           os.path.join(host_dir, name), report):
+                yield item
+
+    def __pipeline(self, function, items):
+        '''
+        Runs function(item) in the thread pool and yields (item, result) in
+        the order of the items, with at most "window" items in flight.
+        '''
+        pool = ThreadPool(self.threads)
+        try:
+            pending = deque()
+            for item in items:
+                pending.append((item, pool.apply_async(function, (item,))))
+                if len(pending) >= self.window:
+                    item, result = pending.popleft()
+                    yield (item, result.get())
+            while pending:
+                item, result = pending.popleft()
+                yield (item, result.get())
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def __read_host_file(item):
+        "Returns the data of the host file of the (host path, image path) item"
+        with open(item[0], "rb") as host_file:
+            return host_file.read()
+
+    @staticmethod
+    def __write_host_file(item):
+        "Writes the data of the (host path, data) item, returns its size"
+        with open(item[0], "wb") as host_file:
+            host_file.write(item[1])
+        return len(item[1])
+
+    def __make_directories(self, image_dir, report):
+        "Creates the directories of the absolute path that don't exist"
+        path = ""
+        for name in image_dir.split("/")[1:]:
+            if name == "":
+                continue
+            parent = path if path else "/"
+            path += "/" + name
+            if not self.file_system.is_directory(path)[0]:
+                self.file_system.change_directory(parent)
+                try:
+                    self.file_system.create_directory(name)
+                except ValueError as error:
+                    raise IOError("Cannot import '{0}': {1}".format(path, error))
+                report['directories'] += 1
+
+    def __absolute(self, image_dir):
+        "Returns the path relative to the working directory as an absolute one"
+        if image_dir.startswith("/"):
+            return image_dir
+        path = self.file_system.working_dir if self.file_system.working_dir else "/"
+        for name in image_dir.split("/"):
+            if name in ("", "."):
+                continue
+            if name == "..":
+                path = path.rsplit("/", 1)[0] or "/"
+            else:
+                path = self.__join(path, name)
+        return path
+
+    @staticmethod
+    def __join(path, *names):
+        "Joins image paths"
+        return "/".join([path.rstrip("/")] + list(names))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Copies directory trees in and out of an image")
+    parser.add_argument("path", help="image file")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("source", help="host directory to import or image directory to export")
+    parser.add_argument("target", nargs="?", default=None,
+                        help="image directory (default: /) or host directory")
+    parser.add_argument("-t", "--threads", type=int, default=Settings.transfer_threads,
+                        help="host I/O threads")
+    args = parser.parse_args(argv)
+    if args.command == "export" and args.target is None:
+        parser.error("export needs the host directory")
+    with open(args.path, "r+b") as fs_file:
+        file_system = FileSystem(fs_file)
+        transfer = Transfer(file_system, args.threads)
+        if args.command == "import":
+            report = transfer.import_tree(args.source, args.target or "/")
+        else:
+            report = transfer.export_tree(args.source, args.target)
+        file_system.sync()
+    print format_transfer(args.command, report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
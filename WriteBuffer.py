@@ -0,0 +1,101 @@
+'''
+Module to keep the pending writes of a batch in memory.
+'''
+import bisect
+
+
+class WriteBuffer(object):
+    '''
+    Pending writes kept as sorted, non overlapping extents. Overlapping and
+    adjacent writes are merged in a single extent, so writing the buffer out
+    takes one write per extent, in offset order.
+    '''
+
+    def __init__(self):
+        self.__starts = list()
+        self.__extents = list()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.__starts)
+
+    def end(self):
+        "Returns the offset after the last pending byte, 0 if the buffer is empty"
+        if not self.__starts:
+            return 0
+        return self.__starts[-1] + len(self.__extents[-1])
+
+    def write(self, offset, data):
+        "Adds the write to the buffer, merging it with the extents it touches"
+        end = offset + len(data)
+        first = self.__first_extent(offset)
+        last = first
+        while last < len(self.__starts) and self.__starts[last] <= end:
+            last += 1
+        if last == first:
+            self.__starts.insert(first, offset)
+            self.__extents.insert(first, bytearray(data))
+            self.size += len(data)
+            return
+        start = self.__starts[first]
+        if last - first == 1 and start <= offset:
+            extent = self.__extents[first]
+            self.size -= len(extent)
+            if end - start >= len(extent):
+                extent[offset - start:] = data
+            else:
+                extent[offset - start:end - start] = data
+            self.size += len(extent)
+            return
+        start = min(start, offset)
+        stop = max(end, self.__starts[last - 1] + len(self.__extents[last - 1]))
+        merged = bytearray(stop - start)
+        for index in xrange(first, last):
+            extent = self.__extents[index]
+            position = self.__starts[index] - start
+            merged[position:position + len(extent)] = extent
+            self.size -= len(extent)
+        merged[offset - start:end - start] = data
+        self.__starts[first:last] = [start]
+        self.__extents[first:last] = [merged]
+        self.size += len(merged)
+
+    def overlay(self, offset, data, size):
+        '''
+        Returns "data", read from the device at "offset", with the pending
+        writes in the first "size" bytes applied.
+        '''
+        end = offset + size
+        first = self.__first_extent(offset)
+        if first == len(self.__starts) or self.__starts[first] >= end:
+            return data
+        result = bytearray(data)
+        index = first
+        while index < len(self.__starts) and self.__starts[index] < end:
+            start = self.__starts[index]
+            extent = self.__extents[index]
+            copy_start = max(start, offset)
+            copy_end = min(start + len(extent), end)
+            if copy_end - offset > len(result):
+                result.extend(bytearray(copy_end - offset - len(result)))
+            result[copy_start - offset:copy_end - offset] = \
+                extent[copy_start - start:copy_end - start]
+            index += 1
+        return str(result)
+
+    def extents(self):
+        "Returns the pending (offset, data) extents sorted by offset"
+        return zip(self.__starts, self.__extents)
+
+    def clear(self):
+        "Drops all the pending writes"
+        self.__starts = list()
+        self.__extents = list()
+        self.size = 0
+
+    def __first_extent(self, offset):
+        "Returns the index of the first extent that ends at or after offset"
+        index = bisect.bisect_right(self.__starts, offset) - 1
+        if index < 0 or self.__starts[index] + len(self.__extents[index]) < offset:
+            index += 1
+        return index
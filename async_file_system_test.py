@@ -0,0 +1,73 @@
+import threading
+import unittest
+from multiprocessing import TimeoutError
+from AsyncFileSystem import AsyncFileSystem, CancelledError
+from FileSystemTestCase import FileSystemTestCase
+
+
+class AsyncFileSystemTest(FileSystemTestCase):
+    def setUp(self):
+        super(AsyncFileSystemTest, self).setUp()
+        self.async_fs = AsyncFileSystem(self.file_system, max_in_flight=2)
+
+    def tearDown(self):
+        self.async_fs.close()
+        super(AsyncFileSystemTest, self).tearDown()
+
+    def test_operations(self):
+        data = "x" * 1500
+        self.async_fs.create_directory("d").result(5)
+        self.async_fs.write("/d/a.txt", data).result(5)
+        self.async_fs.create_file("b.txt").result(5)
+        self.assertEqual(self.async_fs.read("/d/a.txt").result(5), data)
+        self.assertEqual(self.async_fs.list_files().result(5), [".", "b.txt", "d"])
+        self.async_fs.remove_file("b.txt").result(5)
+        self.async_fs.remove_directory("d").result(5)
+        self.assertEqual(self.async_fs.list_files().result(5), ["."])
+
+    def test_open_read_write(self):
+        writer = self.async_fs.open("a.txt", "wb").result(5)
+        self.async_fs.write(writer, "hello ").result(5)
+        self.async_fs.write(writer, "world").result(5)
+        self.async_fs.close_file(writer).result(5)
+        reader = self.async_fs.open("a.txt").result(5)
+        self.assertEqual(self.async_fs.read(reader, 5).result(5), "hello")
+        self.assertEqual(self.async_fs.read(reader).result(5), " world")
+
+    def test_errors_are_raised_by_the_operation(self):
+        operation = self.async_fs.read("missing.txt")
+        self.assertRaises(IOError, operation.result, 5)
+        self.assertTrue(isinstance(operation.exception(), IOError))
+
+    def test_bounded_in_flight_and_cancel(self):
+        release = threading.Event()
+        running = list()
+        lock = threading.Lock()
+
+        def blocked():
+            with lock:
+                running.append(1)
+            release.wait(5)
+            return len(running)
+        first = [self.async_fs.submit(blocked) for _ in xrange(0, 2)]
+        queued = self.async_fs.create_file("a.txt")
+        done = list()
+        queued.add_done_callback(done.append)
+        self.assertRaises(TimeoutError, first[0].result, 0.05)
+        self.assertEqual(len(running), 2)
+        self.assertTrue(queued.cancel())
+        self.assertEqual(done, [queued])
+        release.set()
+        self.assertEqual([operation.result(5) for operation in first], [2, 2])
+        self.assertRaises(CancelledError, queued.result)
+        self.assertFalse(first[0].cancel())
+        self.assertEqual(self.async_fs.list_files().result(5), ["."])
+
+    def test_closed(self):
+        self.async_fs.close()
+        self.assertRaises(ValueError, self.async_fs.create_file, "a.txt")
+        self.assertRaises(ValueError, AsyncFileSystem, self.file_system, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
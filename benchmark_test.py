@@ -0,0 +1,28 @@
+import unittest
+from Benchmark import Benchmark, compare_results
+from SuperBlock import SuperBlock
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_run_all_workloads(self):
+        results = Benchmark(scales=(2,)).run()
+        self.assertEqual([result['workload'] for result in results],
+                         Benchmark(scales=(2,)).workloads.keys())
+        write = [result for result in results if result['workload'] == 'write_file'][0]
+        self.assertEqual(write['ops'], 8)
+        self.assertEqual(write['bytes'], 2 * sum(Benchmark.write_sizes(SuperBlock())))
+        self.assertGreaterEqual(write['io']['bytes_written'], write['bytes'])
+        self.assertEqual(compare_results(results, results), [])
+
+    def test_more_io_is_a_regression(self):
+        baseline = Benchmark(scales=(2,)).run(['create_file'])
+        results = Benchmark(scales=(2,)).run(['create_file'])
+        results[0]['io']['reads'] += 1
+        self.assertEqual(len(compare_results(baseline, results, tolerance=1.0)), 1)
+
+    def test_unknown_workload(self):
+        self.assertRaises(ValueError, Benchmark(scales=(2,)).run, ['fsck'])
+
+
+if __name__ == '__main__':
+    unittest.main()
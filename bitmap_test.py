@@ -0,0 +1,73 @@
+import unittest
+from bitarray import bitarray
+from Bitmap import Bitmap
+from FileSystemTestCase import FileSystemTestCase
+
+
+class BitmapTestCase(FileSystemTestCase):
+    def read_disk_bitmap(self, offset, size):
+        with open(self.path, "rb") as image:
+            image.seek(offset)
+            data = bitarray()
+            data.frombytes(image.read(size))
+        return data
+
+
+class BitmapTest(BitmapTestCase):
+    def test_changes_are_written_on_flush(self):
+        self.file_system.create_file("a.txt")
+        disk = self.read_disk_bitmap(self.superblock.inode_bitmap_offset, self.superblock.inode_bitmap_size)
+        self.assertTrue(disk[1])
+        self.file_system.flush()
+        disk = self.read_disk_bitmap(self.superblock.inode_bitmap_offset, self.superblock.inode_bitmap_size)
+        self.assertFalse(disk[1])
+        disk = self.read_disk_bitmap(self.superblock.datablock_bitmap_offset, self.superblock.datablock_bitmap_size)
+        self.assertFalse(disk[1])
+
+    def test_flush_writes_only_dirty_bytes(self):
+        bitmap = Bitmap(self.file_system.device, self.superblock.datablock_bitmap_offset,
+                        self.superblock.datablock_bitmap_size)
+        bitmap.load()
+        # Corrupt a clean byte on disk, flush must not overwrite it
+        self.file_system.device.write(self.superblock.datablock_bitmap_offset + 100, '\x00')
+        bitmap.set_state(8 * 50, 0)
+        bitmap.set_state(8 * 51 + 3, 0)
+        bitmap.flush()
+        self.assertFalse(bitmap.is_dirty())
+        disk = self.read_disk_bitmap(self.superblock.datablock_bitmap_offset, self.superblock.datablock_bitmap_size)
+        self.assertFalse(disk[8 * 50])
+        self.assertFalse(disk[8 * 51 + 3])
+        self.assertFalse(disk[8 * 100])
+        self.assertTrue(disk[8 * 52])
+
+    def test_first_free_inode_after_create(self):
+        self.assertEqual(self.file_system.inode_table.get_free_inode_index(), 1)
+        self.file_system.create_file("a.txt")
+        self.assertEqual(self.file_system.inode_table.get_free_inode_index(), 2)
+
+
+class ClusterAllocationTest(BitmapTestCase):
+    def test_allocate_returns_contiguous_run(self):
+        clusters = self.file_system.cluster_table.allocate(16)
+        self.assertEqual(clusters, range(clusters[0], clusters[0] + 16))
+        next_clusters = self.file_system.cluster_table.allocate(2)
+        self.assertEqual(next_clusters, [clusters[-1] + 1, clusters[-1] + 2])
+
+    def test_allocate_near_goal(self):
+        self.assertEqual(self.file_system.cluster_table.allocate(3, goal=500), [500, 501, 502])
+
+    def test_allocate_skips_short_runs(self):
+        cluster_table = self.file_system.cluster_table
+        cluster_table.change_cluster_state(103, 0)
+        self.assertEqual(cluster_table.allocate(4, goal=100), range(104, 108))
+
+    def test_write_uses_contiguous_blocks(self):
+        self.file_system.write_file("a.txt", "x" * 1024)
+        inode = self.file_system.inode_table.get_inode(1)
+        first = inode.i_blocks[0]
+        self.assertEqual(inode.i_blocks[:12], range(first, first + 12))
+        self.assertEqual(inode.i_blocks[12], first + 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
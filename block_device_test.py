@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from BlockDevice import BlockDevice
+from FileSystem import FileSystem
+from WriteBuffer import WriteBuffer
+
+
+class BlockDeviceTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".ext2")
+        os.close(handle)
+        self.fs_file = open(self.path, "r+b")
+
+    def tearDown(self):
+        self.fs_file.close()
+        os.remove(self.path)
+
+    def test_empty_image_is_not_mapped(self):
+        device = BlockDevice(self.fs_file)
+        self.assertFalse(device.is_mapped())
+        device.write(10, "abc")
+        self.assertEqual(device.read(10, 3), "abc")
+
+    def test_resize_maps_the_image(self):
+        device = BlockDevice(self.fs_file)
+        device.resize(4096)
+        self.assertTrue(device.is_mapped())
+        self.assertEqual(device.size(), 4096)
+        self.assertEqual(device.read(4000, 4), "\0" * 4)
+        device.write(4000, "abcd")
+        self.assertEqual(str(device.view(4001, 2)), "bc")
+        device.sync()
+        with open(self.path, "rb") as image:
+            image.seek(4000)
+            self.assertEqual(image.read(4), "abcd")
+
+    def test_plain_file_fallback(self):
+        FileSystem(self.fs_file, True)._create_file_system()
+        device = BlockDevice(self.fs_file, use_mmap=False)
+        file_system = FileSystem(device)
+        self.assertFalse(file_system.device.is_mapped())
+        file_system.write_file("a.txt", "hello")
+        self.assertEqual(file_system.is_file("a.txt"), (True, 1))
+
+    def test_batch_buffers_writes_in_file_mode(self):
+        FileSystem(self.fs_file, True)._create_file_system()
+        file_system = FileSystem(BlockDevice(self.fs_file, use_mmap=False))
+        with file_system.batch():
+            with file_system.batch():
+                for index in xrange(0, 8):
+                    file_system.write_file("f{0}".format(index), "x" * index)
+            self.assertEqual(file_system.open("f7").read(), "x" * 7)
+            self.assertNotIn('writes', file_system.stats()['counters'])
+        counters = file_system.stats()['counters']
+        self.assertLess(counters['writes'], counters['buffered_writes'])
+        file_system = FileSystem(BlockDevice(self.fs_file, use_mmap=False))
+        self.assertEqual(file_system.open("f7").read(), "x" * 7)
+
+    def test_end_without_batch(self):
+        self.assertRaises(ValueError, BlockDevice(self.fs_file).end_batch)
+
+
+class WriteBufferTest(unittest.TestCase):
+    def test_writes_are_merged(self):
+        write_buffer = WriteBuffer()
+        write_buffer.write(10, "aaaa")
+        write_buffer.write(20, "bb")
+        write_buffer.write(0, "c")
+        write_buffer.write(14, "dddddd")
+        self.assertEqual([(offset, str(data)) for offset, data in write_buffer.extents()],
+                         [(0, "c"), (10, "aaaaddddddbb")])
+        self.assertEqual(write_buffer.size, 13)
+        self.assertEqual(write_buffer.end(), 22)
+
+    def test_overlay(self):
+        write_buffer = WriteBuffer()
+        write_buffer.write(2, "xy")
+        write_buffer.write(8, "zz")
+        self.assertEqual(write_buffer.overlay(0, "012345", 6), "01xy45")
+        self.assertEqual(write_buffer.overlay(4, "45", 6), "45\0\0zz")
+        self.assertEqual(write_buffer.overlay(20, "ab", 2), "ab")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from SuperBlock import SuperBlock
+
+
+class BlockGroupTest(FileSystemTestCase):
+    def geometry(self):
+        return SuperBlock(64, 4096, 256, blocks_per_group=512)
+
+    def groups(self, name):
+        "Returns the groups of the inode and of the first cluster of the file"
+        inode_id = self.file_system.is_file(name)[1]
+        inode = self.file_system.inode_table.get_inode(inode_id)
+        return (self.superblock.group_of_inode(inode_id),
+                self.superblock.group_of_cluster(inode.i_blocks[0]))
+
+    def test_geometry(self):
+        self.assertEqual(self.superblock.group_count, 8)
+        self.assertEqual(self.superblock.inodes_per_group, 32)
+        self.assertEqual(self.superblock.group_clusters(7), (3584, 4096))
+        self.assertEqual(self.superblock.group_inodes(1), (32, 64))
+        superblock = FileSystem(self.fs_file).device.superblock
+        self.assertEqual(superblock.blocks_per_group, 512)
+        self.assertEqual(SuperBlock.legacy().group_count, 1)
+        self.assertRaises(ValueError, SuperBlock, 64, 4096, 256, False, 100)
+
+    def test_directories_are_spread(self):
+        directories = [self.file_system.create_directory("d{0}".format(index))
+                       for index in xrange(0, 4)]
+        groups = set(self.superblock.group_of_inode(inode_id) for inode_id in directories)
+        self.assertEqual(len(groups), 4)
+        self.assertNotIn(0, groups)
+
+    def test_files_follow_their_directory(self):
+        dir_id = self.file_system.create_directory("d")
+        group = self.superblock.group_of_inode(dir_id)
+        self.file_system.change_directory("d")
+        self.file_system.write_file("a.txt", "a" * 1000)
+        self.assertEqual(self.groups("a.txt"), (group, group))
+        self.file_system.change_directory("/")
+        self.file_system.write_file("b.txt", "b")
+        self.assertEqual(self.groups("b.txt"), (0, 0))
+
+    def test_full_group_uses_the_next_one(self):
+        self.file_system.cluster_table.allocate(512 - 1)
+        self.file_system.write_file("a.txt", "a")
+        self.assertEqual(self.groups("a.txt"), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
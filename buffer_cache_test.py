@@ -0,0 +1,66 @@
+import unittest
+from BufferCache import BufferCache
+from FileSystemTestCase import FileSystemTestCase
+
+
+class BufferCacheTest(FileSystemTestCase):
+    def setUp(self):
+        super(BufferCacheTest, self).setUp()
+        self.data = "".join(chr(48 + index % 64) for index in xrange(20000))
+
+    def test_lru_and_budget(self):
+        cache = BufferCache(4, 12)
+        cache.fill(10, "aaaabbbbcccc", cache.stamp())
+        self.assertEqual(cache.get(10), "aaaa")
+        cache.fill(20, "dddd", cache.stamp())
+        # 11 was the least recently used block
+        self.assertIsNone(cache.get(11))
+        self.assertEqual((cache.get(10), cache.get(12), cache.get(20)), ("aaaa", "cccc", "dddd"))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses'], stats['evictions']),
+                         (12, 4, 1, 1))
+        disabled = BufferCache(4, 0)
+        disabled.fill(0, "aaaa", disabled.stamp())
+        self.assertIsNone(disabled.get(0))
+
+    def test_writes_keep_the_cache_coherent(self):
+        cache = BufferCache(4, 64)
+        stamp = cache.stamp()
+        cache.fill(0, "aaaabbbb", stamp)
+        cache.write(0, 2, "xxxxyy")
+        self.assertEqual((cache.get(0), cache.get(1)), ("aaxx", "xxyy"))
+        # A block read before a write is not cached, it may be stale
+        cache.fill(5, "eeee", stamp)
+        self.assertIsNone(cache.get(5))
+        device = self.file_system.device
+        self.file_system.write_file("a.txt", self.data[:1000])
+        self.file_system.write_file("a.txt", self.data[1000:2000])
+        self.assertEqual(self.file_system.open("a.txt").read(), self.data[1000:2000])
+        self.assertTrue(device.cache.stats()['hits'] > 0)
+
+    def test_sequential_reads_are_read_ahead(self):
+        self.file_system.write_file("a.txt", self.data)
+        device = self.file_system.device
+        device.cache.clear()
+        reads = list()
+        read = device.read
+        device.read = lambda offset, size: reads.append(size) or read(offset, size)
+        file_reader = self.file_system.open("a.txt")
+        self.assertEqual(file_reader.read(100), self.data[:100])
+        del reads[:]
+        # The next 64 blocks were read ahead: no read until half of them are used
+        chunks = [file_reader.read(100) for _ in xrange(0, 20)]
+        self.assertEqual("".join(chunks), self.data[100:2100])
+        self.assertEqual(reads, [])
+        self.assertTrue(device.metrics.snapshot()['counters']['readahead_blocks'] >= 64)
+        # Random reads don't read ahead
+        device.cache.clear()
+        file_reader.seek(15000)
+        self.assertEqual(file_reader.read(10), self.data[15000:15010])
+        # Single blocks: the data block and the indirect blocks not cached by the block map
+        self.assertEqual(set(reads), set([64]))
+        self.assertIn('buffer_cache', self.file_system.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
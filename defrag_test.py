@@ -0,0 +1,104 @@
+import unittest
+from Defrag import Defragmenter
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from Fsck import Fsck
+
+
+class DefragTest(FileSystemTestCase):
+    def setUp(self):
+        super(DefragTest, self).setUp()
+        self.data = dict()
+
+    def fragment(self, names, chunks=40, extents=False):
+        "Appends to the files in turns, so their blocks are interleaved"
+        for name in names:
+            self.file_system.create_file(name, extents)
+            self.data[name] = ""
+        for index in xrange(0, chunks):
+            for name in names:
+                chunk = chr(65 + index % 26) * 64
+                self.file_system.write_file(name, chunk, append=True)
+                self.data[name] += chunk
+
+    def check_files(self):
+        for name, data in self.data.iteritems():
+            with self.file_system.open(name) as file_reader:
+                self.assertEqual(file_reader.read(), data)
+
+    def test_files_are_made_contiguous(self):
+        self.fragment(["a.txt", "b.txt"])
+        self.fragment(["c.txt", "d.txt"], extents=True)
+        free = self.file_system.statfs()['free_clusters']
+        file_reader = self.file_system.open("a.txt")
+        self.assertEqual(file_reader.read(100), self.data["a.txt"][:100])
+        report = Defragmenter(self.file_system).run()
+        self.assertTrue(report['finished'])
+        self.assertEqual(report['relocated'], 4)
+        # One fragment per file, the root directory has no block to move
+        self.assertEqual(report['fragments_after'], 4)
+        self.assertEqual(file_reader.read(), self.data["a.txt"][100:])
+        self.check_files()
+        # The extent files needed an index and 5 leaves, now they have one extent
+        self.assertEqual(self.file_system.statfs()['free_clusters'], free + 2 * 6)
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+        self.assertEqual(Defragmenter(self.file_system).run()['relocated'], 0)
+
+    def test_directories_are_moved(self):
+        self.file_system.create_directory("d")
+        self.file_system.change_directory("d")
+        for index in xrange(0, 15):
+            self.file_system.write_file("f{0}.txt".format(index), "x" * 200)
+        self.file_system.change_directory("/")
+        dir_id = self.file_system.is_directory("d")[1]
+        before, after, copied = self.file_system.relocate_inode(dir_id)
+        self.assertTrue(before > 1)
+        self.assertEqual(after, 1)
+        self.assertTrue(copied > 0)
+        self.file_system.change_directory("d")
+        self.assertEqual(len(self.file_system.list_names()), 17)
+        with self.file_system.open("f3.txt") as file_reader:
+            self.assertEqual(file_reader.read(), "x" * 200)
+        self.file_system.flush()
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+
+    def test_files_open_for_writing_are_skipped(self):
+        self.fragment(["a.txt", "b.txt"])
+        inode_id = self.file_system.is_file("a.txt")[1]
+        file_writer = self.file_system.open("a.txt", "ab")
+        self.assertEqual(self.file_system.relocate_inode(inode_id), (0, 0, 0))
+        file_writer.write("z" * 100)
+        file_writer.close()
+        self.data["a.txt"] += "z" * 100
+        self.assertTrue(self.file_system.relocate_inode(inode_id)[2] > 0)
+        self.check_files()
+
+    def test_readers_of_evicted_inodes_follow_the_move(self):
+        self.file_system = FileSystem(self.fs_file, inode_cache_size=2)
+        self.fragment(["a.txt", "b.txt"])
+        file_reader = self.file_system.open("a.txt")
+        self.assertEqual(file_reader.read(100), self.data["a.txt"][:100])
+        for index in xrange(0, 10):
+            self.file_system.write_file("f{0}".format(index), "x")
+        self.assertTrue(self.file_system.relocate_inode(self.file_system.is_file("a.txt")[1])[2] > 0)
+        # The old clusters of a.txt are used again
+        self.file_system.remove_file("b.txt")
+        self.file_system.write_file("c.txt", "c" * 5000)
+        self.assertEqual(file_reader.read(), self.data["a.txt"][100:])
+
+    def test_budget(self):
+        self.fragment(["a.txt", "b.txt", "c.txt", "d.txt"], chunks=20)
+        defragmenter = Defragmenter(self.file_system)
+        report = defragmenter.run(max_bytes=1)
+        self.assertFalse(report['finished'])
+        self.assertEqual((report['relocated'], report['bytes']), (1, 20 * 64))
+        relocated = report['relocated']
+        while not report['finished']:
+            report = defragmenter.run(max_bytes=1)
+            relocated += report['relocated']
+        self.assertEqual(relocated, 4)
+        self.check_files()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+from FileSystem import FileSystem
+from Directory import Directory, DirEntry
+from FileSystemTestCase import FileSystemTestCase
+from Settings import Settings
+
+
+class DirectoryTestCase(FileSystemTestCase):
+    def root_directory(self, file_system=None):
+        file_system = file_system or self.file_system
+        return Directory(file_system.device, file_system.inode_table, file_system.cluster_table, 0)
+
+
+class DirectoryTest(DirectoryTestCase):
+    def test_small_directory_stays_linear(self):
+        self.file_system.create_file("a.txt")
+        self.assertFalse(self.root_directory().is_indexed())
+        self.assertEqual([entry.name for entry in self.root_directory().entries()], [".", "a.txt"])
+
+    def test_directory_is_indexed_when_it_grows(self):
+        names = ["file{0}.txt".format(index) for index in xrange(15)]
+        for name in names:
+            self.file_system.create_file(name)
+        self.assertTrue(self.root_directory().is_indexed())
+        self.file_system.flush()
+        file_system = FileSystem(self.fs_file)
+        for position, name in enumerate(names):
+            self.assertEqual(file_system.is_file(name), (True, position + 1))
+        self.assertEqual(file_system.is_file("missing.txt"), (False, -1))
+        entries = self.root_directory(file_system).entries()
+        self.assertEqual(sorted(entry.name for entry in entries), sorted(names + ["."]))
+
+    def test_lookup_reads_one_leaf(self):
+        for index in xrange(15):
+            self.file_system.create_file("file{0}.txt".format(index))
+        directory = self.root_directory()
+        directory.lookup("file3.txt")
+        leaf_reads = list()
+        read_block = directory._Directory__read_block
+        directory._Directory__read_block = lambda block: leaf_reads.append(block) or read_block(block)
+        self.assertEqual(len(directory.lookup("file7.txt")), 1)
+        self.assertEqual(len(leaf_reads), 1)
+
+    def test_legacy_linear_directory(self):
+        # Old images store the entries one after the other and i_size is their total size
+        entries = [DirEntry(0, 9, 1, 1, "."), DirEntry(1, 13, 5, 0, "a.txt")]
+        self.file_system.create_file("a.txt")
+        self.fs_file.seek(self.file_system.device.superblock.cluster_offset(0))
+        self.fs_file.write("".join(entry.to_binary() for entry in entries).ljust(
+            Settings.datablock_size, '\0'))
+        self.file_system.flush()
+        file_system = FileSystem(self.fs_file)
+        self.assertEqual(file_system.is_file("a.txt"), (True, 1))
+        file_system.create_directory("d")
+        self.assertEqual(file_system.is_directory("/d")[0], True)
+
+    def test_removed_entries_are_reused(self):
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            self.file_system.create_file(name)
+        size = self.root_directory().inode.i_size
+        self.file_system.remove_file("a.txt")
+        self.assertEqual(self.root_directory().inode.i_size, size)
+        self.file_system.create_file("d.txt")
+        self.assertEqual(self.root_directory().inode.i_size, size)
+        # The slot of d.txt stays free in the "." entry, c.txt was the last one
+        self.file_system.remove_file("d.txt")
+        self.file_system.remove_file("c.txt")
+        self.assertEqual(self.root_directory().inode.i_size, size - 13)
+        self.assertEqual([entry.name for entry in self.root_directory().entries()], [".", "b.txt"])
+
+    def test_empty_leaves_are_freed(self):
+        names = ["file{0}.txt".format(index) for index in xrange(18)]
+        for name in names:
+            self.file_system.create_file(name)
+        free_clusters = self.file_system.statfs()['free_clusters']
+        for name in names[:17]:
+            self.file_system.remove_file(name)
+        directory = self.root_directory()
+        self.assertEqual(sorted(entry.name for entry in directory.entries()), [".", "file17.txt"])
+        self.assertEqual(directory.inode.i_size / Settings.datablock_size,
+                         max(directory._Directory__leaves(directory.index_levels(), 0)) + 1)
+        self.assertTrue(self.file_system.statfs()['free_clusters'] > free_clusters + 17)
+        for name in names[:17]:
+            self.file_system.create_file(name)
+        self.assertEqual(sorted(self.file_system.list_names()), sorted(names + ["."]))
+
+
+    def test_big_directories_use_indirect_blocks(self):
+        free = self.file_system.statfs()['free_clusters']
+        self.file_system.create_directory("d")
+        self.file_system.change_directory("d")
+        names = ["file{0}.txt".format(index) for index in xrange(600)]
+        with self.file_system.batch():
+            for name in names:
+                self.file_system.create_file(name)
+        self.file_system.flush()
+        file_system = FileSystem(self.fs_file)
+        file_system.change_directory("d")
+        directory = Directory(file_system.device, file_system.inode_table,
+                              file_system.cluster_table, file_system.is_directory("/d")[1])
+        self.assertTrue(directory.index_levels() >= 2)
+        # The leaves go on in the single indirect block
+        self.assertNotEqual(directory.inode.i_blocks[file_system.device.superblock.direct_blocks], 0)
+        self.assertEqual(file_system.list_names(), sorted(names + [".", ".."]))
+        for name in names[::7]:
+            self.assertTrue(file_system.is_file(name)[0])
+        for name in names[:500]:
+            file_system.remove_file(name)
+        self.assertEqual(file_system.list_names(), sorted(names[500:] + [".", ".."]))
+        file_system.change_directory("/")
+        file_system.remove_directory("d")
+        self.assertEqual(file_system.statfs()['free_clusters'], free)
+
+
+class DentryCacheTest(DirectoryTestCase):
+    def test_deep_path_lookups_hit_the_cache(self):
+        for name in ["a", "b", "c"]:
+            self.file_system.create_directory(name)
+            self.file_system.change_directory(name)
+        self.file_system.change_directory("/")
+        self.assertEqual(self.file_system.is_directory("/a/b/c")[0], True)
+        hits = self.file_system.dentry_cache.hits
+        self.assertEqual(self.file_system.is_directory("/a/b/c")[0], True)
+        self.assertEqual(self.file_system.dentry_cache.hits, hits + 3)
+
+    def test_negative_entries_are_invalidated(self):
+        self.assertEqual(self.file_system.is_file("a.txt"), (False, -1))
+        inode_id = self.file_system.create_file("a.txt")
+        self.assertEqual(self.file_system.is_file("a.txt"), (True, inode_id))
+        self.file_system.remove_file("a.txt")
+        self.assertEqual(self.file_system.is_file("a.txt"), (False, -1))
+
+    def test_removed_directory_is_forgotten(self):
+        self.file_system.create_directory("a")
+        self.file_system.change_directory("a")
+        self.file_system.create_directory("b")
+        self.file_system.change_directory("/")
+        self.assertEqual(self.file_system.is_directory("/a/b")[0], True)
+        self.file_system.remove_directory("a")
+        self.assertEqual(self.file_system.is_directory("/a/b"), (False, -1))
+        self.assertEqual(self.file_system.is_directory("a"), (False, -1))
+
+    def test_capacity_holds_in_a_single_directory(self):
+        file_system = FileSystem(self.fs_file, dentry_cache_size=100)
+        file_system.create_file("a.txt")
+        for index in xrange(0, 5000):
+            self.assertEqual(file_system.is_file("missing{0}".format(index)), (False, -1))
+        stats = file_system.stats()['dentry_cache']
+        self.assertEqual((stats['size'], stats['capacity']), (100, 100))
+        self.assertEqual(file_system.is_file("missing4999"), (False, -1))
+        self.assertEqual(file_system.dentry_cache.stats()['hits'], stats['hits'] + 1)
+        self.assertTrue(file_system.is_file("a.txt")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
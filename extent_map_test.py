@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from ExtentMap import ExtentMap
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from InodeBase import Inode
+from SuperBlock import SuperBlock
+
+
+class ExtentMapTest(FileSystemTestCase):
+    def geometry(self):
+        return SuperBlock(extents=True)
+
+    def setUp(self):
+        super(ExtentMapTest, self).setUp()
+        self.data = "".join(chr(48 + index % 64) for index in xrange(100 * 1024))
+
+    def inode(self, name):
+        return self.file_system.inode_table.get_inode(self.file_system.is_file(name)[1])
+
+    def extent_map(self, name):
+        return ExtentMap(self.file_system.inode_table, self.file_system.cluster_table,
+                         self.inode(name))
+
+    def test_contiguous_file_uses_one_extent_and_one_read(self):
+        self.file_system.write_file("a.txt", self.data)
+        inode = self.inode("a.txt")
+        self.assertTrue(inode.i_flags & Inode.extents_flag)
+        self.assertEqual(inode.i_blocks[1], len(self.data) / 64)
+        self.assertEqual(inode.i_blocks[2:], [0] * 13)
+        reads = list()
+        file_reader = self.file_system.open("a.txt")
+        self.file_system.device.cache.clear()
+        read = self.file_system.device.read
+        self.file_system.device.read = lambda offset, size: reads.append(size) or read(offset, size)
+        self.assertEqual(file_reader.read(), self.data)
+        self.file_system.device.read = read
+        self.assertEqual(reads, [len(self.data)])
+
+    def test_fragmented_file_spills_to_leaf_blocks(self):
+        free = self.file_system.cluster_table.bitmap.count_free()
+        for index in xrange(0, 20):
+            self.file_system.write_file("a.txt", self.data[index * 64:(index + 1) * 64], append=True)
+            self.file_system.write_file("b.txt", "b" * 64, append=True)
+        self.assertEqual(len(self.extent_map("a.txt").get_runs(20)), 20)
+        self.assertNotEqual(self.inode("a.txt").i_blocks[14], 0)
+        self.file_system.flush()
+        file_system = FileSystem(self.fs_file)
+        self.assertEqual(file_system.open("a.txt").read(), self.data[:20 * 64])
+        file_system.remove_file("a.txt")
+        file_system.remove_file("b.txt")
+        self.assertEqual(file_system.cluster_table.bitmap.count_free(), free)
+
+    def test_too_fragmented_file(self):
+        self.file_system.create_file("a.txt")
+        max_extents = self.extent_map("a.txt").max_extents
+        for _ in xrange(0, max_extents):
+            self.file_system.write_file("a.txt", "a" * 64, append=True)
+            self.file_system.write_file("b.txt", "b" * 64, append=True)
+        free = self.file_system.cluster_table.bitmap.count_free()
+        file_writer = self.file_system.open("a.txt", "ab")
+        self.assertRaises(IOError, file_writer.write, "a" * 4096)
+        self.assertEqual(self.file_system.cluster_table.bitmap.count_free(), free)
+
+    def test_extents_per_file(self):
+        handle, path = tempfile.mkstemp(suffix=".ext2")
+        os.close(handle)
+        try:
+            with open(path, "r+b") as fs_file:
+                file_system = FileSystem(fs_file, True)
+                file_system._create_file_system()
+                file_system.write_file("blocks.txt", self.data[:1500])
+                file_system.write_file("extents.txt", self.data[:1500], extents=True)
+                self.assertEqual(file_system.open("blocks.txt").read(), self.data[:1500])
+                self.assertEqual(file_system.open("extents.txt").read(), self.data[:1500])
+                inode_table = file_system.inode_table
+                self.assertFalse(inode_table.get_inode(file_system.is_file("blocks.txt")[1]).i_flags)
+                self.assertTrue(inode_table.get_inode(file_system.is_file("extents.txt")[1]).i_flags
+                                & Inode.extents_flag)
+                file_system._create_file_system(SuperBlock.legacy())
+                self.assertRaises(ValueError, file_system.create_file, "a.txt", True)
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import unittest
+from FileSystemTestCase import FileSystemTestCase
+
+
+class FileReaderTest(FileSystemTestCase):
+    def setUp(self):
+        super(FileReaderTest, self).setUp()
+        self.data = "".join(chr(48 + index % 64) for index in xrange(1500))
+        self.file_system.write_file("a.txt", self.data)
+
+    def test_read_whole_file(self):
+        with self.file_system.open("a.txt", "rb") as file_reader:
+            self.assertEqual(file_reader.read(), self.data)
+            self.assertEqual(file_reader.read(), "")
+
+    def test_read_seek_and_tell(self):
+        file_reader = self.file_system.open("a.txt")
+        self.assertEqual(file_reader.read(10), self.data[:10])
+        file_reader.seek(1000)
+        self.assertEqual(file_reader.read(100), self.data[1000:1100])
+        self.assertEqual(file_reader.tell(), 1100)
+        file_reader.seek(-5, os.SEEK_END)
+        self.assertEqual(file_reader.read(100), self.data[-5:])
+
+    def test_readinto(self):
+        buffer = bytearray(200)
+        file_reader = self.file_system.open("a.txt")
+        file_reader.seek(1400)
+        self.assertEqual(file_reader.readinto(buffer), 100)
+        self.assertEqual(str(buffer[:100]), self.data[1400:])
+
+    def test_iteration_reads_contiguous_runs(self):
+        file_reader = self.file_system.open("a.txt")
+        self.file_system.device.cache.clear()
+        reads = list()
+        read = self.file_system.device.read
+        self.file_system.device.read = lambda offset, size: reads.append(size) or read(offset, size)
+        self.assertEqual("".join(file_reader), self.data)
+        # The indirect block, the 12 direct blocks, then the (whole) blocks after the indirect one
+        self.assertEqual(reads, [64, 12 * 64, 12 * 64])
+
+    def test_open_by_path(self):
+        self.file_system.create_directory("d")
+        self.file_system.change_directory("d")
+        self.file_system.write_file("b.txt", "hello")
+        self.file_system.change_directory("/")
+        self.assertEqual(self.file_system.open("/d/b.txt").read(), "hello")
+        self.assertEqual(self.file_system.open("d/b.txt").read(), "hello")
+        self.assertRaises(IOError, self.file_system.open, "/x/b.txt")
+        self.assertRaises(IOError, self.file_system.open, "b.txt")
+
+
+if __name__ == '__main__':
+    unittest.main()
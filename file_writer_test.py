@@ -0,0 +1,98 @@
+import unittest
+from StringIO import StringIO
+from BlockMap import BlockMap
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from SuperBlock import SuperBlock
+
+
+class FileWriterTest(FileSystemTestCase):
+    def setUp(self):
+        super(FileWriterTest, self).setUp()
+        self.data = "".join(chr(48 + index % 64) for index in xrange(1500))
+
+    def read(self, path):
+        return self.file_system.open(path).read()
+
+    def test_write_string(self):
+        self.file_system.write_file("a.txt", self.data)
+        self.assertEqual(self.read("a.txt"), self.data)
+        self.file_system.write_file("a.txt", "short")
+        self.assertEqual(self.read("a.txt"), "short")
+
+    def test_write_file_like_and_iterable(self):
+        self.file_system.write_file("a.txt", StringIO(self.data))
+        self.assertEqual(self.read("a.txt"), self.data)
+        chunks = (self.data[index:index + 7] for index in xrange(0, len(self.data), 7))
+        self.file_system.write_file("b.txt", chunks)
+        self.assertEqual(self.read("b.txt"), self.data)
+
+    def test_append(self):
+        self.file_system.write_file("a.txt", self.data[:100])
+        self.file_system.write_file("a.txt", iter([self.data[100:1000], self.data[1000:]]), append=True)
+        self.assertEqual(self.read("a.txt"), self.data)
+
+    def test_writer_batches_contiguous_blocks(self):
+        writes = list()
+        write = self.file_system.device.write
+        with self.file_system.open("/a.txt", "wb") as file_writer:
+            self.file_system.device.write = lambda offset, data: writes.append(len(data)) or write(offset, data)
+            for index in xrange(0, 15):
+                file_writer.write(self.data[index * 100:(index + 1) * 100])
+        self.file_system.device.write = write
+        self.assertEqual(self.read("a.txt"), self.data)
+        # 12 direct blocks, the indirect block, the remaining data blocks, then the indirect pointers
+        self.assertEqual(writes, [12 * 64, 1500 - 12 * 64, 64])
+
+    def test_double_and_triple_indirect_blocks(self):
+        # 12 direct, 16 single indirect, 256 double indirect and the first triple indirect ones
+        data = "".join(chr(48 + index % 64) for index in xrange(64 * 300))
+        free = self.file_system.cluster_table.bitmap.count_free()
+        self.file_system.write_file("a.txt", data[:64 * 100])
+        self.file_system.write_file("a.txt", data[64 * 100:], append=True)
+        self.file_system.flush()
+        file_system = FileSystem(self.fs_file)
+        self.assertEqual(file_system.open("a.txt").read(), data)
+        # Data blocks + single + double (1 + 16) + triple (1 + 1 + 1) indirect blocks
+        self.assertEqual(free - file_system.cluster_table.bitmap.count_free(), 300 + 1 + 17 + 3)
+        file_system.remove_file("a.txt")
+        self.assertEqual(file_system.cluster_table.bitmap.count_free(), free)
+
+    def test_indirect_blocks_are_read_once(self):
+        self.file_system.write_file("a.txt", "x" * (64 * 300))
+        self.file_system.flush()
+        file_system = FileSystem(self.fs_file)
+        file_reader = file_system.open("a.txt")
+        file_system.reset_stats()
+        for _ in file_reader:
+            pass
+        self.assertEqual(file_system.stats()['counters']['indirect_block_reads'], 1 + 17 + 3)
+
+    def test_replaced_i_blocks_drop_the_pending_pointers(self):
+        self.file_system.write_file("a.txt", self.data)
+        inode = self.file_system.inode_table.get_inode(self.file_system.is_file("a.txt")[1])
+        block_map = BlockMap(self.file_system.inode_table, self.file_system.cluster_table, inode)
+        block_map.map_blocks(30)
+        # Like a relocation, the indirect block changed above isn't the file's any more
+        inode.i_blocks = [0] * len(inode.i_blocks)
+        self.assertEqual(block_map.get_blocks(14), [0] * 14)
+        block_map.store()
+        self.assertEqual(block_map.get_blocks(30), [0] * 30)
+
+    def test_file_too_big(self):
+        max_blocks = BlockMap(self.file_system.inode_table, self.file_system.cluster_table,
+                              self.file_system.inode_table.get_inode(0)).max_blocks
+        self.assertEqual(max_blocks, 12 + 16 + 16 ** 2 + 16 ** 3)
+        self.file_system.write_file("a.txt", "x" * (64 * (max_blocks + 1)))
+        self.assertEqual(len(self.read("a.txt")), 0)
+
+    def test_legacy_file_too_big(self):
+        self.file_system._create_file_system(SuperBlock.legacy())
+        self.file_system.write_file("a.txt", "x" * (64 * 30))
+        self.assertEqual(len(self.read("a.txt")), 64 * 30)
+        self.file_system.write_file("b.txt", "x" * (64 * 31))
+        self.assertEqual(len(self.read("b.txt")), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import sys
+import unittest
+from StringIO import StringIO
+from FileSystemTestCase import FileSystemTestCase
+from Fsck import Fsck, main
+
+
+class FsckTest(FileSystemTestCase):
+    def setUp(self):
+        super(FsckTest, self).setUp()
+        self.file_system.create_directory("d")
+        self.file_system.change_directory("d")
+        for index in xrange(0, 10):
+            self.file_system.write_file("f{0}".format(index), "x" * (index * 300))
+        self.file_system.change_directory("/")
+        self.file_system.write_file("big", "y" * 20000, extents=True)
+        self.file_system.flush()
+
+    def check(self, repair=False, processes=1):
+        self.file_system.flush()
+        return Fsck(self.path, processes).run(repair)
+
+    def test_clean_image(self):
+        report = self.check(processes=2)
+        self.assertEqual(report['problems'], [])
+        self.assertEqual(report['inodes'], 13)
+        self.assertEqual(report['directories'], 2)
+        self.assertEqual(report['warnings'], [])
+
+    def test_leaked_and_missing_clusters(self):
+        self.file_system.cluster_table.allocate(3, goal=60000)
+        inode = self.file_system.inode_table.get_inode(self.file_system.is_file("big")[1])
+        self.file_system.cluster_table.change_cluster_state(inode.i_blocks[0] + 5, 1)
+        report = self.check(repair=True)
+        self.assertEqual(report['problems'], [
+            "Clusters 60000-60002 are in use but not claimed by any inode",
+            "Clusters {0}-{0} are claimed but marked as free".format(inode.i_blocks[0] + 5)])
+        self.assertEqual(report['repaired'], report['problems'])
+        self.assertEqual(report['remaining'], [])
+        self.assertEqual(self.check()['problems'], [])
+
+    def test_sizes_and_tree(self):
+        self.file_system.change_directory("d")
+        inode_id = self.file_system.is_file("f2")[1]
+        self.file_system.change_directory("/")
+        inode = self.file_system.inode_table.get_inode(inode_id)
+        inode.i_size = 5000
+        self.file_system.inode_table.write_inode(inode_id, inode)
+        orphan_id = self.file_system.inode_table.get_free_inode_index()
+        self.file_system.inode_table.change_inode_state(orphan_id, 0)
+        problems = self.check()['problems']
+        self.assertIn("Inode {0}: i_size 5000 is past its assigned blocks (640 bytes)".format(
+            inode_id), problems)
+        self.assertIn("Inode {0} is not reachable from the root directory".format(orphan_id),
+                      problems)
+
+    def test_problems_without_fix_are_left(self):
+        inode_table = self.file_system.inode_table
+        self.file_system.change_directory("d")
+        inode_id, other_id = [self.file_system.is_file(name)[1] for name in ["f2", "f3"]]
+        inode = inode_table.get_inode(inode_id)
+        inode.i_blocks[0] = inode_table.get_inode(other_id).i_blocks[0]
+        inode_table.write_inode(inode_id, inode)
+        orphan_id = inode_table.get_free_inode_index()
+        inode_table.change_inode_state(orphan_id, 0)
+        self.file_system.flush()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertEqual(main([self.path, "--repair", "--processes", "1"]), 4)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertIn("1 problems repaired\n2 problems left", output)
+        report = self.check(repair=True)
+        self.assertEqual(report['repaired'], [])
+        self.assertEqual(report['remaining'], report['problems'])
+        self.assertEqual(report['problems'], [
+            "Cluster {0} is claimed by inodes {1}, {2}".format(
+                inode.i_blocks[0], inode_id, other_id),
+            "Inode {0} is not reachable from the root directory".format(orphan_id)])
+
+    def test_warnings(self):
+        # Like images written before the inodes and the blocks were reclaimed
+        inode_table = self.file_system.inode_table
+        big_id = self.file_system.is_file("big")[1]
+        self.file_system.change_directory("d")
+        inode_id = self.file_system.is_file("f9")[1]
+        inode = inode_table.get_inode(big_id)
+        inode.i_ddate = 1
+        inode_table.write_inode(big_id, inode)
+        inode = inode_table.get_inode(inode_id)
+        inode.i_size = 5
+        inode_table.write_inode(inode_id, inode)
+        report = self.check()
+        self.assertEqual(report['warnings'], ["Inode {0}: 45 blocks past i_size".format(inode_id),
+                                              "1 deleted inodes are still allocated"])
+
+
+if __name__ == '__main__':
+    unittest.main()
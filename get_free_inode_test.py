@@ -1,11 +1,17 @@
+import os
+import tempfile
 import unittest
 from FileSystem import FileSystem
-from InodeTable import InodeTable
 
 class MyTest(unittest.TestCase):
-    def TestGetFreeInode(self):
-        print "it should create a new file system, and the first free inode should be the inode 1"
-        with open("FS_test.ext2", "r+b") as test_fs:
-            FileSystem(test_fs)
-            position = InodeTable.get_free_inode_index(test_fs)
-            self.assertEqual(position, 1)
\ No newline at end of file
+    def test_get_free_inode(self):
+        "it should create a new file system, and the first free inode should be the inode 1"
+        handle, path = tempfile.mkstemp(suffix=".ext2")
+        os.close(handle)
+        try:
+            with open(path, "r+b") as test_fs:
+                FileSystem(test_fs, True)._create_file_system()
+                position = FileSystem(test_fs).inode_table.get_free_inode_index()
+                self.assertEqual(position, 1)
+        finally:
+            os.remove(path)
@@ -0,0 +1,77 @@
+import unittest
+from BlockDevice import BlockDevice
+from FileSystemTestCase import FileSystemTestCase
+from InodeBase import Inode
+from InodeTable import InodeTable
+from Settings import Settings
+
+
+class InodeCacheTest(FileSystemTestCase):
+    def read_disk_inode(self, inode_id):
+        superblock = BlockDevice(self.fs_file).superblock
+        with open(self.path, "rb") as image:
+            image.seek(superblock.inode_table_offset + superblock.inode_size * inode_id)
+            return Inode().from_binary(image.read(superblock.inode_size), 0, superblock.version)
+
+    def test_hits_and_misses(self):
+        inode_table = InodeTable(BlockDevice(self.fs_file), 4)
+        inode_table.get_inode(1)
+        inode_table.get_inode(1)
+        inode_table.get_inode(2)
+        stats = inode_table.cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 2)
+
+    def test_lru_eviction_writes_dirty_inode(self):
+        inode_table = InodeTable(BlockDevice(self.fs_file), 2)
+        inode = inode_table.get_inode(5)
+        inode.i_size = 77
+        inode_table.write_inode(5, inode)
+        self.assertEqual(self.read_disk_inode(5).i_size, 0)
+        inode_table.get_inode(6)
+        inode_table.get_inode(5)
+        inode_table.get_inode(7)
+        self.assertEqual(inode_table.cache_stats()['evictions'], 1)
+        self.assertEqual(self.read_disk_inode(5).i_size, 0)
+        inode_table.get_inode(8)
+        self.assertEqual(inode_table.cache_stats()['evictions'], 2)
+        self.assertEqual(self.read_disk_inode(5).i_size, 77)
+
+    def test_flush_coalesces_writes(self):
+        inode_table = InodeTable(BlockDevice(self.fs_file))
+        for inode_id in [3, 4, 9]:
+            inode = inode_table.get_inode(inode_id)
+            inode.i_size = inode_id
+            inode_table.write_inode(inode_id, inode)
+            inode_table.write_inode(inode_id, inode)
+        self.assertEqual(inode_table.cache_stats()['dirty'], 3)
+        inode_table.flush()
+        self.assertEqual(inode_table.cache_stats()['dirty'], 0)
+        for inode_id in [3, 4, 9]:
+            self.assertEqual(self.read_disk_inode(inode_id).i_size, inode_id)
+
+
+class InodeScanTest(FileSystemTestCase):
+    def test_scan_queries(self):
+        self.file_system.write_file("a.txt", "a" * 100)
+        self.file_system.write_file("b.txt", "b" * 10)
+        dir_id = self.file_system.create_directory("d")
+        self.file_system.remove_file("b.txt")
+        scan = self.file_system.inode_table.scan()
+        self.assertEqual(scan.live_files(), [1])
+        self.assertEqual(scan.live_directories(), [0, dir_id])
+        self.assertEqual(scan.deleted(), [2])
+        self.assertEqual(scan.total_size(), 100)
+        self.assertEqual(scan.get_inode(1).i_blocks, self.file_system.inode_table.get_inode(1).i_blocks)
+
+    def test_load_all(self):
+        self.file_system.write_file("a.txt", "a" * 100)
+        inodes = self.file_system.inode_table.load_all()
+        self.assertEqual(len(inodes), Settings.inode_max_elements)
+        self.assertEqual(inodes[1].i_size, 100)
+        self.assertEqual(inodes[0].i_mode, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from Metrics import Metrics
+from utilities import format_stats
+
+
+class MetricsTest(unittest.TestCase):
+    def test_latency_histogram(self):
+        metrics = Metrics()
+        metrics.observe('read_file', 0.00005)
+        metrics.observe('read_file', 0.5)
+        latency = metrics.snapshot()['latencies']['read_file']
+        self.assertEqual(latency['count'], 2)
+        self.assertEqual(latency['max'], 0.5)
+        self.assertEqual(latency['buckets']['0.0001'], 1)
+        self.assertEqual(latency['buckets']['1.0'], 1)
+        self.assertEqual(latency['buckets']['inf'], 0)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {'counters': {}, 'latencies': {}})
+
+
+class FileSystemStatsTest(FileSystemTestCase):
+    def setUp(self):
+        super(FileSystemStatsTest, self).setUp()
+        self.file_system = FileSystem(self.fs_file)
+
+    def test_operations_are_counted_and_timed(self):
+        self.file_system.reset_stats()
+        self.file_system.write_file("a.txt", "x" * 200)
+        with self.file_system.open("a.txt") as reader:
+            self.assertEqual(reader.read(), "x" * 200)
+        stats = self.file_system.stats()
+        self.assertGreaterEqual(stats['counters']['bytes_written'], 200)
+        self.assertGreaterEqual(stats['counters']['bytes_read'], 200)
+        self.assertGreater(stats['counters']['dirent_parses'], 0)
+        self.assertEqual(stats['latencies']['write_file']['count'], 1)
+        self.assertEqual(stats['latencies']['open']['count'], 2)
+        self.assertIn('hits', stats['inode_cache'])
+        self.assertIn('hits', stats['dentry_cache'])
+        self.assertTrue(format_stats(stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from FileSystem import FileSystem
+from InodeBase import Inode
+from Mkfs import make_file_system
+from Settings import Settings
+from SuperBlock import SuperBlock
+
+
+class MkfsTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".ext2")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_image_layout(self):
+        with open(self.path, "wb") as image:
+            image.write("garbage" * 100000)
+        make_file_system(self.path)
+        self.assertEqual(os.path.getsize(self.path), SuperBlock().image_size())
+        with open(self.path, "r+b") as fs_file:
+            file_system = FileSystem(fs_file)
+            inodes = file_system.inode_table.load_all()
+            self.assertEqual(len(inodes), Settings.inode_max_elements)
+            self.assertTrue(all(inode.i_cdate > 0 for inode in inodes))
+            self.assertEqual(file_system.inode_table.get_free_inode_index(), 1)
+            self.assertEqual(file_system.cluster_table.bitmap.count_free(),
+                             Settings.datablock_max_elements - 1)
+            self.assertEqual(file_system.is_directory("/"), (True, 0))
+            file_system.write_file("a.txt", "hello")
+            self.assertEqual(file_system.open("a.txt").read(), "hello")
+
+    def test_data_region_is_sparse(self):
+        make_file_system(self.path)
+        if hasattr(os.stat(self.path), 'st_blocks'):
+            self.assertLess(os.stat(self.path).st_blocks * 512, Settings.datablock_region_size)
+
+    def test_custom_geometry(self):
+        make_file_system(self.path, SuperBlock(4096, 40000, 100))
+        with open(self.path, "r+b") as fs_file:
+            file_system = FileSystem(fs_file)
+            superblock = file_system.device.superblock
+            self.assertEqual((superblock.datablock_size, superblock.datablock_max_elements,
+                              superblock.inode_max_elements), (4096, 40000, 100))
+            self.assertEqual(superblock.datablock_region_offset % 4096, 0)
+            self.assertEqual(file_system.cluster_table.bitmap.count_free(), 39999)
+            # Clusters above 32767 need the 32 bit block pointers
+            file_system.cluster_table.allocate(35000)
+            file_system.write_file("big.txt", "b" * 20000)
+            file_system.flush()
+            blocks = FileSystem(fs_file).inode_table.get_inode(1).i_blocks
+            self.assertEqual(blocks[:5], range(35001, 35006))
+            self.assertEqual(FileSystem(fs_file).open("big.txt").read(), "b" * 20000)
+
+    def test_legacy_image(self):
+        make_file_system(self.path, SuperBlock.legacy())
+        self.assertEqual(os.path.getsize(self.path),
+                         Settings.datablock_region_offset + Settings.datablock_region_size)
+        with open(self.path, "r+b") as fs_file:
+            file_system = FileSystem(fs_file)
+            self.assertEqual(file_system.device.superblock.version, 1)
+            file_system.write_file("a.txt", "a" * 1000)
+            file_system.flush()
+            with open(self.path, "rb") as image:
+                image.seek(Settings.inode_table_offset + Settings.inode_size)
+                self.assertEqual(Inode().from_binary(image.read(Settings.inode_size)).i_size, 1000)
+            self.assertEqual(FileSystem(fs_file).open("a.txt").read(), "a" * 1000)
+
+    def test_invalid_geometry(self):
+        self.assertRaises(ValueError, SuperBlock, 100)
+        self.assertRaises(ValueError, SuperBlock, 8192)
+        self.assertRaises(ValueError, SuperBlock, 64, 1)
+        self.assertRaises(ValueError, SuperBlock, 64, 100, SuperBlock.max_inodes + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
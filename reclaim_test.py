@@ -0,0 +1,90 @@
+import unittest
+from AsyncFileSystem import AsyncFileSystem
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from Fsck import Fsck
+
+
+class ReclaimTest(FileSystemTestCase):
+    def free(self):
+        statfs = self.file_system.statfs()
+        return (statfs['free_clusters'], statfs['free_inodes'])
+
+    def test_remove_frees_inodes_and_clusters(self):
+        free = self.free()
+        self.file_system.create_file("empty.txt")
+        self.file_system.write_file("a.txt", "x" * 5000)
+        self.file_system.write_file("b.txt", "y" * 5000, extents=True)
+        for name in ["empty.txt", "a.txt", "b.txt"]:
+            self.file_system.remove_file(name)
+        self.assertEqual(self.free(), free)
+        self.assertEqual(self.file_system.create_file("c.txt"), 1)
+
+    def test_remove_directory_frees_the_tree(self):
+        free = self.free()
+        self.file_system.create_directory("d")
+        self.file_system.change_directory("d")
+        self.file_system.create_directory("e")
+        for index in xrange(0, 20):
+            self.file_system.write_file("f{0}.txt".format(index), "z" * 300)
+        self.file_system.change_directory("/")
+        self.file_system.remove_directory("d")
+        self.assertEqual(self.free(), free)
+        self.assertEqual(self.file_system.list_names(), ["."])
+
+    def test_overwrite_frees_the_blocks_past_the_end(self):
+        for extents in [False, True]:
+            free = self.free()
+            self.file_system.write_file("a.txt", "x" * 20000, extents=extents)
+            self.file_system.write_file("a.txt", "short")
+            self.assertEqual(self.free(), (free[0] - 1, free[1] - 1))
+            with self.file_system.open("a.txt") as file_reader:
+                self.assertEqual(file_reader.read(), "short")
+            self.file_system.remove_file("a.txt")
+
+    def test_files_open_for_writing_are_freed_on_close(self):
+        free = self.free()
+        file_writer = self.file_system.open("a.txt", "wb")
+        file_writer.write("x" * 2000)
+        file_writer.flush()
+        self.file_system.remove_file("a.txt")
+        self.file_system.write_file("b.txt", "y" * 2000)
+        file_writer.write("z" * 100)
+        file_writer.close()
+        self.assertEqual(self.file_system.open("b.txt").read(), "y" * 2000)
+        self.file_system.remove_file("b.txt")
+        self.assertEqual(self.free(), free)
+        self.file_system.flush()
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+        async_fs = AsyncFileSystem(self.file_system, max_in_flight=1)
+        try:
+            file_writer = async_fs.open("c.txt", "wb").result(5)
+            file_writer.write("x" * 300)
+            async_fs.remove_file("c.txt").result(5)
+            async_fs.close_file(file_writer).result(5)
+        finally:
+            async_fs.close()
+        self.assertEqual(self.free(), free)
+
+    def test_reading_a_removed_file_fails(self):
+        self.file_system.write_file("a.txt", "x" * 500)
+        file_reader = self.file_system.open("a.txt")
+        self.file_system.remove_file("a.txt")
+        self.assertRaises(IOError, file_reader.read)
+
+    def test_readers_of_evicted_inodes_see_the_removal(self):
+        file_system = FileSystem(self.fs_file, inode_cache_size=2)
+        file_system.write_file("a.txt", "a" * 3000)
+        file_reader = file_system.open("a.txt")
+        self.assertEqual(file_reader.read(10), "a" * 10)
+        for index in xrange(0, 20):
+            file_system.write_file("f{0}".format(index), "x")
+        self.assertEqual(file_system.inode_table.cache_stats()['size'], 2)
+        file_system.remove_file("a.txt")
+        # The inode and the clusters of a.txt are used again
+        file_system.write_file("b.txt", "b" * 3000)
+        self.assertRaises(IOError, file_reader.read)
+
+
+if __name__ == '__main__':
+    unittest.main()
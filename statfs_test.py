@@ -0,0 +1,86 @@
+import struct
+import unittest
+from BlockDevice import BlockDevice
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from Fsck import Fsck
+from SuperBlock import SuperBlock
+
+
+class StatfsTest(FileSystemTestCase):
+    def counted(self):
+        "Free clusters and inodes counted in the bitmaps"
+        superblock = self.file_system.device.superblock
+        return (self.file_system.cluster_table.bitmap.count_free(
+                    0, superblock.datablock_max_elements),
+                self.file_system.inode_table.bitmap.count_free(0, superblock.inode_max_elements))
+
+    def test_counters_follow_the_bitmaps(self):
+        statfs = self.file_system.statfs()
+        self.assertEqual((statfs['free_clusters'], statfs['free_inodes']), (65535, 1023))
+        self.file_system.create_directory("d")
+        self.file_system.write_file("a.txt", "x" * 5000)
+        self.file_system.write_file("b.txt", "y" * 3000, extents=True)
+        self.file_system.write_file("a.txt", "short")
+        self.file_system.remove_file("b.txt")
+        statfs = self.file_system.statfs()
+        self.assertEqual((statfs['free_clusters'], statfs['free_inodes']), self.counted())
+        self.assertEqual(statfs['free_bytes'], statfs['free_clusters'] * 64)
+
+    def test_statfs_doesnt_read_the_image(self):
+        self.file_system.write_file("a.txt", "x" * 5000)
+        self.file_system.flush()
+        self.fs_file.close()
+        self.fs_file = open(self.path, "r+b")
+        device = BlockDevice(self.fs_file)
+        self.file_system = FileSystem(device)
+        # 79 data blocks and 6 indirect blocks
+        self.assertEqual(device.superblock.free_clusters, 65535 - 85)
+        reads = self.file_system.metrics.snapshot()['counters'].get('reads', 0)
+        self.file_system.statfs()
+        self.assertEqual(self.file_system.metrics.snapshot()['counters'].get('reads', 0), reads)
+
+    def test_images_without_counters(self):
+        self.file_system.write_file("a.txt", "x" * 5000)
+        self.file_system.flush()
+        # Clear the feature and the counters, like an image written before them
+        superblock = self.file_system.device.superblock
+        superblock.features = 0
+        superblock.free_clusters = superblock.free_inodes = 0
+        superblock.write(self.file_system.device)
+        self.file_system.device.sync()
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+        self.file_system = FileSystem(self.fs_file)
+        self.assertEqual((superblock.free_clusters, superblock.free_inodes), (0, 0))
+        statfs = self.file_system.statfs()
+        self.assertEqual((statfs['free_clusters'], statfs['free_inodes']), self.counted())
+        self.file_system.flush()
+        values = struct.unpack_from(SuperBlock._sb_mask, self.file_system.device.read(0, 68))
+        self.assertEqual(values[-4:], (SuperBlock.free_counts_feature, 512, 65535 - 85, 1022))
+
+    def test_short_legacy_images(self):
+        superblock = SuperBlock.legacy()
+        self.file_system._create_file_system(superblock)
+        self.file_system.create_directory("d")
+        self.file_system.write_file("a.txt", "x" * 500)
+        self.file_system.flush()
+        # Older versions wrote one inode less at the end of the image
+        self.fs_file.truncate(superblock.image_size() - superblock.inode_size)
+        self.fs_file.flush()
+        self.file_system = FileSystem(open(self.path, "r+b"))
+        statfs = self.file_system.statfs()
+        self.assertEqual((statfs['free_clusters'], statfs['free_inodes']), self.counted())
+        self.assertEqual(statfs['free_inodes'], 1024 - 3)
+        self.file_system.device.file_object.close()
+
+    def test_fsck_repairs_the_counters(self):
+        self.file_system.device.superblock.change_free(clusters=-5)
+        self.file_system.flush()
+        report = Fsck(self.path, 1).run(repair=True)
+        self.assertEqual(report['problems'],
+                         ["The superblock counts 65530 free clusters, the bitmap 65535"])
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import threading
+import unittest
+from BlockDevice import BlockDevice
+from FileSystem import FileSystem
+from FileSystemTestCase import FileSystemTestCase
+from RWLock import RWLock
+
+
+class RWLockTest(unittest.TestCase):
+    def test_readers_share_the_lock(self):
+        lock = RWLock()
+        inside = threading.Event()
+        release = threading.Event()
+
+        def reader():
+            with lock.read_locked():
+                inside.set()
+                release.wait(5)
+        thread = threading.Thread(target=reader)
+        thread.start()
+        self.assertTrue(inside.wait(5))
+        with lock.read_locked():
+            pass
+        release.set()
+        thread.join()
+
+    def test_writer_excludes_readers(self):
+        lock = RWLock()
+        events = list()
+        lock.acquire_write()
+
+        def reader():
+            with lock.read_locked():
+                events.append("read")
+        thread = threading.Thread(target=reader)
+        thread.start()
+        thread.join(0.05)
+        events.append("write")
+        lock.release_write()
+        thread.join()
+        self.assertEqual(events, ["write", "read"])
+
+    def test_reentrancy(self):
+        lock = RWLock()
+        with lock.write_locked():
+            with lock.write_locked():
+                with lock.read_locked():
+                    pass
+        with lock.read_locked():
+            with lock.read_locked():
+                self.assertRaises(RuntimeError, lock.acquire_write)
+        self.assertRaises(RuntimeError, lock.release_write)
+
+
+class ConcurrentFileSystemTest(FileSystemTestCase):
+    threads = 8
+
+    def setUp(self):
+        super(ConcurrentFileSystemTest, self).setUp()
+        self.file_system = FileSystem(BlockDevice(self.fs_file, use_mmap=False))
+        self.errors = list()
+
+    def run_threads(self, target):
+        def guarded(index):
+            try:
+                target(index)
+            except Exception as error:
+                self.errors.append(error)
+        threads = [threading.Thread(target=guarded, args=(index,))
+                   for index in xrange(0, ConcurrentFileSystemTest.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.errors, [])
+
+    def data(self, index):
+        return "".join(chr(65 + (index + position) % 26) for position in xrange(700 + index * 50))
+
+    def test_writers_and_readers_of_different_files(self):
+        def work(index):
+            file_system = self.file_system.handle()
+            file_system.create_directory("d{0}".format(index))
+            file_system.change_directory("d{0}".format(index))
+            for _ in xrange(0, 10):
+                file_system.write_file("f.txt", self.data(index))
+                self.assertEqual(file_system.open("f.txt").read(), self.data(index))
+            self.assertEqual(file_system.working_dir, "/d{0}".format(index))
+        self.run_threads(work)
+        for index in xrange(0, ConcurrentFileSystemTest.threads):
+            self.assertEqual(self.file_system.open("/d{0}/f.txt".format(index)).read(),
+                             self.data(index))
+
+    def test_readers_of_a_file_being_rewritten(self):
+        versions = ["a" * 1000, "b" * 1000]
+        self.file_system.write_file("shared.txt", versions[0])
+
+        def work(index):
+            for repetition in xrange(0, 10):
+                if index == 0:
+                    self.file_system.write_file("shared.txt", versions[repetition % 2])
+                else:
+                    self.assertIn(self.file_system.open("shared.txt").read(), versions)
+        self.run_threads(work)
+
+    def test_handle_has_its_own_working_directory(self):
+        self.file_system.create_directory("a")
+        handle = self.file_system.handle()
+        handle.change_directory("a")
+        self.assertEqual(handle.working_dir, "/a")
+        self.assertEqual(self.file_system.working_dir, "")
+        handle.write_file("f.txt", "x")
+        self.assertEqual(self.file_system.open("/a/f.txt").read(), "x")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+from FileSystemTestCase import FileSystemTestCase
+from Fsck import Fsck
+from InodeBase import Inode
+from SuperBlock import SuperBlock
+from Transfer import Transfer
+
+
+class TransferTest(FileSystemTestCase):
+    def setUp(self):
+        super(TransferTest, self).setUp()
+        self.host_dir = tempfile.mkdtemp()
+        self.files = {
+            "a.txt": "a" * 100,
+            "empty": "",
+            os.path.join("d", "b.txt"): "".join(chr(index % 256) for index in xrange(5000)),
+            os.path.join("d", "e", "c.txt"): "c" * 3000,
+        }
+        os.makedirs(os.path.join(self.host_dir, "in", "d", "e"))
+        os.makedirs(os.path.join(self.host_dir, "in", "f"))
+        for name, data in self.files.iteritems():
+            with open(os.path.join(self.host_dir, "in", name), "wb") as host_file:
+                host_file.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.host_dir)
+        super(TransferTest, self).tearDown()
+
+    def test_import_and_export(self):
+        transfer = Transfer(self.file_system, threads=2, window=2)
+        report = transfer.import_tree(os.path.join(self.host_dir, "in"), "/x/y")
+        # x, y, d, e and f are created
+        self.assertEqual((report['files'], report['directories'], report['bytes']),
+                         (4, 5, 8100))
+        self.assertEqual(self.file_system.open("/x/y/d/e/c.txt").read(), "c" * 3000)
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+        report = transfer.export_tree("/x/y", os.path.join(self.host_dir, "out"))
+        self.assertEqual((report['files'], report['directories'], report['bytes']),
+                         (4, 4, 8100))
+        for name, data in self.files.iteritems():
+            with open(os.path.join(self.host_dir, "out", name), "rb") as host_file:
+                self.assertEqual(host_file.read(), data)
+        self.assertTrue(os.path.isdir(os.path.join(self.host_dir, "out", "f")))
+
+    def test_files_are_contiguous_and_overwritten(self):
+        self.file_system.change_directory("/")
+        self.file_system.write_file("a.txt", "old" * 1000)
+        Transfer(self.file_system, extents=True).import_tree(os.path.join(self.host_dir, "in"))
+        self.assertEqual(self.file_system.open("a.txt").read(), "a" * 100)
+        self.file_system.change_directory("d")
+        inode = self.file_system.inode_table.get_inode(self.file_system.is_file("b.txt")[1])
+        # A single extent for the 79 blocks
+        self.assertTrue(inode.i_flags & Inode.extents_flag)
+        self.assertEqual(inode.i_blocks[1], 79)
+        self.assertEqual(inode.i_blocks[2:], [0] * 13)
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+        self.assertRaises(IOError, Transfer(self.file_system).export_tree, "/missing", self.host_dir)
+
+    def test_full_directories_fail_with_the_path(self):
+        # The legacy directories have no indirect blocks
+        self.file_system._create_file_system(SuperBlock.legacy())
+        many = os.path.join(self.host_dir, "many")
+        os.makedirs(many)
+        for index in xrange(0, 200):
+            with open(os.path.join(many, "file{0:03}".format(index)), "wb") as host_file:
+                host_file.write("x" * 10)
+        with self.assertRaises(IOError) as context:
+            Transfer(self.file_system).import_tree(many, "/many")
+        self.assertIn("Cannot import '/many/file", str(context.exception))
+        self.assertIn("Directory is full", str(context.exception))
+        self.assertEqual(Fsck(self.path, 1).run()['problems'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
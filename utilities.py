@@ -1,8 +1,11 @@
 "Some utilities functions"
 
 import calendar
+import logging
 import time
-from Settings import Settings
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 def split_path_and_file(path):
     "Returns the given path and file name as a tuple, (dir_path, file_name)"
@@ -14,18 +17,60 @@ def split_path_and_file(path):
         else:
             dir_path = path
             file_name = None
-        print 'Dir: {0}, file:{1}'.format(dir_path, file_name)
+        logger.debug('Dir: %s, file:%s', dir_path, file_name)
         return (dir_path, file_name)
     return ('.', file_name)
 
-def get_cluster_offset(block_id):
-        '''
-        Returns the Cluster offset in the whole storage device.
-        '''
-        return Settings.datablock_region_offset + (block_id * Settings.datablock_size)
-
 def get_current_time_seconds():
     '''
     Returns the unix time
     '''
-    return calendar.timegm(time.gmtime())
\ No newline at end of file
+    return calendar.timegm(time.gmtime())
+
+def format_stats(stats):
+    '''
+    Returns the File System stats as printable lines.
+    '''
+    lines = ['I/O counters:']
+    for name, value in sorted(stats['counters'].iteritems()):
+        lines.append('  {0}: {1}'.format(name, value))
+    lines.append('Latencies (ms):')
+    for operation, latency in sorted(stats['latencies'].iteritems()):
+        lines.append('  {0}: count={1} mean={2:.3f} max={3:.3f}'.format(
+            operation, latency['count'], latency['mean'] * 1000, latency['max'] * 1000))
+    for cache in ['inode_cache', 'dentry_cache', 'buffer_cache']:
+        lines.append('{0}: {1}'.format(cache, ', '.join(
+            '{0}={1}'.format(name, value) for name, value in sorted(stats[cache].iteritems()))))
+    return lines
+
+def format_statfs(statfs):
+    '''
+    Returns the File System free space as printable lines, like df.
+    '''
+    lines = ['{0:<10}{1:>12}{2:>12}{3:>12}{4:>6}'.format('', 'Total', 'Used', 'Free', 'Use%')]
+    for name, total, free in [('Blocks', statfs['clusters'], statfs['free_clusters']),
+                              ('Inodes', statfs['inodes'], statfs['free_inodes']),
+                              ('Bytes', statfs['size'], statfs['free_bytes'])]:
+        lines.append('{0:<10}{1:>12}{2:>12}{3:>12}{4:>5}%'.format(
+            name, total, total - free, free, 100 * (total - free) // total))
+    return lines
+
+def format_transfer(command, report):
+    '''
+    Returns the report of an import or an export as a printable line.
+    '''
+    return '{0}: {1} files, {2} directories, {3} bytes in {4:.1f} ms'.format(
+        command, report['files'], report['directories'], report['bytes'],
+        report['seconds'] * 1000)
+
+def to_runs(block_ids):
+    '''
+    Groups the block ids in (first id, length) runs of consecutive ids.
+    '''
+    runs = list()
+    for block_id in block_ids:
+        if runs and runs[-1][0] + runs[-1][1] == block_id:
+            runs[-1][1] += 1
+        else:
+            runs.append([block_id, 1])
+    return [tuple(run) for run in runs]